@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+分析流程 (与界面无关的部分)
+
+界面 (main.py) 与命令行批量分析共用：后台备份、A 列回写、缺料时间线。
+
+analyze_files 一次分析多个排程文件 (如共享目录中各车间各一份)：
+1. 所有文件在一个后台线程中依次备份，同时在进程池中并行解析 (openpyxl 扫描是纯 Python，按文件并行)；
+2. 所有文件的工单键合并去重后只查询一次 ERP (BOM 与库存)，
+   总耗时随不重复的 ERP 数据量增长，而不是随文件数；
+3. 每个文件各自从完整库存开始推演 (与在界面中逐个分析的结果相同)，回写 A 列并另存缺料时间线；
+   分析全部车间时可另存车间汇总 (workshop_summary)，一次推演得到各车间的齐套情况。
+单个文件解析、备份或写入失败只影响该文件。
+
+命令行入口见 main.py：python main.py batch <文件/目录/通配符> ... --start 2026-10-19 --end 2026-10-25
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from backup_store import BackupStore
+
+RESULT_FONT = ("微软雅黑", 9)       # A 列结果字体
+PLAN_SUFFIXES = (".xlsx", ".xlsm")
+
+
+def start_backups(jobs):
+    """
+    在一个后台线程中依次备份 [(BackupStore, 文件路径)]，返回对应的 Future 列表 (结果为备份记录)。
+    同一目录的文件共用一份 manifest，依次执行可避免并发改写。
+    """
+    futs = [Future() for _ in jobs]
+
+    def run():
+        for (store, path), fut in zip(jobs, futs):
+            try:
+                fut.set_result(store.backup(path))
+            except BaseException as e:
+                fut.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return futs
+
+
+def write_results(path, sheet, results, formatter=None):
+    """
+    把推演结果写入 A 列 (只改写该工作表 XML，先写临时文件再整体替换)，返回写入行数。
+    formatter 为结果 -> A 列文字，默认 format_result (逐日推演用 format_daily_result)。
+    """
+    from kitting_engine import format_result
+    from plan_workbook import restamp_plan
+    from xlsx_patch import write_column_a
+    formatter = formatter or format_result
+    values = {r['row_idx']: formatter(r) for r in results}
+    write_column_a(path, sheet, values, font_name=RESULT_FONT[0], font_size=RESULT_FONT[1])
+    restamp_plan(path, sheet)
+    return len(values)
+
+
+def write_timeline(path, wo_list, store, inv0):
+    """按品号反查缺料并另存到排程文件旁；返回 (时间线, 输出路径)，没有缺料时不写文件、路径为 None。"""
+    from kitting_engine import shortage_timeline
+    from shortage_report import write_shortage_workbook, sidecar_path
+    timeline = shortage_timeline(wo_list, store, inv0)
+    if not timeline:
+        return timeline, None
+    out = sidecar_path(path)
+    write_shortage_workbook(out, timeline)
+    return timeline, out
+
+
+def workshop_summary(wo_list, results, timeline=None, top=20):
+    """
+    按车间汇总一次推演的结果。wo_list 与 results 一一对应 (工单带 'workshop')，timeline 为同一次推演的缺料时间线。
+    每个车间一项 (按在排程中首次出现的行排列)，最后一项为合计 (车间名 "合计")：
+    rows 排产行数、orders 工单数、kitted / short / error 齐套 / 缺料 / 异常 (无 ERP 信息) 行数、
+    daily_short 当日缺料行数、rate_bins 齐套率分布 (与 RATE_BINS 对应，按 A 列显示的百分比分档，不含异常行)、
+    short_parts 缺料品号数、top 缺量最大的 top 个品号 [(品号, 品名, 单位, 缺量, 受阻行数, 首次缺料日期, 首次缺料行号)]。
+    缺料品号取自时间线的受阻工单 (含多阶展开出的下阶品号)；timeline 为 None 时 short_parts 为 None、top 为空。
+    """
+    from shortage_report import RATE_BINS
+    total = "合计"
+    stats, first_row, ws_of = {}, {}, {}
+
+    def entry(ws):
+        s = stats.get(ws)
+        if s is None:
+            s = stats[ws] = {'workshop': ws, 'rows': 0, 'orders': set(), 'kitted': 0, 'short': 0, 'error': 0,
+                             'daily_short': 0, 'rate_bins': [0] * len(RATE_BINS), 'short_parts': None, 'top': []}
+        return s
+
+    for item, r in zip(wo_list, results):
+        ws = item['workshop']
+        ws_of[item['row_idx']] = ws
+        first_row[ws] = min(first_row.get(ws, item['row_idx']), item['row_idx'])
+        for s in (entry(ws), entry(total)):
+            s['rows'] += 1
+            s['orders'].add(item['wo_key'])
+            if r['daily_status'] == "异常":
+                s['error'] += 1
+                continue
+            s['daily_short'] += r['daily_status'] == "缺料"
+            if r['rate'] >= 1:
+                s['kitted'] += 1
+                pct = 100
+            else:
+                s['short'] += 1
+                pct = min(round(r['rate'] * 100), 99)     # 与 A 列显示的百分比一致；缺料行不进 100% 档
+            s['rate_bins'][next(k for k, (lo, _) in enumerate(RATE_BINS) if pct >= lo)] += 1
+
+    if timeline is not None:
+        # (车间, 品号) -> [时间线记录, 缺量, 受阻行, 首次缺料日期, 首次缺料行号]；blocked 已按推演先后排列
+        agg = {}
+        for rec in timeline:
+            for d, _, row, _, _, short in rec['blocked']:
+                for ws in (ws_of.get(row), total):
+                    a = agg.get((ws, rec['part']))
+                    if a is None:
+                        a = agg[(ws, rec['part'])] = [rec, 0.0, set(), d, row]
+                    a[1] += short
+                    a[2].add(row)
+        by_ws = {}
+        for (ws, _), a in agg.items():
+            by_ws.setdefault(ws, []).append(a)
+        for ws, s in stats.items():
+            parts = sorted(by_ws.get(ws, ()), key=lambda a: -a[1])
+            s['short_parts'] = len(parts)
+            s['top'] = [(rec['part'], rec['name'], rec['unit'], short, len(rows), d, row)
+                        for rec, short, rows, d, row in parts[:top]]
+
+    out = [stats[ws] for ws in sorted(first_row, key=first_row.get)]
+    if total in stats:
+        out.append(stats[total])
+    for s in out:
+        s['orders'] = len(s['orders'])
+    return out
+
+
+def summary_lines(summary):
+    """车间汇总的日志摘要，每个车间一行。"""
+    from shortage_report import kit_percent
+    lines = []
+    for s in summary:
+        pct = kit_percent(s)
+        lines.append(f"{s['workshop']}: {s['rows']} 行, 齐套 {s['kitted']}, 缺料 {s['short']} "
+                     f"(当日缺料 {s['daily_short']}), 异常 {s['error']}"
+                     + (f", 齐套率 {pct:g}%" if pct is not None else ""))
+    return lines
+
+
+def write_summary(path, wo_list, results, timeline=None):
+    """按车间汇总并另存到排程文件旁；返回 (汇总, 输出路径)，没有工单时不写文件、路径为 None。"""
+    from shortage_report import write_workshop_workbook, workshop_sidecar_path
+    summary = workshop_summary(wo_list, results, timeline)
+    if not summary:
+        return summary, None
+    out = workshop_sidecar_path(path)
+    write_workshop_workbook(out, summary)
+    return summary, out
+
+
+def expand_paths(patterns):
+    """
+    文件 / 目录 / 通配符展开为排程文件列表 (去重，保持顺序)。
+    目录与通配符只取 .xlsx / .xlsm，并跳过 Excel 锁文件 (~$) 与本程序生成的缺料时间线 / 逐日齐套表 / 车间汇总。
+    """
+    import glob
+    from shortage_report import DAILY_SUFFIX, SIDECAR_SUFFIX, WORKSHOP_SUFFIX
+    out = {}
+    for pat in patterns:
+        if os.path.isdir(pat):
+            found = [os.path.join(pat, n) for n in sorted(os.listdir(pat))]
+        elif any(c in pat for c in "*?["):
+            found = sorted(glob.glob(pat))
+        else:
+            found = None
+        if found is None:
+            paths = [pat]   # 明确给出的文件原样保留，不存在时在分析中报错
+        else:
+            paths = [p for p in found if os.path.isfile(p) and p.lower().endswith(PLAN_SUFFIXES)
+                     and not os.path.basename(p).startswith("~$") and not p.endswith((SIDECAR_SUFFIX, DAILY_SUFFIX, WORKSHOP_SUFFIX))]
+        for p in paths:
+            p = os.path.abspath(p)
+            out.setdefault(os.path.normcase(p), p)
+    return list(out.values())
+
+
+def parse_plan(path, sheet, start_date, end_date, workshop):
+    """
+    扫描排程并提取日期范围内的工单，按 (开工日期, 行号) 排序。在进程池中执行，返回值可 pickle。
+    sheet 为 None 时取第一个工作表。返回 (工作表名, 工单列表, 计数)。
+    """
+    from plan_workbook import load_plan, sheet_names
+    t0 = time.perf_counter()
+    sheet = sheet or sheet_names(path)[0]
+    model = load_plan(path, sheet)
+    wo_list = model.extract(start_date, end_date, workshop)
+    wo_list.sort(key=lambda x: (x['start_date'], x['row_idx']))
+    return sheet, wo_list, {'plan_rows': len(model.row_idx), 'date_cols': len(model.date_cols),
+                            'seconds': round(time.perf_counter() - t0, 3)}
+
+
+def _parse_all(jobs, args, workers, log):
+    n = min(len(jobs), workers or os.cpu_count() or 1)
+    if n > 1:
+        with ProcessPoolExecutor(n) as ex:
+            futs = [ex.submit(parse_plan, j['path'], *args) for j in jobs]
+            outcomes = []
+            for f in futs:
+                try:
+                    outcomes.append((f.result(), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+    else:
+        outcomes = []
+        for j in jobs:
+            try:
+                outcomes.append((parse_plan(j['path'], *args), None))
+            except Exception as e:
+                outcomes.append((None, e))
+
+    for j, (res, err) in zip(jobs, outcomes):
+        name = os.path.basename(j['path'])
+        if err is not None:
+            j['error'] = f"解析失败: {err}"
+            log(f"{name}: {j['error']}")
+            continue
+        j['sheet'], j['wo_list'], counts = res
+        j['orders'] = len(j['wo_list'])
+        if not j['wo_list']:
+            j['status'] = "no_data"
+        log(f"{name} [{j['sheet']}]: {counts['plan_rows']} 行有排产, 范围内 {j['orders']} 张工单 "
+            f"({counts['seconds']:.2f}s)")
+
+
+def analyze_files(paths, fetch, start_date, end_date, workshop, sheet=None, workers=0, backup=True,
+                  timeline=True, summary=False, keep_last=30, keep_days=14, report=None, log=print, simulate=None):
+    """
+    批量分析多个排程文件。
+    fetch(工单键列表) -> (BomStore 或工单数据 dict, {品号: 库存})，整批只调用一次。
+    workers: 解析进程数，0 为 min(文件数, CPU 核数)；report: 可选的 RunReport (由调用方 start/stop)。
+    summary: 每个文件另存车间汇总 (见 workshop_summary)。
+    simulate(工单列表, BomStore, 库存 dict) -> 结果：推演引擎 (按开工顺序整单锁定的各引擎之一，库存 dict 被写回)，
+    默认数组版引擎。逐日推演的输出不同，不经此流程 (batch_main 遇到 SIM_TIME_PHASED 直接报错)。
+    返回每个文件一条 dict：path, sheet, status ("ok" / "no_data" / "error"), orders, rows_written,
+    short_parts (None 为未生成), timeline / summary (输出路径), error。
+    """
+    from kitting_engine import BomStore, simulate_kitting_vectorized
+    begin = report.begin if report is not None else (lambda name: None)
+    count = report.count if report is not None else (lambda **kw: None)
+    jobs = [{'path': p, 'sheet': sheet, 'status': "error", 'orders': 0, 'rows_written': 0,
+             'short_parts': None, 'timeline': None, 'summary': None, 'error': None, 'wo_list': None} for p in paths]
+
+    backups = {}
+    try:
+        begin("备份与解析")
+        if backup:
+            pairs = []
+            for j in jobs:
+                if os.path.isfile(j['path']):
+                    pairs.append((BackupStore.for_file(j['path'], keep_last=keep_last, keep_days=keep_days),
+                                  j['path']))
+            backups = dict(zip((p for _, p in pairs), start_backups(pairs)))
+        _parse_all(jobs, (sheet, start_date, end_date, workshop), workers, log)
+        ready = [j for j in jobs if j['wo_list']]
+        count(files=len(jobs), parsed=sum(j['wo_list'] is not None for j in jobs),
+              orders=sum(j['orders'] for j in jobs))
+
+        begin("查询ERP数据")
+        keys = list(dict.fromkeys(w['wo_key'] for j in ready for w in j['wo_list']))
+        count(unique_orders=len(keys))
+        if not keys:
+            log("所有文件的日期范围内都没有排产数量 > 0 的工单。")
+            return _strip(jobs)
+        log(f"{len(ready)} 个文件共 {sum(j['orders'] for j in ready)} 行工单, 去重后 {len(keys)} 张, 查询ERP数据...")
+        wo_data, inventory = fetch(keys)
+        store = wo_data if isinstance(wo_data, BomStore) else BomStore.from_wo_data(wo_data)
+        count(erp_orders=store.n_orders, bom_lines=store.n_lines, parts=len(store.parts))
+        log(f"ERP 数据就绪: {store.n_orders} 张工单, {len(inventory)} 个品号库存")
+
+        begin("推演")
+        simulate = simulate or simulate_kitting_vectorized
+        for j in ready:
+            # 各文件独立从完整库存开始扣减
+            j['results'] = simulate(j['wo_list'], store, dict(inventory))
+
+        begin("回写A列")
+        written = 0
+        for j in ready:
+            name = os.path.basename(j['path'])
+            try:
+                if backup:
+                    backups[j['path']].result()
+                j['rows_written'] = write_results(j['path'], j['sheet'], j['results'])
+                j['status'] = "ok"
+                written += j['rows_written']
+            except Exception as e:
+                j['error'] = f"未保存: {e}"
+                log(f"{name}: {j['error']}")
+        count(files_written=sum(j['status'] == "ok" for j in jobs), rows_written=written)
+
+        if timeline or summary:
+            begin("附带报表")
+            inv0 = store.inventory_vector(inventory)
+            for j in ready:
+                if j['status'] != "ok": continue
+                name = os.path.basename(j['path'])
+                tl = None
+                if timeline:
+                    try:
+                        tl, j['timeline'] = write_timeline(j['path'], j['wo_list'], store, inv0)
+                        j['short_parts'] = len(tl)
+                    except Exception as e:
+                        log(f"{name}: 缺料时间线写入失败 (文件是否已被打开?): {e}")
+                if summary:
+                    try:
+                        _, j['summary'] = write_summary(j['path'], j['wo_list'], j['results'], tl)
+                    except Exception as e:
+                        log(f"{name}: 车间汇总写入失败 (文件是否已被打开?): {e}")
+        return _strip(jobs)
+    finally:
+        # 出错提前返回时也等备份写完，不留下临时文件
+        for fut in backups.values():
+            fut.exception()
+
+
+def _strip(jobs):
+    for j in jobs:
+        j.pop('wo_list', None)
+        j.pop('results', None)
+    return jobs
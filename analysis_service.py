@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""
+分析服务 (常驻进程)
+
+各计划员的界面程序每次分析都要冷启动 Python / pandas / ODBC，再各自向 FQD 查询大体相同的工单与库存。
+服务模式由一个常驻进程统一持有：
+- ERP 连接池与内存中的工单 BOM / 库存快照 (Snapshot)。后台线程按间隔刷新：库存每 inv_interval 秒，
+  工单 BOM 每 bom_interval 秒 (经本地 ErpCache 时只重新拉取有变化的工单)；
+- 请求中快照没有的工单只补查这一部分并入快照；超过 idle_days 天无人请求的工单在刷新时移出。
+单次请求只剩解析排程与推演的时间；ERP 查询量只取决于刷新间隔和新出现的工单，与客户端数量无关。
+
+HTTP 接口 (JSON，UTF-8)：
+  GET  /status    快照规模、刷新时间、请求计数
+  POST /refresh   立即全部刷新
+  POST /analyze   分析一个排程，请求字段：
+      path        服务端可访问的排程路径；或 workbook: 文件内容 (base64) + name: 文件名
+      sheet       工作表 (默认第一个)；start / end: YYYY-MM-DD；workshop: 车间 (默认全部车间)
+      write       仅 path 方式：由服务备份并回写 A 列、另存缺料时间线 (同一文件的回写请求依次进行)；否则只返回结果
+      timeline    是否计算缺料时间线 (默认是)；force: 先重新查询这些工单 (忽略快照与本地缓存)
+      summary     是否按车间汇总 (默认否，write 时另存车间汇总)
+    返回 {status, sheet, orders, results: [[行号, A列文字]], timeline, summary, short_parts, rows_written, seconds}
+访问控制：path 方式 (读取并可能改写服务端文件) 只接受 plan_roots 目录下的排程，未配置 plan_roots 时只能上传；
+配置了 token 时每个请求都须带请求头 X-Service-Token，否则返回 403。
+推演用数组版引擎 (服务端挂接了品号 BOM 时含多阶展开)；逐日推演仍在本机进行。
+
+启动：python main.py serve (见 main.py 的 SERVICE_* 配置)；界面设置 ANALYSIS_SERVICE_URL 后改由服务分析，
+服务无法连接时自动改为本机分析。
+"""
+import base64
+import datetime
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from analysis_pipeline import (PLAN_SUFFIXES, parse_plan, start_backups, workshop_summary, write_results,
+                               write_summary, write_timeline)
+from backup_store import BackupStore
+
+GZIP_MIN_BYTES = 64 * 1024      # 响应超过此大小且客户端接受时 gzip 压缩
+TOKEN_HEADER = "X-Service-Token"
+
+
+class ServiceError(Exception):
+    """分析服务返回错误 (请求有误、ERP 查询失败等)。"""
+
+
+class ServiceUnavailable(ServiceError):
+    """无法连接分析服务。"""
+
+
+class Forbidden(Exception):
+    """请求不被允许 (口令不符、排程路径不在开放目录下)，服务端返回 403。"""
+
+
+class Snapshot:
+    """
+    内存中的 ERP 快照。
+    fetch(工单键列表, force) -> (BomStore, {品号: 库存})；fetch_inventory(品号列表) -> {品号: 库存}。
+    (store, 库存, 库存向量) 只整体替换、从不原地修改，推演线程取到引用后无需加锁；ERP 查询 (补查与刷新) 依次进行。
+    """
+
+    def __init__(self, fetch, fetch_inventory, bom_interval=4 * 3600, inv_interval=15 * 60, idle_days=3,
+                 tick=30, log=print):
+        self.fetch = fetch
+        self.fetch_inventory = fetch_inventory
+        self.bom_interval = bom_interval
+        self.inv_interval = inv_interval
+        self.idle_days = idle_days
+        self.tick = tick            # 后台线程检查是否到期的间隔 (秒)
+        self.log = log
+        self.view = (None, {}, None)
+        self.keys = set()           # 已查询过的工单键 (含 ERP 中不存在的)
+        self.last_used = {}         # 工单键 -> 最近一次被请求的时间
+        self.bom_at = self.inv_at = 0.0
+        self.erp_fetches = 0
+        self.last_error = None
+        self._lock = threading.Lock()           # 保护 last_used
+        self._fetch_lock = threading.Lock()     # ERP 查询依次进行
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _swap(self, store, inventory):
+        inv0 = store.inventory_vector(inventory) if store is not None else None
+        self.view = (store, inventory, inv0)
+
+    def get(self, keys, force=False):
+        """
+        返回包含 keys 的 (BomStore, 库存, 库存向量) 与补查的工单数。
+        快照中没有的工单先补查并入快照；force 时这些工单全部重新查询并替换快照中的旧数据。
+        """
+        now = time.time()
+        with self._lock:
+            for k in keys:
+                self.last_used[k] = now
+        with self._fetch_lock:
+            need = list(keys) if force else [k for k in keys if k not in self.keys]
+            if need:
+                store, inventory = self.fetch(need, force)
+                self.erp_fetches += 1
+                old_store, old_inv, _ = self.view
+                if old_store is not None:
+                    # 新数据在前：merged 只补入 old_store 中 store 没有的工单
+                    store, inventory = store.merged(old_store), {**old_inv, **inventory}
+                self._swap(store, inventory)
+                self.keys.update(need)
+            return self.view, len(need)
+
+    def refresh(self, force=False):
+        """全部重新查询：超过 idle_days 天没人请求的工单移出，其余工单的 BOM 与库存整体替换。"""
+        with self._fetch_lock:
+            self._refresh(force)
+
+    def _refresh(self, force=False):
+        now = time.time()
+        cutoff = now - self.idle_days * 86400
+        with self._lock:
+            for k in [k for k, t in self.last_used.items() if t < cutoff]:
+                del self.last_used[k]
+            active = list(self.last_used)
+        if active:
+            t0 = time.perf_counter()
+            store, inventory = self.fetch(active, force)
+            self.erp_fetches += 1
+            self._swap(store, inventory)
+            self.log(f"快照已刷新: {store.n_orders} 张工单, {len(inventory)} 个品号库存 "
+                     f"({time.perf_counter() - t0:.1f}s)")
+        else:
+            self._swap(None, {})
+        self.keys = set(active)
+        self.bom_at = self.inv_at = now
+
+    def _refresh_inventory(self):
+        now = time.time()
+        store = self.view[0]
+        if store is not None:
+            t0 = time.perf_counter()
+            inventory = self.fetch_inventory(list(store.parts.values))
+            self.erp_fetches += 1
+            self._swap(store, inventory)
+            self.log(f"库存已刷新: {len(inventory)} 个品号 ({time.perf_counter() - t0:.1f}s)")
+        self.inv_at = now
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            now = time.time()
+            try:
+                with self._fetch_lock:
+                    if now - self.bom_at >= self.bom_interval:
+                        self._refresh()
+                    elif now - self.inv_at >= self.inv_interval:
+                        self._refresh_inventory()
+            except Exception as e:
+                # 刷新失败时继续使用旧快照，下一个检查周期重试
+                traceback.print_exc()
+                self.last_error = f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} {e}"
+                self.log(f"快照刷新失败 (继续使用旧快照): {e}")
+
+
+class AnalysisService:
+    """
+    snapshot: Snapshot；keep_last / keep_days: write 方式回写前备份的保留策略 (见 BackupStore)。
+    plan_roots: 允许 path 方式访问的目录 (含子目录)，为空时只接受上传；token: 非空时请求须带相同的 X-Service-Token。
+    上传的排程按内容哈希存入临时目录，同一内容再次上传 (如只改日期范围重新分析) 时直接复用已解析的排程模型；
+    最多保留 upload_keep 份。
+    """
+
+    def __init__(self, snapshot, keep_last=30, keep_days=14, upload_keep=32, plan_roots=(), token="", log=print):
+        self.snapshot = snapshot
+        self.plan_roots = [os.path.normcase(os.path.realpath(r)) for r in plan_roots]
+        self.token = token or ""
+        self.keep_last = keep_last
+        self.keep_days = keep_days
+        self.upload_keep = upload_keep
+        self.log = log
+        self.upload_dir = tempfile.mkdtemp(prefix="kitting_service_")
+        self.started_at = time.time()
+        self.requests = 0
+        self.failures = 0
+        self._uploads = OrderedDict()
+        self._upload_lock = threading.Lock()
+        self._write_locks = {}                  # 真实路径 -> 锁：同一排程的回写依次进行
+        self._write_locks_lock = threading.Lock()
+
+    def close(self):
+        shutil.rmtree(self.upload_dir, ignore_errors=True)
+
+    def authorized(self, token):
+        return not self.token or hmac.compare_digest((token or "").encode("utf-8"), self.token.encode("utf-8"))
+
+    def _plan_path(self, path):
+        """path 方式的排程路径：按解析符号链接后的真实路径检查是否在 plan_roots 下，返回真实路径。"""
+        if not self.plan_roots:
+            raise Forbidden("服务未开放服务端路径 (见 SERVICE_PLAN_ROOTS)，请改为上传排程")
+        real = os.path.realpath(path)
+        key = os.path.normcase(real)
+        for root in self.plan_roots:
+            try:
+                if os.path.commonpath([key, root]) == root:
+                    break
+            except ValueError:      # Windows 下不在同一盘符
+                pass
+        else:
+            raise Forbidden(f"排程不在服务开放的目录下: {path}")
+        if os.path.splitext(real)[1].lower() not in PLAN_SUFFIXES:
+            raise ValueError(f"不支持的文件类型: {path}")
+        if not os.path.isfile(real):
+            raise FileNotFoundError(f"找不到排程文件: {path}")
+        return real
+
+    def _write_lock(self, path):
+        """path 方式回写用的锁 (按 _plan_path 返回的真实路径)；请求由多个线程并行处理，同一文件的备份与回写不能交错。"""
+        key = os.path.normcase(path)
+        with self._write_locks_lock:
+            lock = self._write_locks.get(key)
+            if lock is None:
+                lock = self._write_locks[key] = threading.Lock()
+            return lock
+
+    def _save_upload(self, data, name):
+        from plan_workbook import forget_plan
+        ext = os.path.splitext(name)[1].lower()
+        if ext not in PLAN_SUFFIXES:
+            raise ValueError(f"不支持的文件类型: {name}")
+        path = os.path.join(self.upload_dir, hashlib.sha256(data).hexdigest()[:32] + ext)
+        with self._upload_lock:
+            if path in self._uploads:
+                self._uploads.move_to_end(path)
+                return path
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._uploads[path] = name
+            while len(self._uploads) > self.upload_keep:
+                old, _ = self._uploads.popitem(last=False)
+                forget_plan(old)
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return path
+
+    def analyze(self, req):
+        """处理一个 /analyze 请求 (字段见模块说明)，返回可 JSON 序列化的结果。"""
+        from kitting_engine import format_result, shortage_timeline, simulate_kitting_vectorized
+        from plan_workbook import ALL_WORKSHOPS
+        t0 = time.perf_counter()
+        start = datetime.date.fromisoformat(req['start'])
+        end = datetime.date.fromisoformat(req.get('end') or req['start'])
+        if end < start:
+            raise ValueError("结束日期不能早于开始日期")
+        workshop = req.get('workshop') or ALL_WORKSHOPS
+        write = bool(req.get('write'))
+        if 'workbook' in req:
+            if write:
+                raise ValueError("上传的排程只返回结果，回写请改用 path")
+            path = self._save_upload(base64.b64decode(req['workbook']), req.get('name') or "plan.xlsx")
+            label = req.get('name') or os.path.basename(path)
+        else:
+            path = self._plan_path(req['path'])
+            label = path
+
+        backup = lock = None
+        try:
+            if write:
+                lock = self._write_lock(path)
+                lock.acquire()
+                store = BackupStore.for_file(path, keep_last=self.keep_last, keep_days=self.keep_days)
+                backup, = start_backups([(store, path)])   # 与解析排程并行
+            sheet, wo_list, counts = parse_plan(path, req.get('sheet'), start, end, workshop)
+            seconds = {'parse': counts['seconds']}
+            reply = {'status': "no_data", 'sheet': sheet, 'orders': len(wo_list), 'results': [], 'timeline': None,
+                     'summary': None, 'short_parts': None, 'rows_written': 0, 'fetched': 0, 'seconds': seconds}
+            if not wo_list:
+                return reply
+
+            t1 = time.perf_counter()
+            keys = list(dict.fromkeys(w['wo_key'] for w in wo_list))
+            (store, inventory, inv0), reply['fetched'] = self.snapshot.get(keys, bool(req.get('force')))
+            t2 = time.perf_counter()
+            seconds['erp'] = round(t2 - t1, 4)
+            results = simulate_kitting_vectorized(wo_list, store, dict(inventory))
+            t3 = time.perf_counter()
+            seconds['simulate'] = round(t3 - t2, 4)
+
+            want_timeline, want_summary = req.get('timeline', True), req.get('summary', False)
+            timeline = None
+            if write:
+                backup.result()
+                reply['rows_written'] = write_results(path, sheet, results)
+                if want_timeline:
+                    timeline, _ = write_timeline(path, wo_list, store, inv0)
+                    reply['short_parts'] = len(timeline)
+                if want_summary:
+                    write_summary(path, wo_list, results, timeline)
+            else:
+                reply['results'] = [[r['row_idx'], format_result(r)] for r in results]
+                if want_timeline:
+                    timeline = shortage_timeline(wo_list, store, inv0)
+                    reply['short_parts'] = len(timeline)
+                    reply['timeline'] = timeline_to_json(timeline)
+                if want_summary:
+                    reply['summary'] = summary_to_json(workshop_summary(wo_list, results, timeline))
+            seconds['output'] = round(time.perf_counter() - t3, 4)
+            reply['status'] = "ok"
+        finally:
+            if backup is not None:
+                backup.exception()
+            if lock is not None:
+                lock.release()
+        seconds['total'] = round(time.perf_counter() - t0, 4)
+        self.log(f"{os.path.basename(label)} [{sheet}] {start}~{end} {workshop}: {len(wo_list)} 张工单, "
+                 f"补查 {reply['fetched']} 张, 用时 {seconds['total']:.2f}s")
+        return reply
+
+    def refresh(self, req):
+        """处理 /refresh 请求：立即全部刷新 (force 时忽略本地缓存)，返回刷新后的状态。"""
+        self.snapshot.refresh(bool(req.get('force')))
+        return self.status()
+
+    def status(self):
+        snap = self.snapshot
+        store, inventory, _ = snap.view
+
+        def stamp(t):
+            return datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S") if t else None
+        return {'orders': store.n_orders if store is not None else 0,
+                'bom_lines': store.n_lines if store is not None else 0,
+                'parts': len(inventory), 'active_keys': len(snap.last_used),
+                'bom_refreshed': stamp(snap.bom_at), 'inv_refreshed': stamp(snap.inv_at),
+                'erp_fetches': snap.erp_fetches, 'last_error': snap.last_error,
+                'requests': self.requests, 'failures': self.failures,
+                'uptime': round(time.time() - self.started_at)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "KittingService/1"
+
+    def log_message(self, fmt, *args):
+        pass    # 每个请求由 AnalysisService 记一行日志
+
+    def _reply(self, code, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if len(body) >= GZIP_MIN_BYTES and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, 1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        if self.server.service.authorized(self.headers.get(TOKEN_HEADER)):
+            return True
+        self._reply(403, {'error': "口令不符 (见 SERVICE_TOKEN)"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/status":
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {'error': f"未知路径: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        # 先读完请求体：未读完就回复并断开时，客户端可能收不到回复而只见连接被重置
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self._authorized():
+            service.log(f"拒绝请求 {self.path}: 口令不符 ({self.client_address[0]})")
+            return
+        if self.path == "/analyze":
+            handler = service.analyze
+        elif self.path == "/refresh":
+            handler = service.refresh
+        else:
+            self._reply(404, {'error': f"未知路径: {self.path}"})
+            return
+        service.requests += 1
+        try:
+            reply = handler(json.loads(body or b"{}"))
+        except Forbidden as e:
+            service.failures += 1
+            service.log(f"拒绝请求 {self.path}: {e} ({self.client_address[0]})")
+            self._reply(403, {'error': str(e)})
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            service.failures += 1
+            self._reply(400, {'error': f"请求有误: {e!r}" if isinstance(e, KeyError) else f"请求有误: {e}"})
+        except Exception as e:
+            service.failures += 1
+            traceback.print_exc()
+            service.log(f"请求失败: {e}")
+            self._reply(500, {'error': str(e)})
+        else:
+            self._reply(200, reply)
+
+
+def make_server(service, host="127.0.0.1", port=8765):
+    """创建 HTTP 服务 (每个请求一个线程)；调用方执行 serve_forever()。port 为 0 时自动选择空闲端口。"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+# ============== 客户端 ==============
+
+def timeline_to_json(timeline):
+    """缺料时间线转成可 JSON 序列化的形式 (日期为 YYYY-MM-DD)。"""
+    out = []
+    for r in timeline:
+        r = dict(r)
+        r['first_date'] = r['first_date'].isoformat()
+        r['days'] = [(d.isoformat(), *rest) for d, *rest in r['days']]
+        r['blocked'] = [(d.isoformat(), *rest) for d, *rest in r['blocked']]
+        out.append(r)
+    return out
+
+
+def timeline_from_json(timeline):
+    """timeline_to_json 的逆变换：还原日期与工单键 (tuple)。"""
+    day = datetime.date.fromisoformat
+    for r in timeline:
+        r['first_date'], r['first_wo'] = day(r['first_date']), tuple(r['first_wo'])
+        r['days'] = [(day(d), *rest) for d, *rest in r['days']]
+        r['blocked'] = [(day(d), tuple(key), *rest) for d, key, *rest in r['blocked']]
+    return timeline
+
+
+def summary_to_json(summary):
+    """车间汇总转成可 JSON 序列化的形式 (首次缺料日期为 YYYY-MM-DD)。"""
+    return [dict(s, top=[(*t[:5], t[5].isoformat(), t[6]) for t in s['top']]) for s in summary]
+
+
+def summary_from_json(summary):
+    """summary_to_json 的逆变换。"""
+    day = datetime.date.fromisoformat
+    for s in summary:
+        s['top'] = [(*t[:5], day(t[5]), t[6]) for t in s['top']]
+    return summary
+
+
+def call_service(url, path, payload=None, timeout=600, token=""):
+    """向服务发送请求 (payload 为 None 时 GET)，返回解析后的 JSON。token 非空时随请求发送。"""
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+    if token:
+        headers[TOKEN_HEADER] = token
+    req = urllib.request.Request(url.rstrip("/") + path, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            if resp.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+    except urllib.error.HTTPError as e:
+        try:
+            msg = json.loads(e.read())['error']
+        except Exception:
+            msg = f"HTTP {e.code}"
+        raise ServiceError(f"分析服务返回错误: {msg}") from None
+    except urllib.error.URLError as e:
+        raise ServiceUnavailable(str(e.reason)) from None
+    except TimeoutError:
+        raise ServiceError(f"分析服务 {timeout}s 内未返回结果") from None
+    return json.loads(body)
+
+
+def remote_analyze(url, path, sheet, start_date, end_date, workshop, force=False, timeline=True, timeout=600,
+                   summary=False, token=""):
+    """
+    上传排程文件交给服务分析 (界面调用，A 列、缺料时间线与车间汇总由调用方在本机写入)；token 为服务口令。
+    返回服务的结果，其中 results 转为 [{'row_idx', 'text'}]，timeline / summary 已还原。
+    无法连接时抛出 ServiceUnavailable，服务返回错误时抛出 ServiceError。
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    reply = call_service(url, "/analyze", {
+        'workbook': base64.b64encode(data).decode("ascii"), 'name': os.path.basename(path), 'sheet': sheet,
+        'start': start_date.isoformat(), 'end': end_date.isoformat(), 'workshop': workshop,
+        'force': force, 'timeline': timeline, 'summary': summary}, timeout, token)
+    reply['results'] = [{'row_idx': row, 'text': text} for row, text in reply['results']]
+    if reply['timeline'] is not None:
+        timeline_from_json(reply['timeline'])
+    if reply.get('summary') is not None:
+        summary_from_json(reply['summary'])
+    return reply
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+排程文件备份库 (内容寻址)
+
+每次分析前不再整份复制 <名称>_备份_<时间>.xlsx，而是存入排程文件所在目录下的
+隐藏目录 .排程备份：
+- objects/<sha256 前两位>/<sha256>.gz: gzip 压缩的文件内容，相同内容只存一份；
+- manifest.json: 备份记录 (文件名、sha256、大小、时间)，与上一次备份内容相同时不新增记录；
+- 保留策略：每个文件保留最近 keep_last 份，另外最近 keep_days 天每天保留最后一份，
+  不再被任何记录引用的对象随即删除；
+- restore 恢复指定备份 (恢复前先备份当前文件，可再恢复回来)。
+
+读源文件只有一遍：边读边算哈希边压缩写临时对象，完成后按哈希改名或丢弃。
+多人 / 多个线程可能同时备份同一目录：对象就位、manifest 读改写和清理对象都在
+锁文件 manifest.lock 内进行 (O_CREAT|O_EXCL 建立，超过 LOCK_STALE 秒视为残留锁)。
+
+命令行：
+    python backup_store.py list 排程.xlsx
+    python backup_store.py restore 排程.xlsx <序号或时间> [--out 另存路径]
+"""
+import argparse
+import contextlib
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import time
+
+BACKUP_DIR_NAME = ".排程备份"
+CHUNK = 1 << 20
+FILE_MODE = 0o644   # mkstemp 建的文件只有本人可读，共享目录中其他人也要能列出和恢复
+LOCK_NAME = "manifest.lock"
+LOCK_WAIT = 30      # 等锁最多秒数
+LOCK_STALE = 120    # 锁文件超过此秒数未释放视为持有者已退出 (持锁期间只做改名、写 manifest、删对象)
+
+
+class BackupError(Exception):
+    pass
+
+
+def _hide(path):
+    """Windows 下给目录加隐藏属性 (以点开头的目录在资源管理器中并不隐藏)。"""
+    if os.name == "nt":
+        try:
+            import ctypes
+            ctypes.windll.kernel32.SetFileAttributesW(path, 0x02)
+        except Exception:
+            pass
+
+
+class BackupStore:
+    """
+    root: 备份目录 (通常由 for_file 取排程文件旁的 .排程备份)
+    keep_last / keep_days: 保留策略；compress_level: gzip 压缩级别 (xlsx 本身已压缩，默认取快速档)
+    """
+
+    def __init__(self, root, keep_last=30, keep_days=14, compress_level=1):
+        self.root = root
+        self.keep_last = keep_last
+        self.keep_days = keep_days
+        self.compress_level = compress_level
+        self.manifest_path = os.path.join(root, "manifest.json")
+
+    @classmethod
+    def for_file(cls, path, **kw):
+        return cls(os.path.join(os.path.dirname(os.path.abspath(path)), BACKUP_DIR_NAME), **kw)
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest + ".gz")
+
+    # ---------- 记录 ----------
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """持有 manifest 锁期间执行 with 块；等待超过 LOCK_WAIT 秒报 BackupError。"""
+        path = os.path.join(self.root, LOCK_NAME)
+        deadline = time.monotonic() + LOCK_WAIT
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, FILE_MODE)
+                break
+            except FileExistsError:
+                pass
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_STALE:
+                    os.unlink(path)     # 上次持锁的进程异常退出留下的锁
+                    continue
+            except FileNotFoundError:
+                continue                # 刚被释放
+            if time.monotonic() > deadline:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        holder = f.read().strip()
+                except OSError:
+                    holder = "?"
+                raise BackupError(f"备份目录正被占用 ({holder})，请稍后再试: {self.root}")
+            time.sleep(0.05)
+        try:
+            os.write(fd, f"{socket.gethostname()} pid {os.getpid()}".encode("utf-8"))
+        finally:
+            os.close(fd)
+        try:
+            yield
+        finally:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f).get('entries', [])
+        except FileNotFoundError:
+            return []
+
+    def _save(self, entries):
+        fd, tmp = tempfile.mkstemp(prefix=".~manifest", dir=self.root)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({'version': 1, 'entries': entries}, f, ensure_ascii=False, indent=1)
+            os.chmod(tmp, FILE_MODE)
+            os.replace(tmp, self.manifest_path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def entries(self, file_name=None):
+        """备份记录 (按时间从新到旧)；file_name 为排程文件名时只列该文件的。"""
+        es = [e for e in self._load() if file_name is None or e['file'] == file_name]
+        return sorted(es, key=lambda e: e['ts'], reverse=True)
+
+    # ---------- 备份 ----------
+
+    def backup(self, path):
+        """
+        备份 path，返回记录 dict；内容与该文件上一次备份相同时返回上一次的记录，
+        并带 duplicate=True。
+        """
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root, exist_ok=True)
+            _hide(self.root)
+        obj_dir = os.path.join(self.root, "objects")
+        os.makedirs(obj_dir, exist_ok=True)
+
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(prefix=".~obj", dir=obj_dir)
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as raw, \
+                    gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.compress_level, mtime=0) as gz:
+                while True:
+                    buf = src.read(CHUNK)
+                    if not buf: break
+                    h.update(buf)
+                    gz.write(buf)
+                    size += len(buf)
+            digest = h.hexdigest()
+            obj = self._object_path(digest)
+            name = os.path.basename(path)
+            # 对象就位到记录写入之间不能被别人的 _prune 删掉，一并放在锁内
+            with self._locked():
+                if os.path.exists(obj):
+                    os.unlink(tmp)
+                else:
+                    os.makedirs(os.path.dirname(obj), exist_ok=True)
+                    os.chmod(tmp, FILE_MODE)
+                    os.replace(tmp, obj)
+                entries = self._load()
+                last = max((e for e in entries if e['file'] == name), key=lambda e: e['ts'], default=None)
+                if last is not None and last['sha256'] == digest:
+                    return dict(last, duplicate=True)
+                now = time.time()
+                entry = {'file': name, 'sha256': digest, 'size': size, 'stored': os.path.getsize(obj), 'ts': now,
+                         'time': datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")}
+                entries.append(entry)
+                self._save(self._prune(entries, name, now))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return dict(entry, duplicate=False)
+
+    def _prune(self, entries, name, now):
+        """按保留策略删去该文件多余的记录，并删除不再被引用的对象 (须在 _locked 内调用)。"""
+        mine = sorted((e for e in entries if e['file'] == name), key=lambda e: e['ts'], reverse=True)
+        keep = {id(e) for e in mine[:self.keep_last]}
+        cutoff = now - self.keep_days * 86400
+        days = set()
+        for e in mine:
+            day = e['time'][:10]
+            if e['ts'] >= cutoff and day not in days:
+                days.add(day)
+                keep.add(id(e))
+        kept = [e for e in entries if e['file'] != name or id(e) in keep]
+        used = {e['sha256'] for e in kept}
+        for e in mine:
+            if id(e) not in keep and e['sha256'] not in used:
+                used.add(e['sha256'])
+                try:
+                    os.unlink(self._object_path(e['sha256']))
+                except FileNotFoundError:
+                    pass
+        return kept
+
+    # ---------- 恢复 ----------
+
+    def restore(self, entry, dest):
+        """
+        把备份 entry 恢复到 dest：先解压到同目录临时文件并校验哈希，dest 已存在时再把它
+        备份一次 (内容相同则不重复存)，最后整体替换。先解压是因为这次备份的清理可能删掉 entry 的对象。
+        """
+        obj = self._object_path(entry['sha256'])
+        h = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(prefix=".~", suffix=os.path.splitext(dest)[1],
+                                   dir=os.path.dirname(os.path.abspath(dest)))
+        try:
+            try:
+                src = gzip.open(obj, "rb")
+            except FileNotFoundError:
+                os.close(fd)
+                raise BackupError(f"备份对象缺失: {entry['sha256'][:12]}") from None
+            with src, os.fdopen(fd, "wb") as out:
+                while True:
+                    buf = src.read(CHUNK)
+                    if not buf: break
+                    h.update(buf)
+                    out.write(buf)
+            if h.hexdigest() != entry['sha256']:
+                raise BackupError("备份内容校验失败")
+            if os.path.exists(dest):
+                self.backup(dest)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return dest
+
+
+def describe(entry):
+    return f"{entry['time']}  {entry['size'] / 1048576:7.2f} MB  {entry['sha256'][:12]}"
+
+
+def _pick(entries, which):
+    if which.isdigit() and int(which) < len(entries):
+        return entries[int(which)]
+    for e in entries:
+        if e['time'].replace("-", "").replace(":", "").replace(" ", "_").startswith(which) or e['time'].startswith(which):
+            return e
+    raise BackupError(f"找不到备份: {which}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="排程文件备份库")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("list", help="列出某个排程文件的备份 (序号 0 为最新)")
+    ls.add_argument("file")
+    rs = sub.add_parser("restore", help="恢复备份 (默认覆盖原文件，覆盖前会先备份当前内容)")
+    rs.add_argument("file")
+    rs.add_argument("which", help="list 中的序号，或时间 (如 2026-10-18 21:30 / 20261018_2130)")
+    rs.add_argument("--out", help="另存到此路径，不覆盖原文件")
+    args = ap.parse_args()
+
+    store = BackupStore.for_file(args.file)
+    entries = store.entries(os.path.basename(args.file))
+    if args.cmd == "list":
+        for i, e in enumerate(entries):
+            print(f"{i:>3}  {describe(e)}")
+        if not entries:
+            print("没有备份")
+        return
+    entry = _pick(entries, args.which)
+    print(f"已恢复 {describe(entry)} -> {store.restore(entry, args.out or args.file)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+性能基准
+
+不依赖生产排程表和 FQD 数据库：
+1. 按排程表布局生成合成工作簿 (第2行表头、第3行日期、ROW_IDX_DATA_START 起为数据，
+   含 车间 / 单别 / 工单单号 列)，行数、日期跨度、BOM 展开数可配置；
+2. 生成与之对应的 ERP 替身库 (SQLite，MOCTA / MOCTB / INVMB / INVMC，以及在途供应 PURTD 与品号 BOM BOMMD)；
+3. 不启动 Tk，按分析流程逐阶段计时 (可选 tracemalloc 峰值内存)，结果写成 JSON，
+   不同版本的结果可用 compare 子命令对比。
+
+用法：
+    python benchmark.py run --sizes 1000 10000 100000 --out bench.json
+    python benchmark.py compare old.json new.json
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import openpyxl
+
+import erp_access
+import erp_standin
+import plan_workbook
+from analysis_service import AnalysisService, Snapshot, make_server, remote_analyze
+from backup_store import BackupStore
+from erp_cache import ErpCache
+from kitting_engine import (IncrementalSimulator, ItemBom, simulate_kitting_vectorized, simulate_partitioned,
+                            simulate_time_phased, order_components, format_result, shortage_timeline)
+from plan_workbook import load_plan, ROW_IDX_DATA_START
+from run_report import RunReport
+from shortage_report import write_shortage_workbook, sidecar_path
+from xlsx_patch import write_column_a
+
+SHEET = "排程"
+WORKSHOPS = ("一车间", "二车间", "三车间", "组装车间")
+WO_TYPES = ("5101", "5102")
+HEADERS = ("齐套结果", "车间", "品名", "备注", "单别", "工单单号")   # 日期列紧随其后
+
+
+def _wo_key(i):
+    return WO_TYPES[i % len(WO_TYPES)], f"{20260000000 + i:011d}"
+
+
+def make_plan_workbook(path, n_orders, n_days=30, start=datetime.date(2026, 10, 1), run_days=(1, 5), seed=1):
+    """
+    生成合成排程表：每行一张工单，在随机开工日起连续 run_days 天排产。
+    约 2% 的行缺少单号、1% 的行没有排产，用于覆盖异常分支。
+    """
+    r = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(SHEET)
+    n_fixed = len(HEADERS)
+    ws.append(["合成排程 (benchmark)"])
+    ws.append(list(HEADERS))
+    ws.append([None] * n_fixed + [datetime.datetime.combine(start + datetime.timedelta(d), datetime.time())
+                                  for d in range(n_days)])
+    for _ in range(ROW_IDX_DATA_START - 4):
+        ws.append([])
+    for i in range(n_orders):
+        t, n = _wo_key(i)
+        if r.random() < 0.02:
+            n = None
+        qty = [None] * n_days
+        if r.random() >= 0.01:
+            d0 = r.randrange(n_days)
+            for d in range(d0, min(n_days, d0 + r.randint(*run_days))):
+                qty[d] = r.choice((50, 100, 120, 200, 300, 500))
+        ws.append([None, r.choice(WORKSHOPS), f"产品{i % 997}", None, t, n] + qty)
+    wb.save(path)
+
+
+def make_fake_erp(path, n_orders, fanout=12, n_parts=None, families=1, seed=1, chunk=50000):
+    """
+    生成与 make_plan_workbook 对应的 ERP 替身库。每张工单约 fanout 行 BOM，
+    品号按幂律分布抽取 (少数通用料被大量工单共用，库存竞争更真实)；约 3% 工单已完工，
+    约 0.5% 工单在 ERP 中不存在。
+    families > 1 时品号分成互不相交的若干产品族，第 i 张工单只用第 i % families 族的料。
+    """
+    r = random.Random(seed)
+    n_parts = n_parts or max(200, n_orders // 2)
+    per_family = max(1, n_parts // families)
+    n_parts = per_family * families
+    if os.path.exists(path):
+        os.remove(path)
+    conn = erp_standin.connect_standin(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    weights = 1.0 / np.arange(1, per_family + 1) ** 0.8
+    cum = np.cumsum(weights / weights.sum())
+    rng = np.random.default_rng(seed)
+
+    conn.execute("BEGIN")
+    mocta, moctb = [], []
+    for i in range(n_orders):
+        if r.random() < 0.005:
+            continue
+        t, n = _wo_key(i)
+        total = float(r.choice((100, 200, 500, 1000, 2000)))
+        mocta.append((t, n, "Y" if r.random() < 0.03 else "N", total, "20261001"))
+        k = max(1, int(rng.poisson(fanout)))
+        parts = (np.searchsorted(cum, rng.random(k)) + (i % families) * per_family).tolist()
+        for p in parts:
+            req = total * r.choice((1, 1, 2, 4, 0.5))
+            iss = r.choice((0.0, 0.0, req * 0.5, req))
+            moctb.append((t, n, f"P{p:07d}", req, iss, "20261001"))
+        if len(moctb) >= chunk:
+            conn.executemany("INSERT INTO MOCTA (TA001, TA002, TA011, TA015, MODI_DATE) VALUES (?,?,?,?,?)", mocta)
+            conn.executemany("INSERT INTO MOCTB VALUES (?,?,?,?,?,?)", moctb)
+            mocta, moctb = [], []
+    conn.executemany("INSERT INTO MOCTA (TA001, TA002, TA011, TA015, MODI_DATE) VALUES (?,?,?,?,?)", mocta)
+    conn.executemany("INSERT INTO MOCTB VALUES (?,?,?,?,?,?)", moctb)
+    conn.executemany("INSERT INTO INVMB (MB001, MB002, MB004) VALUES (?,?,?)",
+                     ((f"P{p:07d}", f"物料{p}", r.choice(("PCS", "KG", "M"))) for p in range(n_parts)))
+    inv = []
+    for p in range(n_parts):
+        if r.random() < 0.9:
+            inv.append((f"P{p:07d}", "01", float(r.choice((0, 100, 1000, 5000, 20000)))))
+        if r.random() < 0.2:
+            inv.append((f"P{p:07d}", "02", float(r.randint(0, 500))))
+    conn.executemany("INSERT INTO INVMC VALUES (?,?,?)", inv)
+
+    # 在途供应 (逐日推演用)：约三成品号有 1~3 笔未交采购单，约 2% 的品号有生产中的工单产出，
+    # 到货日散布在 10/1 前后约 100 天。用单独的随机数，不改变上面已生成的数据
+    rs = random.Random(seed + 7919)
+    base = datetime.date(2026, 10, 1)
+    purchases, productions = [], []
+    for p in range(n_parts):
+        for _ in range(rs.randint(1, 3) if rs.random() < 0.3 else 0):
+            q = float(rs.choice((100, 500, 1000, 5000)))
+            purchases.append((f"P{p:07d}", base + datetime.timedelta(rs.randrange(-5, 95)), q, rs.choice((0.0, q / 2))))
+        if rs.random() < 0.02:
+            productions.append(("5199", f"{p:011d}", f"P{p:07d}", base + datetime.timedelta(rs.randrange(0, 90)),
+                                float(rs.choice((200, 1000))), 0.0))
+    conn.execute("COMMIT")
+    erp_standin.load_supply(conn, purchases, productions)
+
+    # 品号 BOM (多阶展开用)：约 8% 的品号是自制件，各有 2~5 个子件，子件编号总大于母件 (无循环)，
+    # 常用料多为上阶，结构一般有数阶深、半成品被多个母件共用
+    rb = random.Random(seed + 104729)
+    structure = []
+    for p in range(n_parts):
+        if rb.random() >= 0.08 or p >= n_parts - 1:
+            continue
+        f0 = (p // per_family) * per_family
+        for _ in range(rb.randint(2, 5)):
+            c = min(f0 + per_family - 1, p + 1 + int(rb.expovariate(1 / max(1, per_family // 20))))
+            if c > p:
+                structure.append((f"P{p:07d}", f"P{c:07d}", rb.choice((1, 1, 2, 0.5)), 1, rb.choice((0, 0, 0.02))))
+    erp_standin.load_item_bom(conn, structure)
+    conn.close()
+
+
+def _git_version():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_scenario(workdir, n_orders, n_days=30, fanout=12, latency=0.0, pool_size=4, memory=False,
+                 classic=False, families=1, workers=0, seed=1, log=print):
+    """生成数据并按分析流程逐阶段计时，返回 RunReport.to_dict() 结果 (附 setup 耗时)。"""
+    plan = os.path.join(workdir, f"plan_{n_orders}.xlsx")
+    db = os.path.join(workdir, f"erp_{n_orders}.sqlite")
+    t0 = time.perf_counter()
+    make_plan_workbook(plan, n_orders, n_days, seed=seed)
+    make_fake_erp(db, n_orders, fanout, families=families, seed=seed)
+    setup = time.perf_counter() - t0
+    log(f"[{n_orders}] 数据已生成 ({setup:.1f}s)")
+
+    report = RunReport(trace_memory=memory, n_orders=n_orders, n_days=n_days, fanout=fanout, families=families,
+                       latency=latency, pool_size=pool_size, workers=workers, setup_seconds=round(setup, 2))
+    report.start()
+    try:
+        work = os.path.join(workdir, f"work_{n_orders}.xlsx")
+        shutil.copy2(plan, work)
+        backups = BackupStore(os.path.join(workdir, f"backup_{n_orders}"))
+        shutil.rmtree(backups.root, ignore_errors=True)
+        report.begin("backup")
+        entry = backups.backup(work)
+        report.count(bytes=entry['size'], stored=entry['stored'])
+        report.begin("backup_dup")
+        report.count(duplicate=int(backups.backup(work)['duplicate']))
+
+        report.begin("scan")
+        plan_workbook._plan_cache.clear()
+        model = load_plan(work, SHEET)
+        report.count(plan_rows=len(model.row_idx), date_cols=len(model.date_cols))
+
+        report.begin("extract")
+        start = min(model.date_column_map)
+        wo_list = model.extract(start, max(model.date_column_map), plan_workbook.ALL_WORKSHOPS)
+        wo_list.sort(key=lambda x: (x['start_date'], x['row_idx']))
+        keys = list({w['wo_key'] for w in wo_list})
+        report.count(orders=len(wo_list))
+
+        pool = erp_access.ConnectionPool(erp_standin.standin_factory(db, latency), size=pool_size)
+        report.begin("erp_fetch")
+        store, inv = erp_access.fetch_pipelined(pool, keys, on_batch=report.sql_batch)
+        report.count(erp_orders=store.n_orders, bom_lines=store.n_lines, parts=len(store.parts))
+
+        # 两种库存查询方式各计时一次 (auto 按表统计在二者间选择)
+        for strategy in ("in", "scan"):
+            report.begin(f"inventory_{strategy}")
+            erp_access.fetch_inventory_pooled(pool, store.parts.values, strategy=strategy, on_batch=report.sql_batch)
+            report.count(parts=len(store.parts))
+
+        report.begin("supply_fetch")
+        supply = erp_access.fetch_supply(pool, store.parts.values, on_batch=report.sql_batch)
+        report.count(supply=len(supply))
+
+        # 多阶展开用另一份 BomStore (挂接后品号表会增加下阶品号)
+        report.begin("item_bom_fetch")
+        item_bom = ItemBom(erp_access.fetch_item_bom(pool, store.parts.values, on_batch=report.sql_batch))
+        multi = store.subset(np.arange(store.n_orders))
+        multi_inv = dict(inv)
+        multi_inv.update(erp_access.fetch_inventory_pooled(pool, multi.attach_item_bom(item_bom),
+                                                           on_batch=report.sql_batch))
+        report.count(items=len(item_bom), depth=max(item_bom.levels.values(), default=0), parts=len(multi.parts))
+
+        cache_path = os.path.join(workdir, f"cache_{n_orders}.sqlite")
+        for f in (cache_path, cache_path + "-wal", cache_path + "-shm"):
+            if os.path.exists(f):
+                os.remove(f)
+        cache = ErpCache(cache_path)
+        fetchers = dict(fetch_bom=lambda k: erp_access.fetch_pipelined(pool, k),
+                        fetch_versions=lambda k: erp_access.fetch_bom_versions(pool, k),
+                        fetch_inventory=lambda p: erp_access.fetch_inventory_pooled(pool, p))
+        report.begin("erp_cache_cold")
+        cache.fetch(keys, **fetchers)
+        report.begin("erp_cache_warm")
+        warm, _ = cache.fetch(keys, **fetchers)
+        report.count(erp_orders=warm.n_orders)
+        report.end()
+        cache.close()
+
+        # 分析服务：首个请求含 ERP 查询，之后同一排程的请求只剩推演 (同内容的上传不再重新解析)
+        snapshot = Snapshot(lambda k, force: erp_access.fetch_pipelined(pool, k),
+                            lambda p: erp_access.fetch_inventory_pooled(pool, p), log=lambda msg: None)
+        service = AnalysisService(snapshot, log=lambda msg: None)
+        server = make_server(service, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            for name in ("service_cold", "service_warm"):
+                report.begin(name)
+                reply = remote_analyze(url, work, SHEET, start, max(model.date_column_map), plan_workbook.ALL_WORKSHOPS)
+                report.count(orders=reply['orders'], fetched=reply['fetched'],
+                             **{f"server_{k}": v for k, v in reply['seconds'].items()})
+            report.end()    # 停止服务与清理上传目录不计入 service_warm
+        finally:
+            server.shutdown()
+            server.server_close()
+            service.close()
+        pool.close()
+
+        report.begin("simulate")
+        results = simulate_kitting_vectorized(wo_list, store, copy.deepcopy(inv))
+        report.count(orders=len(results))
+
+        if workers:
+            with ProcessPoolExecutor(workers) as ex:
+                # 预热：进程启动与模块导入不计入推演耗时
+                list(ex.map(abs, range(workers)))
+                report.begin("simulate_parallel")
+                par = simulate_partitioned(wo_list, store, copy.deepcopy(inv), ex)
+                report.count(components=int(order_components(wo_list, store).max()) + 1)
+            if par != results:
+                raise AssertionError("分量并行推演结果与串行不一致")
+
+        if classic:
+            import main  # 需要 Tk / pyodbc 等界面依赖
+            report.begin("simulate_classic")
+            main.DailyPlanAvailabilityApp._simulate_logic_v3(None, wo_list, store.to_wo_data(), copy.deepcopy(inv))
+
+        report.begin("simulate_daily")
+        daily = model.extract(start, max(model.date_column_map), plan_workbook.ALL_WORKSHOPS, daily=True)
+        daily.sort(key=lambda x: (x['start_date'], x['row_idx']))
+        phased = simulate_time_phased(daily, model.target_dates(start, max(model.date_column_map)), store, inv, supply)
+        report.count(plan_days=sum(r['plan_days'] for r in phased), kit_days=sum(r['kit_days'] for r in phased))
+
+        report.begin("simulate_multi_level")
+        exploded = simulate_kitting_vectorized(wo_list, multi, copy.deepcopy(multi_inv))
+        report.count(orders=len(exploded), sub_short=sum("下阶缺料" in r['msg'] for r in exploded))
+
+        sim = IncrementalSimulator(store, inv)
+        sim.run(wo_list)
+        edited = copy.deepcopy(wo_list)
+        edited[-len(edited) // 50 - 1]['plan_qty'] += 10
+        report.begin("resimulate_edit")
+        sim.run(edited)
+        report.count(recomputed=sim.stats['recomputed'])
+
+        report.begin("write_back")
+        values = {r['row_idx']: format_result(r) for r in results}
+        write_column_a(work, SHEET, values)
+        report.count(rows_written=len(values), bytes=os.path.getsize(work))
+
+        report.begin("shortage_timeline")
+        timeline = shortage_timeline(wo_list, store, store.inventory_vector(inv))
+        if timeline:
+            write_shortage_workbook(sidecar_path(work), timeline)
+        report.count(short_parts=len(timeline), blocked_lines=sum(len(r['blocked']) for r in timeline))
+        report.stop("ok")
+    except BaseException:
+        report.stop("error")
+        raise
+    d = report.to_dict()
+    log(f"[{n_orders}] " + ", ".join(f"{s['name']}={s['seconds']:.2f}s" for s in d['stages']))
+    return d
+
+
+_STARTUP_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.warm_up()
+print(json.dumps({'import_main': t1 - t0, 'warm_up': time.perf_counter() - t1}))
+"""
+
+
+def measure_startup(repeat=3, log=print):
+    """
+    在新进程中计时 main 模块导入 (窗口显示前的关键路径) 与后台预加载，取多次中的最小值。
+    不创建窗口，但需要 tkinter / tkcalendar。结果与规模场景同一结构 (规模记为 0)。
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = {}
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=here, capture_output=True, text=True,
+                             check=True).stdout
+        for k, v in json.loads(out.strip().splitlines()[-1]).items():
+            best[k] = min(best.get(k, v), v)
+    log("[startup] " + ", ".join(f"{k}={v:.3f}s" for k, v in best.items()))
+    return {'status': 'ok', 'meta': {'n_orders': 0, 'repeat': repeat},
+            'stages': [{'name': k, 'seconds': round(v, 4), 'peak_mb': None, 'counts': {}} for k, v in best.items()]}
+
+
+def cmd_run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fqd_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    out = {
+        'version': _git_version(),
+        'created_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'openpyxl': openpyxl.__version__,
+        'scenarios': [],
+    }
+    try:
+        if args.startup:
+            out['scenarios'].append(measure_startup())
+        for n in args.sizes:
+            out['scenarios'].append(run_scenario(workdir, n, args.days, args.fanout, args.latency, args.pool,
+                                                 args.memory, args.classic, args.families, args.workers, args.seed))
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2, default=str)
+    print(f"结果已写入 {args.out}")
+
+
+def cmd_compare(args):
+    """按 (规模, 阶段) 对比两份结果，列出耗时比值。"""
+    def load(path):
+        with open(path, encoding="utf-8") as f:
+            d = json.load(f)
+        return d.get('version'), {(s['meta']['n_orders'], st['name']): st['seconds']
+                                  for s in d['scenarios'] for st in s['stages']}
+
+    va, a = load(args.base)
+    vb, b = load(args.new)
+    print(f"{'规模':>8} {'阶段':<18} {va or 'base':>12} {vb or 'new':>12} {'比值':>8}")
+    for key in sorted(set(a) | set(b), key=lambda k: (k[0], k[1])):
+        x, y = a.get(key), b.get(key)
+        ratio = f"{y / x:.2f}x" if x and y is not None else "-"
+        flag = "  <-- 变慢" if x and y is not None and y > x * (1 + args.threshold) and y - x > 0.05 else ""
+        print(f"{key[0]:>8} {key[1]:<18} {'-' if x is None else f'{x:.3f}':>12} "
+              f"{'-' if y is None else f'{y:.3f}':>12} {ratio:>8}{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="排程齐套分析性能基准")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="生成合成数据并逐阶段计时")
+    r.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="工单 (行) 数")
+    r.add_argument("--days", type=int, default=30, help="日期列跨度 (天)")
+    r.add_argument("--fanout", type=int, default=12, help="平均每张工单的 BOM 行数")
+    r.add_argument("--latency", type=float, default=0.0, help="每次 SQL 注入的延迟 (秒)，模拟网络")
+    r.add_argument("--pool", type=int, default=4, help="连接池大小")
+    r.add_argument("--memory", action="store_true", help="用 tracemalloc 记录各阶段峰值内存 (耗时会明显变大，不要与未开启的结果对比)")
+    r.add_argument("--classic", action="store_true", help="同时计时逐单字典版推演 (需要界面依赖)")
+    r.add_argument("--families", type=int, default=1, help="互不共用物料的产品族数量")
+    r.add_argument("--workers", type=int, default=0, help="同时计时分量并行推演，使用的进程数 (0 为不计时)")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--startup", action="store_true", help="同时计时启动 (main 模块导入与后台预加载)")
+    r.add_argument("--workdir", help="数据目录 (默认临时目录，结束后删除)")
+    r.add_argument("--keep", action="store_true", help="保留临时目录中的合成数据")
+    r.add_argument("--out", default="bench_result.json")
+    r.set_defaults(func=cmd_run)
+    c = sub.add_parser("compare", help="对比两份结果")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.2, help="超过该比例视为变慢")
+    c.set_defaults(func=cmd_compare)
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,764 @@
+# -*- coding: utf-8 -*-
+"""
+ERP (鼎新 FQD) 数据访问
+
+- ErpConnection: 单个复用的数据库连接，断线自动重连一次；
+- fetch_bom_setbased: 把工单键批量写入临时表，一次集合连接 MOCTA/MOCTB/INVMB，
+  替代成百上千个 (TA001=.. AND TA002=..) OR 条件；
+- 每批出错都会抛出 ErpFetchError，不再静默吞掉；
+- ConnectionPool + fetch_pipelined: 有限连接池上并发执行 BOM 分批查询，
+  每批到达后立即为新出现的品号排队查库存；单次查询超时、有限次退避重试；
+- 库存查询均为参数化语句，可按库别 (MC002) 白/黑名单过滤；品号数多到按 INVMC / INVMB
+  表统计估算整表汇总更省时，改为一次整表汇总代替几十次 IN 列表查询；
+- fetch_supply: 在途供应 (未交采购单、生产中工单的未产量) 按预计到货日，供逐日推演；
+- fetch_item_bom: 自制/托外件的品号 BOM (BOMMD)，逐阶向下查到底，供多阶展开。
+
+同样的 SQL 也能跑在 erp_standin 提供的 SQLite 替身库上，便于离线测试。
+"""
+import datetime
+import math
+import queue
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ErpFetchError(Exception):
+    """ERP 查询失败。errors 为 [(批次描述, 异常)]。"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        lines = [f"{where}: {e}" for where, e in errors[:5]]
+        if len(errors) > 5:
+            lines.append(f"... 共 {len(errors)} 处错误")
+        super().__init__("ERP 查询失败\n" + "\n".join(lines))
+
+
+class SqlDialect:
+    """SQL Server 与 SQLite 替身库在临时表写法上的差异。"""
+
+    def __init__(self, name, key_table, create_key_table, drop_key_table, fast_executemany, set_timeout,
+                 inventory_stats):
+        self.name = name
+        self.key_table = key_table
+        self.create_key_table = create_key_table
+        self.drop_key_table = drop_key_table
+        self.fast_executemany = fast_executemany
+        self.set_timeout = set_timeout
+        self.inventory_stats = inventory_stats  # 返回一行 (INVMC 行数, INVMB 行数)
+
+
+def _pyodbc_timeout(conn, seconds):
+    # pyodbc: Connection.timeout 为单条语句的查询超时 (秒，0 表示不限)
+    conn.timeout = int(seconds) if seconds else 0
+
+
+def _sqlite_timeout(conn, seconds):
+    if not isinstance(conn, sqlite3.Connection):
+        # 替身库包装连接，语义同 pyodbc
+        conn.timeout = seconds
+        return
+    if not seconds:
+        conn.set_progress_handler(None, 0)
+        return
+    deadline = time.monotonic() + seconds
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+
+
+SQLSERVER = SqlDialect(
+    "sqlserver", "#wo_keys",
+    "CREATE TABLE #wo_keys (t NVARCHAR(10) NOT NULL, n NVARCHAR(20) NOT NULL)",
+    "IF OBJECT_ID('tempdb..#wo_keys') IS NOT NULL DROP TABLE #wo_keys",
+    True, _pyodbc_timeout,
+    # 取自分区元数据，不扫描表
+    "SELECT SUM(CASE WHEN object_id=OBJECT_ID('INVMC') THEN rows END), "
+    "SUM(CASE WHEN object_id=OBJECT_ID('INVMB') THEN rows END) "
+    "FROM sys.partitions WHERE object_id IN (OBJECT_ID('INVMC'), OBJECT_ID('INVMB')) AND index_id IN (0, 1)",
+)
+
+SQLITE = SqlDialect(
+    "sqlite", "temp.wo_keys",
+    "CREATE TEMP TABLE wo_keys (t TEXT NOT NULL, n TEXT NOT NULL)",
+    "DROP TABLE IF EXISTS temp.wo_keys",
+    False, _sqlite_timeout,
+    "SELECT (SELECT COUNT(*) FROM INVMC), (SELECT COUNT(*) FROM INVMB)",
+)
+
+
+def _guess_dialect(conn):
+    if isinstance(conn, sqlite3.Connection) or getattr(conn, "is_standin", False):
+        return SQLITE
+    return SQLSERVER
+
+
+class ErpConnection:
+    """
+    复用的 ERP 连接。connect 为无参工厂函数 (例如 lambda: pyodbc.connect(DB_CONN_STRING))。
+    """
+
+    def __init__(self, connect, dialect=None):
+        self._connect = connect
+        self._conn = None
+        self.dialect = dialect
+        self.inventory_stats = None     # (INVMC 行数, INVMB 行数)，首次自动选择库存查询方式时测得
+
+    def get(self):
+        if self._conn is None:
+            self._conn = self._connect()
+            if self.dialect is None:
+                self.dialect = _guess_dialect(self._conn)
+        return self._conn
+
+    def reset(self):
+        """丢弃当前连接 (出错后调用，下次 get 时重连)。"""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def close(self):
+        self.reset()
+
+    def run(self, work):
+        """
+        在复用连接上执行 work(conn)。若连接已断开则重连后重试一次。
+        """
+        try:
+            return work(self.get())
+        except Exception:
+            self.reset()
+            return work(self.get())
+
+
+BOM_SELECT = """
+    SELECT RTRIM(TA.TA001) t, RTRIM(TA.TA002) n, TA.TA015 total, TA.TA011 status,
+           RTRIM(TB.TB003) p, COALESCE(RTRIM(MB.MB002),'') name,
+           COALESCE(RTRIM(MB.MB004),'') unit, TB.TB004 req, TB.TB005 iss
+    FROM {keys} K
+    INNER JOIN MOCTA TA ON TA.TA001=K.t AND TA.TA002=K.n
+    INNER JOIN MOCTB TB ON TA.TA001=TB.TB001 AND TA.TA002=TB.TB002
+    LEFT JOIN INVMB MB ON TB.TB003=MB.MB001
+"""
+
+
+def load_key_table(conn, dialect, keys, batch_size=5000):
+    """
+    建临时表并分批写入工单键，返回失败批次列表 [(描述, 异常)]。
+    """
+    errors = []
+    cur = conn.cursor()
+    cur.execute(dialect.drop_key_table)
+    cur.execute(dialect.create_key_table)
+    if dialect.fast_executemany:
+        cur.fast_executemany = True
+    ins = f"INSERT INTO {dialect.key_table} (t, n) VALUES (?, ?)"
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        try:
+            cur.executemany(ins, batch)
+        except Exception as e:
+            errors.append((f"写入工单键 {i + 1}-{i + len(batch)}", e))
+    cur.close()
+    return errors
+
+
+def _stream_bom(erp, keys, on_start, on_chunk, batch_size, chunk_size, on_batch=None):
+    """
+    执行集合查询，并以 fetchmany 分块把结果行交给 on_chunk(rows)。
+    每次 (重) 试开始前调用 on_start()，便于调用方清空已收数据。
+    on_batch(kind, index, seconds, rows) 在查询读取完毕后回调一次。
+    """
+    keys = [(str(t), str(n)) for t, n in keys]
+
+    def work(conn):
+        on_start()
+        t0 = time.perf_counter()
+        n = 0
+        dialect = erp.dialect
+        errors = load_key_table(conn, dialect, keys, batch_size)
+        if errors:
+            raise ErpFetchError(errors)
+        cur = conn.cursor()
+        try:
+            cur.execute(BOM_SELECT.format(keys=dialect.key_table))
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows: break
+                n += len(rows)
+                on_chunk(rows)
+            cur.execute(dialect.drop_key_table)
+        finally:
+            cur.close()
+        if on_batch:
+            on_batch('bom', 0, time.perf_counter() - t0, n)
+
+    try:
+        erp.run(work)
+    except ErpFetchError:
+        raise
+    except Exception as e:
+        raise ErpFetchError([("BOM 集合查询", e)]) from e
+
+
+def fetch_bom_setbased(erp, keys, batch_size=5000, chunk_size=10000, on_batch=None):
+    """
+    集合方式获取工单头与 BOM，返回与 _fetch_erp_data 相同的 dict 结构。
+    任一批次失败都抛出 ErpFetchError。
+    """
+    if not keys: return {}
+    data = defaultdict(lambda: {'status': '', 'total': 0, 'bom': []})
+
+    def on_chunk(rows):
+        for t, n, total, status, p, name, unit, req, iss in rows:
+            d = data[(t, n)]
+            d['total'] = float(total)
+            d['status'] = str(status).strip()
+            d['bom'].append({'part': p, 'name': name, 'unit': unit, 'req': float(req), 'iss': float(iss)})
+
+    _stream_bom(erp, keys, data.clear, on_chunk, batch_size, chunk_size, on_batch)
+    return data
+
+
+def fetch_bom_columnar(erp, keys, batch_size=5000, chunk_size=10000, on_batch=None):
+    """
+    集合查询结果直接流入 BomStoreBuilder，返回 kitting_engine.BomStore。
+    内存与耗时随行数线性增长，且不产生逐行 dict。
+    """
+    from kitting_engine import BomStoreBuilder, gc_paused
+    builder = [BomStoreBuilder()]
+
+    def on_start():
+        builder[0] = BomStoreBuilder()
+
+    with gc_paused():
+        _stream_bom(erp, keys, on_start, lambda rows: builder[0].add_rows(rows), batch_size, chunk_size,
+                    on_batch)
+    return builder[0].build()
+
+
+INVENTORY_SELECT = "SELECT RTRIM(MC001) p, SUM(MC007) q FROM INVMC{where} GROUP BY MC001"
+
+# 自动选择库存查询方式的代价模型 (单位: 顺序扫描一行)
+INV_SEEK_COST = 8.0         # IN 列表按索引查找，每命中一行的代价
+INV_BATCH_COST = 2000.0     # 每次 IN 查询的往返与编译代价
+
+
+def _inventory_query(parts=None, include=None, exclude=None):
+    """
+    库存汇总语句与参数。parts 为 None 时整表汇总；
+    include / exclude 为只计入 / 不计入的库别 (MC002)，例如排除待验仓、不良品仓。
+    """
+    conds, params = [], []
+    if parts is not None:
+        conds.append(f"MC001 IN ({','.join('?' * len(parts))})")
+        params += parts
+    if include:
+        conds.append(f"MC002 IN ({','.join('?' * len(include))})")
+        params += list(include)
+    if exclude:
+        conds.append(f"MC002 NOT IN ({','.join('?' * len(exclude))})")
+        params += list(exclude)
+    return INVENTORY_SELECT.format(where=" WHERE " + " AND ".join(conds) if conds else ""), params
+
+
+def _inventory_rows(conn, parts=None, include=None, exclude=None, chunk_size=10000):
+    sql, params = _inventory_query(parts, include, exclude)
+    cur = conn.cursor()
+    try:
+        if params:
+            cur.execute(sql, params)
+        else:
+            cur.execute(sql)
+        rows = []
+        while True:
+            chunk = cur.fetchmany(chunk_size)
+            if not chunk: break
+            rows += chunk
+        return rows
+    finally:
+        cur.close()
+
+
+def _put_inventory(inv, rows, wanted=None):
+    for p, q in rows:
+        if wanted is None or p in wanted:
+            inv[p] = float(q) if q is not None else float("nan")
+
+
+def inventory_table_stats(conn, dialect):
+    """(INVMC 行数, INVMB 行数)，取自表统计信息；无权限或查询失败时返回 None。"""
+    cur = conn.cursor()
+    try:
+        cur.execute(dialect.inventory_stats)
+        row = cur.fetchone()
+    except Exception:
+        return None
+    finally:
+        cur.close()
+    if not row or not row[0]:
+        return None
+    return int(row[0]), int(row[1] or 0)
+
+
+def inventory_scan_threshold(stats, part_batch=500, seek_cost=INV_SEEK_COST, batch_cost=INV_BATCH_COST):
+    """
+    品号数达到多少时，整表汇总比 IN 列表分批查询更省；stats 为 None 时返回 None (只用 IN 列表)。
+    IN 列表代价 ≈ 命中行数 × seek_cost + 批数 × batch_cost，命中行数 ≈ INVMC 行数 × 品号数 / 品号总数；
+    整表汇总代价 ≈ INVMC 行数。
+    """
+    if not stats:
+        return None
+    inv_rows, items = stats
+    per_part = inv_rows / max(items, 1) * seek_cost + batch_cost / part_batch
+    return max(1, math.ceil(inv_rows / per_part))
+
+
+def _scan_threshold(strategy, measure, part_batch):
+    """按 strategy 返回转为整表汇总的品号数门槛 ('in' 为 None，'scan' 为 0)。"""
+    if strategy == "scan":
+        return 0
+    if strategy == "in":
+        return None
+    return inventory_scan_threshold(measure(), part_batch)
+
+
+def fetch_inventory_streaming(erp, parts, batch_size=500, chunk_size=10000, on_batch=None,
+                              include=None, exclude=None, strategy="auto"):
+    """
+    在复用连接上查询库存，返回 {品号: 数量}。
+    strategy: "in" 参数化 IN 列表分批 / "scan" 整表汇总一次 / "auto" 按品号数与表统计选择。
+    """
+    parts = [p for p in dict.fromkeys(parts) if p is not None]
+    inv = {}
+    if not parts: return inv
+
+    def measure():
+        if erp.inventory_stats is None:
+            erp.inventory_stats = erp.run(lambda conn: inventory_table_stats(conn, erp.dialect)) or ()
+        return erp.inventory_stats
+
+    threshold = _scan_threshold(strategy, measure, batch_size)
+    if threshold is not None and len(parts) >= threshold:
+        t0 = time.perf_counter()
+        try:
+            rows = erp.run(lambda conn: _inventory_rows(conn, None, include, exclude, chunk_size))
+        except Exception as e:
+            raise ErpFetchError([("库存整表汇总", e)])
+        if on_batch:
+            on_batch('inv_scan', 0, time.perf_counter() - t0, len(rows))
+        _put_inventory(inv, rows, set(parts))
+        return inv
+
+    errors = []
+    for i in range(0, len(parts), batch_size):
+        batch = parts[i:i + batch_size]
+        try:
+            t0 = time.perf_counter()
+            rows = erp.run(lambda conn: _inventory_rows(conn, batch, include, exclude, chunk_size))
+            if on_batch:
+                on_batch('inv', i // batch_size, time.perf_counter() - t0, len(rows))
+        except Exception as e:
+            errors.append((f"库存批次 {i // batch_size + 1}", e))
+            continue
+        _put_inventory(inv, rows)
+    if errors:
+        raise ErpFetchError(errors)
+    return inv
+
+
+class ConnectionPool:
+    """
+    有限大小的连接池。连接按需创建，出错的连接直接丢弃，下次取用时重建。
+    """
+
+    def __init__(self, connect, size=4, dialect=None):
+        self._connect = connect
+        self.size = size
+        self.dialect = dialect
+        self.inventory_stats = None     # 同 ErpConnection.inventory_stats
+        self._idle = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+
+    def acquire(self, timeout=None):
+        self._slots.get(timeout=timeout)
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = self._connect()
+        except Exception:
+            self._slots.put(None)
+            raise
+        if self.dialect is None:
+            self.dialect = _guess_dialect(conn)
+        return conn
+
+    def release(self, conn):
+        self._idle.put(conn)
+        self._slots.put(None)
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._slots.put(None)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def run_with_retry(pool, work, timeout=60, retries=2, backoff=0.5):
+    """
+    从连接池取连接执行 work(conn, dialect)，带单次查询超时；
+    失败时丢弃连接，按 backoff * 2^n 秒退避后重试，最多 retries 次。
+    """
+    for attempt in range(retries + 1):
+        conn = pool.acquire()
+        try:
+            pool.dialect.set_timeout(conn, timeout)
+            out = work(conn, pool.dialect)
+        except Exception:
+            pool.discard(conn)
+            if attempt >= retries:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+        else:
+            pool.release(conn)
+            return out
+
+
+def _bom_batch_rows(conn, dialect, keys):
+    errors = load_key_table(conn, dialect, keys)
+    if errors:
+        raise errors[0][1]
+    cur = conn.cursor()
+    try:
+        cur.execute(BOM_SELECT.format(keys=dialect.key_table))
+        rows = cur.fetchall()
+        cur.execute(dialect.drop_key_table)
+    finally:
+        cur.close()
+    return rows
+
+
+def _pool_inventory_stats(pool, timeout, retries):
+    """连接池对应库的库存表统计 (只测一次)。"""
+    if pool.inventory_stats is None:
+        try:
+            pool.inventory_stats = run_with_retry(pool, inventory_table_stats, timeout, retries) or ()
+        except Exception:
+            pool.inventory_stats = ()
+    return pool.inventory_stats
+
+
+def fetch_pipelined(pool, keys, batch_size=500, part_batch=500, timeout=60, retries=2, backoff=0.5,
+                    on_batch=None, include=None, exclude=None, inv_strategy="auto"):
+    """
+    流水线获取 BOM 与库存，返回 (BomStore, {品号: 数量})。
+
+    - BOM 按 batch_size 张工单一批，在 pool.size 个连接上并发查询；
+    - 每批 BOM 到达即为其中首次出现的品号提交库存查询 (每批最多 part_batch 个品号，参数化 IN)；
+      inv_strategy 为 "auto" 时，累计品号数一旦超过表统计估算的门槛，改为提交一次整表汇总，
+      之后新出现的品号不再单独查询；"scan" 开始时即整表汇总，"in" 始终用 IN 列表；
+    - include / exclude: 计入 / 不计入的库别 (MC002)；
+    - 每次查询有 timeout 秒超时，失败按退避重试；全部结束后若仍有失败批次则抛出 ErpFetchError。
+    on_batch(kind, index, seconds, rows) 在每批完成后回调 (kind 为 'bom' / 'inv' / 'inv_scan')。
+    """
+    from kitting_engine import BomStoreBuilder
+    builder = BomStoreBuilder()
+    inventory = {}
+    keys = [(str(t), str(n)) for t, n in keys]
+    if not keys:
+        return builder.build(), inventory
+    threshold = _scan_threshold(inv_strategy, lambda: _pool_inventory_stats(pool, timeout, retries), part_batch)
+
+    def timed(kind, idx, fn, arg):
+        def job():
+            t0 = time.perf_counter()
+            rows = run_with_retry(pool, lambda conn, dialect: fn(conn, dialect, arg), timeout, retries, backoff)
+            return kind, idx, time.perf_counter() - t0, rows
+        return job
+
+    errors = []
+    seen_parts = set()
+    inv_batches = 0
+    scanned = None
+    with ThreadPoolExecutor(max_workers=pool.size) as ex:
+        pending = {}
+
+        def submit_scan():
+            f = ex.submit(timed('inv_scan', 0, lambda conn, dialect, _: _inventory_rows(conn, None, include, exclude),
+                                None))
+            pending[f] = "库存整表汇总"
+            return []
+
+        if threshold == 0:
+            scanned = submit_scan()
+        for i in range(0, len(keys), batch_size):
+            f = ex.submit(timed('bom', i // batch_size, _bom_batch_rows, keys[i:i + batch_size]))
+            pending[f] = f"BOM 批次 {i // batch_size + 1}"
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                where = pending.pop(f)
+                try:
+                    kind, idx, secs, rows = f.result()
+                except Exception as e:
+                    errors.append((where, e))
+                    continue
+                if on_batch:
+                    on_batch(kind, idx, secs, len(rows))
+                if kind == 'bom':
+                    builder.add_rows(rows)
+                    new_parts = [p for p in {r[4] for r in rows} - seen_parts if p is not None]
+                    seen_parts.update(new_parts)
+                    if scanned is None and threshold is not None and len(seen_parts) >= threshold:
+                        scanned = submit_scan()
+                    if scanned is not None:
+                        continue
+                    for j in range(0, len(new_parts), part_batch):
+                        inv_batches += 1
+                        f2 = ex.submit(timed('inv', inv_batches,
+                                             lambda conn, dialect, b: _inventory_rows(conn, b, include, exclude),
+                                             new_parts[j:j + part_batch]))
+                        pending[f2] = f"库存批次 {inv_batches}"
+                elif kind == 'inv_scan':
+                    scanned = rows
+                else:
+                    _put_inventory(inventory, rows)
+    if errors:
+        raise ErpFetchError(errors)
+    # 整表汇总只保留本次用到的品号
+    _put_inventory(inventory, scanned or (), seen_parts)
+    return builder.build(), inventory
+
+
+def fetch_inventory_pooled(pool, parts, part_batch=500, timeout=60, retries=2, backoff=0.5, on_batch=None,
+                           include=None, exclude=None, strategy="auto"):
+    """
+    在连接池上查询一组品号的库存，返回 {品号: 数量}。
+    strategy / include / exclude 同 fetch_inventory_streaming；IN 列表各批并发执行。
+    """
+    parts = [p for p in dict.fromkeys(parts) if p is not None]
+    inventory, errors = {}, []
+    if not parts:
+        return inventory
+    threshold = _scan_threshold(strategy, lambda: _pool_inventory_stats(pool, timeout, retries), part_batch)
+    if threshold is not None and len(parts) >= threshold:
+        t0 = time.perf_counter()
+        try:
+            rows = run_with_retry(pool, lambda conn, dialect: _inventory_rows(conn, None, include, exclude),
+                                  timeout, retries, backoff)
+        except Exception as e:
+            raise ErpFetchError([("库存整表汇总", e)])
+        if on_batch:
+            on_batch('inv_scan', 0, time.perf_counter() - t0, len(rows))
+        _put_inventory(inventory, rows, set(parts))
+        return inventory
+    batches = [parts[i:i + part_batch] for i in range(0, len(parts), part_batch)]
+
+    def job(b):
+        t0 = time.perf_counter()
+        rows = run_with_retry(pool, lambda conn, dialect: _inventory_rows(conn, b, include, exclude),
+                              timeout, retries, backoff)
+        return time.perf_counter() - t0, rows
+
+    with ThreadPoolExecutor(max_workers=pool.size) as ex:
+        futures = [ex.submit(job, b) for b in batches]
+        for i, f in enumerate(futures):
+            try:
+                secs, rows = f.result()
+            except Exception as e:
+                errors.append((f"库存批次 {i + 1}", e))
+                continue
+            if on_batch:
+                on_batch('inv', i, secs, len(rows))
+            _put_inventory(inventory, rows)
+    if errors:
+        raise ErpFetchError(errors)
+    return inventory
+
+
+# 在途供应：已确认、未结束的采购单身未交量按预交货日；已确认、未完工的工单未产量按预计完工日
+SUPPLY_SELECTS = (
+    ('po', "SELECT RTRIM(TD004), TD012, TD008 - TD015 FROM PURTD "
+           "WHERE TD016 = 'N' AND TD018 = 'Y' AND TD008 > TD015 AND TD004 IN ({parts})"),
+    ('mo', "SELECT RTRIM(TA006), TA010, TA015 - TA017 FROM MOCTA "
+           "WHERE TA011 NOT IN ('Y', 'y') AND TA013 = 'Y' AND TA015 > TA017 AND TA006 IN ({parts})"),
+)
+
+
+def parse_erp_date(val):
+    """ERP 日期 ('YYYYMMDD' 文本，或驱动转换后的 date/datetime)；无法识别时返回 None。"""
+    if isinstance(val, datetime.datetime):
+        return val.date()
+    if isinstance(val, datetime.date):
+        return val
+    try:
+        return datetime.datetime.strptime(str(val).strip()[:8], "%Y%m%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_supply(pool, parts, part_batch=500, timeout=60, retries=2, backoff=0.5, on_batch=None):
+    """
+    查询一组品号的在途供应，返回 [(品号, 预计到货日 date 或 None, 数量, 来源 'po' / 'mo')]。
+    各品号批次与两类来源的查询在连接池上并发执行。
+    """
+    parts = [p for p in dict.fromkeys(parts) if p is not None]
+    batches = [parts[i:i + part_batch] for i in range(0, len(parts), part_batch)]
+    jobs = [(src, sql, b) for src, sql in SUPPLY_SELECTS for b in batches]
+    if not jobs:
+        return []
+
+    def job(sql, b):
+        def work(conn, dialect):
+            cur = conn.cursor()
+            try:
+                cur.execute(sql.format(parts=",".join("?" * len(b))), b)
+                return cur.fetchall()
+            finally:
+                cur.close()
+        t0 = time.perf_counter()
+        rows = run_with_retry(pool, work, timeout, retries, backoff)
+        return time.perf_counter() - t0, rows
+
+    supply, errors = [], []
+    with ThreadPoolExecutor(max_workers=pool.size) as ex:
+        futures = [ex.submit(job, sql, b) for _, sql, b in jobs]
+        for i, ((src, _, _), f) in enumerate(zip(jobs, futures)):
+            try:
+                secs, rows = f.result()
+            except Exception as e:
+                errors.append((f"在途供应批次 {i + 1} ({src})", e))
+                continue
+            if on_batch:
+                on_batch('supply', i, secs, len(rows))
+            supply += [(p, parse_erp_date(d), float(q), src) for p, d, q in rows if q is not None]
+    if errors:
+        raise ErpFetchError(errors)
+    return supply
+
+
+# 品号 BOM：只取品号属性为自制 / 托外 / 虚设 (INVMB.MB025 = M / S / Y) 的母件
+ITEM_BOM_SELECT = """
+    SELECT RTRIM(MD.MD001), RTRIM(MD.MD003), MD.MD006, MD.MD007, MD.MD008,
+           COALESCE(RTRIM(MB.MB002),''), COALESCE(RTRIM(MB.MB004),'')
+    FROM BOMMD MD
+    INNER JOIN INVMB P ON P.MB001 = MD.MD001
+    LEFT JOIN INVMB MB ON MB.MB001 = MD.MD003
+    WHERE P.MB025 IN ('M', 'S', 'Y') AND MD.MD001 IN ({parts})
+"""
+
+
+def fetch_item_bom(pool, parts, part_batch=500, timeout=60, retries=2, backoff=0.5, on_batch=None):
+    """
+    从 parts 出发逐阶查询品号 BOM，返回 [(母件, 子件, 组成用量, 底数, 损耗率, 子件品名, 子件单位)]
+    (可直接交给 kitting_engine.ItemBom)。
+    每一阶只查上一阶新出现的子件，同一阶的各批在连接池上并发执行；每个品号只查一次，
+    结构中有循环也会停止。
+    """
+    seen = set()
+    frontier = [p for p in dict.fromkeys(parts) if p is not None]
+    rows, errors = [], []
+    idx = 0
+
+    def job(b):
+        def work(conn, dialect):
+            cur = conn.cursor()
+            try:
+                cur.execute(ITEM_BOM_SELECT.format(parts=",".join("?" * len(b))), b)
+                return cur.fetchall()
+            finally:
+                cur.close()
+        t0 = time.perf_counter()
+        got = run_with_retry(pool, work, timeout, retries, backoff)
+        return time.perf_counter() - t0, got
+
+    with ThreadPoolExecutor(max_workers=pool.size) as ex:
+        while frontier:
+            seen.update(frontier)
+            batches = [frontier[i:i + part_batch] for i in range(0, len(frontier), part_batch)]
+            futures = [ex.submit(job, b) for b in batches]
+            level = []
+            for f in futures:
+                idx += 1
+                try:
+                    secs, got = f.result()
+                except Exception as e:
+                    errors.append((f"品号BOM批次 {idx}", e))
+                    continue
+                if on_batch:
+                    on_batch('item_bom', idx - 1, secs, len(got))
+                level += got
+            if errors:
+                raise ErpFetchError(errors)
+            rows += level
+            frontier = [c for c in dict.fromkeys(r[1] for r in level) if c is not None and c not in seen]
+    return rows
+
+
+# 按键表的列分组：以 MOCTA 列分组时，部分优化器会为避免排序而全表扫描 MOCTA
+VERSION_SELECT = """
+    SELECT K.t, K.n, TA.TA011, TA.TA015, TA.MODI_DATE,
+           COUNT(TB.TB003), SUM(TB.TB004), SUM(TB.TB005), MAX(TB.MODI_DATE)
+    FROM {keys} K
+    INNER JOIN MOCTA TA ON TA.TA001=K.t AND TA.TA002=K.n
+    LEFT JOIN MOCTB TB ON TA.TA001=TB.TB001 AND TA.TA002=TB.TB002
+    GROUP BY K.t, K.n, TA.TA011, TA.TA015, TA.MODI_DATE
+"""
+
+
+def fetch_bom_versions(pool, keys, batch_size=2000, timeout=60, retries=2, on_batch=None):
+    """
+    查询工单的 "版本戳"：状态、预计产量、修改日期 (MODI_DATE) 以及 BOM 行数、
+    需领/已领合计。任何一项变化都说明缓存中的 BOM 已过期。
+    返回 {(单别, 单号): 版本戳字符串}；ERP 中不存在的工单不出现在结果中。
+    """
+    keys = [(str(t), str(n)) for t, n in keys]
+    stamps = {}
+
+    def work(conn, dialect, batch):
+        errors = load_key_table(conn, dialect, batch)
+        if errors:
+            raise errors[0][1]
+        cur = conn.cursor()
+        try:
+            cur.execute(VERSION_SELECT.format(keys=dialect.key_table))
+            rows = cur.fetchall()
+            cur.execute(dialect.drop_key_table)
+        finally:
+            cur.close()
+        return rows
+
+    errors = []
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        try:
+            t0 = time.perf_counter()
+            rows = run_with_retry(pool, lambda conn, dialect: work(conn, dialect, batch), timeout, retries)
+        except Exception as e:
+            errors.append((f"版本查询批次 {i // batch_size + 1}", e))
+            continue
+        if on_batch:
+            on_batch('version', i // batch_size, time.perf_counter() - t0, len(rows))
+        for r in rows:
+            stamps[(r[0], r[1])] = "|".join("" if x is None else str(x).strip() for x in r[2:])
+    if errors:
+        raise ErpFetchError(errors)
+    return stamps
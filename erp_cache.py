@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+ERP 本地快照缓存 (SQLite 文件，默认放在程序旁边)
+
+- 工单表头 + BOM 按 (TA001, TA002) 缓存 (每张工单的 BOM 列打包成一个 BLOB，
+  读回时整单写入 BomStoreBuilder)，库存按品号缓存，各自有 TTL；
+- 过期的工单先用一次轻量的版本查询 (MODI_DATE、状态、BOM 合计) 比对，
+  未变化的只刷新时间戳，变化的和缺失的才重新拉取 BOM；
+- 库存变化频繁且修改日期只精确到天，只按 TTL 刷新；
+- 保留若干天的快照，超出天数或文件大小上限时从最旧的开始淘汰。
+"""
+import marshal
+import os
+import sqlite3
+import time
+
+from kitting_engine import BomStoreBuilder, gc_paused
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wo_header (
+    t TEXT NOT NULL, n TEXT NOT NULL, found INTEGER NOT NULL, total REAL, status TEXT,
+    bom BLOB, stamp TEXT, fetched_at REAL NOT NULL, PRIMARY KEY (t, n));
+CREATE INDEX IF NOT EXISTS ix_wo_header_fetched ON wo_header (fetched_at);
+CREATE TABLE IF NOT EXISTS inventory (
+    part TEXT PRIMARY KEY, qty REAL, fetched_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ix_inventory_fetched ON inventory (fetched_at);
+CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+"""
+
+
+class ErpCache:
+    """
+    path: 缓存文件路径
+    bom_ttl / inv_ttl: 工单 BOM / 库存的有效期 (秒)
+    keep_days: 快照最长保留天数；max_bytes: 缓存文件大小上限
+    inv_scope: 库存口径 (如库别过滤条件)，与缓存中记录的不同时清空库存缓存
+    """
+
+    def __init__(self, path, bom_ttl=4 * 3600, inv_ttl=15 * 60, keep_days=7, max_bytes=512 * 1024 * 1024,
+                 inv_scope=""):
+        self.path = path
+        self.bom_ttl = bom_ttl
+        self.inv_ttl = inv_ttl
+        self.keep_days = keep_days
+        self.max_bytes = max_bytes
+        new_file = not os.path.exists(path)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if new_file:
+            self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT v FROM meta WHERE k='inv_scope'").fetchone()
+        if row is None or row[0] != inv_scope:
+            with self.db:
+                self.db.execute("DELETE FROM inventory")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('inv_scope', ?)", (inv_scope,))
+
+    def close(self):
+        self.db.close()
+
+    # ---------- 工单 / BOM ----------
+
+    def _load_key_table(self, keys):
+        self.db.execute("DROP TABLE IF EXISTS temp.req_keys")
+        self.db.execute("CREATE TEMP TABLE req_keys (t TEXT NOT NULL, n TEXT NOT NULL, PRIMARY KEY (t, n))")
+        self.db.executemany("INSERT OR IGNORE INTO temp.req_keys VALUES (?, ?)", keys)
+
+    def _classify(self, keys, now):
+        """把请求的工单分成 新鲜 / 过期 / 缺失 三类。返回 (stale{key: stamp}, missing[key])。"""
+        self._load_key_table(keys)
+        cached = {}
+        for t, n, stamp, fetched_at in self.db.execute(
+                "SELECT h.t, h.n, h.stamp, h.fetched_at FROM temp.req_keys k "
+                "JOIN wo_header h ON h.t=k.t AND h.n=k.n"):
+            cached[(t, n)] = (stamp, fetched_at)
+        stale, missing = {}, []
+        for key in keys:
+            c = cached.get(key)
+            if c is None:
+                missing.append(key)
+            elif now - c[1] >= self.bom_ttl:
+                stale[key] = c[0]
+        return stale, missing
+
+    def _store_bom(self, store, keys, stamps, now):
+        """写入新拉取的 BOM。keys 中 ERP 没有返回的工单记为 found=0 (同样缓存)。"""
+        pv, lv = store.parts.values, store.labels.values
+        rows = []
+        for key in keys:
+            k = store.key_index.get(key)
+            if k is None:
+                rows.append((key[0], key[1], 0, None, None, None, stamps.get(key), now))
+                continue
+            s, e = store.offsets[k], store.offsets[k + 1]
+            bom = marshal.dumps(([pv[i] for i in store.part_id[s:e].tolist()],
+                                 [lv[i] for i in store.name_id[s:e].tolist()],
+                                 [lv[i] for i in store.unit_id[s:e].tolist()],
+                                 store.req[s:e].tobytes(), store.iss[s:e].tobytes()))
+            rows.append((key[0], key[1], 1, float(store.total[k]), 'Y' if store.done[k] else '',
+                         bom, stamps.get(key), now))
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO wo_header VALUES (?,?,?,?,?,?,?,?)", rows)
+
+    def _read_bom(self, keys):
+        self._load_key_table(keys)
+        builder = BomStoreBuilder()
+        with gc_paused():
+            for t, n, total, status, bom in self.db.execute(
+                    "SELECT h.t, h.n, h.total, h.status, h.bom FROM temp.req_keys k "
+                    "JOIN wo_header h ON h.t=k.t AND h.n=k.n AND h.found=1"):
+                parts, names, units, req, iss = marshal.loads(bom)
+                builder.add_order((t, n), total, status == 'Y', parts, names, units, req, iss)
+        return builder.build()
+
+    # ---------- 库存 ----------
+
+    def _read_inventory(self, parts, now):
+        """返回 (缓存中未过期的库存, 需要重新查询的品号)。"""
+        self.db.execute("DROP TABLE IF EXISTS temp.req_parts")
+        self.db.execute("CREATE TEMP TABLE req_parts (part TEXT PRIMARY KEY)")
+        self.db.executemany("INSERT OR IGNORE INTO temp.req_parts VALUES (?)", [(p,) for p in parts])
+        inv, fresh = {}, set()
+        for p, q, fetched_at in self.db.execute(
+                "SELECT i.part, i.qty, i.fetched_at FROM temp.req_parts r JOIN inventory i ON i.part=r.part"):
+            if now - fetched_at < self.inv_ttl:
+                fresh.add(p)
+                # qty 为 NULL 表示 ERP 中没有该品号的库存记录
+                if q is not None:
+                    inv[p] = q
+        return inv, [p for p in parts if p not in fresh]
+
+    def _store_inventory(self, parts, inv, now):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO inventory VALUES (?,?,?)",
+                                [(p, inv.get(p), now) for p in parts])
+
+    # ---------- 对外接口 ----------
+
+    def fetch(self, keys, fetch_bom, fetch_versions, fetch_inventory, force=False, log=None):
+        """
+        keys: 需要的工单键
+        fetch_bom(keys) -> (BomStore, 顺带查到的库存 dict 或 None)
+        fetch_versions(keys) -> {key: 版本戳}
+        fetch_inventory(parts) -> {品号: 数量}
+        force: 忽略缓存全部重新拉取
+        返回 (BomStore, {品号: 数量})，与 fetch_pipelined 相同。
+        """
+        log = log or (lambda msg: None)
+        now = time.time()
+        keys = list(dict.fromkeys((str(t), str(n)) for t, n in keys))
+
+        if force:
+            stale, missing = {}, keys
+        else:
+            stale, missing = self._classify(keys, now)
+
+        to_fetch = list(missing)
+        check = list(stale) + missing
+        stamps = {}
+        if check:
+            try:
+                stamps = fetch_versions(check)
+            except Exception as e:
+                # 版本查询失败 (例如库中无 MODI_DATE 列) 时，过期工单一律重新拉取
+                log(f"版本查询失败，过期工单全部重新拉取: {e}")
+                stamps = {}
+                to_fetch += list(stale)
+            else:
+                unchanged = [k for k, old in stale.items() if old is not None and stamps.get(k) == old]
+                unchanged_set = set(unchanged)
+                to_fetch += [k for k in stale if k not in unchanged_set]
+                if unchanged:
+                    with self.db:
+                        self.db.executemany("UPDATE wo_header SET fetched_at=? WHERE t=? AND n=?",
+                                            [(now, t, n) for t, n in unchanged])
+
+        queried, fetched_inv = set(), {}
+        if to_fetch:
+            log(f"ERP 缓存: {len(keys) - len(to_fetch)} 张工单命中, {len(to_fetch)} 张需拉取")
+            fresh_store, partial_inv = fetch_bom(to_fetch)
+            self._store_bom(fresh_store, to_fetch, stamps, now)
+            if partial_inv is not None:
+                # 流水线顺带查到的库存；ERP 中没有库存记录的品号也记为已查询
+                queried, fetched_inv = set(fresh_store.parts.values), partial_inv
+                self._store_inventory(list(queried), fetched_inv, now)
+        else:
+            log(f"ERP 缓存: {len(keys)} 张工单全部命中")
+
+        store = self._read_bom(keys)
+
+        parts = list(store.parts.values)
+        if force:
+            inv = {p: fetched_inv[p] for p in parts if p in fetched_inv}
+            need = [p for p in parts if p not in queried]
+        else:
+            inv, need = self._read_inventory(parts, now)
+        if need:
+            more = fetch_inventory(need)
+            self._store_inventory(need, more, now)
+            inv.update(more)
+        log(f"库存缓存: {len(parts) - len(need)} 个品号命中, {len(need)} 个重新查询")
+
+        self.evict(now)
+        return store, inv
+
+    def evict(self, now=None):
+        """淘汰超过保留天数的快照；文件超过大小上限时继续按时间从旧到新淘汰。"""
+        now = now or time.time()
+        cutoff = now - self.keep_days * 86400
+        with self.db:
+            self.db.execute("DELETE FROM wo_header WHERE fetched_at < ?", (cutoff,))
+            self.db.execute("DELETE FROM inventory WHERE fetched_at < ?", (cutoff,))
+        while self._size() > self.max_bytes:
+            row = self.db.execute("SELECT COUNT(*), MIN(fetched_at) FROM wo_header").fetchone()
+            if not row[0]: break
+            # 每轮淘汰最旧的约 10%
+            oldest = self.db.execute("SELECT fetched_at FROM wo_header ORDER BY fetched_at LIMIT 1 OFFSET ?",
+                                     (max(row[0] // 10, 1) - 1,)).fetchone()[0]
+            with self.db:
+                self.db.execute("DELETE FROM wo_header WHERE fetched_at <= ?", (oldest,))
+                self.db.execute("DELETE FROM inventory WHERE fetched_at <= ?", (oldest,))
+            self.db.execute("PRAGMA incremental_vacuum")
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.execute("PRAGMA incremental_vacuum")
+
+    def _size(self):
+        page_count = self.db.execute("PRAGMA page_count").fetchone()[0]
+        freelist = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - freelist) * page_size
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+ERP 替身库 (SQLite)
+
+按 FQD 中用到的列建 MOCTA / MOCTB / INVMB / INVMC / PURTD / BOMMD 六张表，供离线测试与压测使用。
+字段名与真实库一致，因此 erp_access 的 SQL 无需改动即可运行。
+日期列与 ERP 相同，为 'YYYYMMDD' 文本。
+"""
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS MOCTA (TA001 TEXT, TA002 TEXT, TA011 TEXT, TA015 REAL, MODI_DATE TEXT,
+                                  TA006 TEXT, TA010 TEXT, TA013 TEXT, TA017 REAL DEFAULT 0,
+                                  PRIMARY KEY (TA001, TA002));
+CREATE TABLE IF NOT EXISTS MOCTB (TB001 TEXT, TB002 TEXT, TB003 TEXT, TB004 REAL, TB005 REAL, MODI_DATE TEXT);
+CREATE INDEX IF NOT EXISTS IX_MOCTB ON MOCTB (TB001, TB002);
+CREATE TABLE IF NOT EXISTS INVMB (MB001 TEXT PRIMARY KEY, MB002 TEXT, MB004 TEXT, MB025 TEXT);
+CREATE TABLE IF NOT EXISTS INVMC (MC001 TEXT, MC002 TEXT, MC007 REAL);
+CREATE INDEX IF NOT EXISTS IX_INVMC ON INVMC (MC001);
+CREATE TABLE IF NOT EXISTS PURTD (TD001 TEXT, TD002 TEXT, TD003 TEXT, TD004 TEXT, TD008 REAL, TD012 TEXT,
+                                  TD015 REAL DEFAULT 0, TD016 TEXT DEFAULT 'N', TD018 TEXT DEFAULT 'Y');
+CREATE INDEX IF NOT EXISTS IX_PURTD ON PURTD (TD004);
+CREATE TABLE IF NOT EXISTS BOMMD (MD001 TEXT, MD002 TEXT, MD003 TEXT, MD006 REAL, MD007 REAL DEFAULT 1,
+                                  MD008 REAL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS IX_BOMMD ON BOMMD (MD001);
+"""
+# 旧版替身库缺少的列，打开时补上：MOCTA 的产出相关列 (产品品号 / 预计完工 / 确认码 / 已生产量)、
+# INVMB 的品号属性 (P 采购 / M 自制 / S 托外 / Y 虚设)
+_ADDED_COLUMNS = (
+    ("MOCTA", (("TA006", "TEXT"), ("TA010", "TEXT"), ("TA013", "TEXT"), ("TA017", "REAL DEFAULT 0"))),
+    ("INVMB", (("MB025", "TEXT"),)),
+)
+
+
+def connect_standin(path=":memory:"):
+    """打开 (或新建) 替身库。自动提交、允许跨线程使用，便于连接池测试。"""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.executescript(SCHEMA)
+    for table, cols in _ADDED_COLUMNS:
+        have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+        for col, decl in cols:
+            if col not in have:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+    return conn
+
+
+class SlowConnection:
+    """
+    给替身库连接注入网络延迟：每次 execute / executemany 先等待 latency 秒。
+    timeout 属性语义同 pyodbc (秒，0 为不限)，延迟超过 timeout 时抛出 TimeoutError。
+    """
+    is_standin = True
+
+    def __init__(self, conn, latency):
+        self._conn = conn
+        self.latency = latency
+        self.timeout = 0
+
+    def _wait(self):
+        if self.timeout and self.latency > self.timeout:
+            time.sleep(self.timeout)
+            raise TimeoutError(f"查询超时 ({self.timeout}s)")
+        time.sleep(self.latency)
+
+    def cursor(self):
+        return _SlowCursor(self._conn.cursor(), self)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _SlowCursor:
+    def __init__(self, cur, owner):
+        self._cur = cur
+        self._owner = owner
+
+    def execute(self, *args):
+        self._owner._wait()
+        self._cur.execute(*args)
+        return self
+
+    def executemany(self, *args):
+        self._owner._wait()
+        self._cur.executemany(*args)
+        return self
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+def standin_factory(path, latency=0.0):
+    """返回打开同一个替身库文件的连接工厂，可选注入延迟，供连接池使用。"""
+    def connect():
+        conn = connect_standin(path)
+        return SlowConnection(conn, latency) if latency else conn
+    return connect
+
+
+def load_standin(conn, wo_data, inventory, warehouse="01"):
+    """
+    把 _fetch_erp_data / _fetch_inventory 形式的数据写入替身库。
+    wo_data: {(单别, 单号): {'status', 'total', 'bom': [{'part','name','unit','req','iss'}]}}
+    inventory: {品号: 数量}
+    """
+    items = {}
+    mocta, moctb = [], []
+    for (t, n), info in wo_data.items():
+        mocta.append((t, n, info['status'], info['total']))
+        for b in info['bom']:
+            moctb.append((t, n, b['part'], b['req'], b['iss']))
+            items.setdefault(b['part'], (b['name'], b['unit']))
+    conn.executemany("INSERT INTO MOCTA (TA001, TA002, TA011, TA015) VALUES (?,?,?,?)", mocta)
+    conn.executemany("INSERT INTO MOCTB (TB001, TB002, TB003, TB004, TB005) VALUES (?,?,?,?,?)", moctb)
+    conn.executemany("INSERT OR REPLACE INTO INVMB (MB001, MB002, MB004) VALUES (?,?,?)",
+                     [(p, name, unit) for p, (name, unit) in items.items()])
+    conn.executemany("INSERT INTO INVMC (MC001, MC002, MC007) VALUES (?,?,?)",
+                     [(p, warehouse, q) for p, q in inventory.items()])
+    conn.commit()
+
+
+def load_supply(conn, purchases=(), productions=()):
+    """
+    写入在途供应 (供逐日推演测试)。
+    purchases: [(品号, 预交货日, 采购数量, 已交数量)]，写成已确认、未结束的采购单身 PURTD；
+    productions: [(单别, 单号, 产品品号, 预计完工日, 预计产量, 已生产量)]，写成已确认、生产中的工单 MOCTA。
+    日期可为 date 或 'YYYYMMDD' 文本。
+    """
+    def ymd(d):
+        return d.strftime("%Y%m%d") if hasattr(d, "strftime") else d
+    conn.executemany("INSERT INTO PURTD (TD001, TD002, TD003, TD004, TD012, TD008, TD015) VALUES (?,?,?,?,?,?,?)",
+                     [("3301", f"S{i // 100:09d}", f"{i % 100 + 1:04d}", p, ymd(d), q, got)
+                      for i, (p, d, q, got) in enumerate(purchases)])
+    conn.executemany("INSERT OR REPLACE INTO MOCTA (TA001, TA002, TA006, TA010, TA015, TA017, TA011, TA013) "
+                     "VALUES (?,?,?,?,?,?,'3','Y')",
+                     [(t, n, p, ymd(d), q, got) for t, n, p, d, q, got in productions])
+    conn.commit()
+
+
+def load_item_bom(conn, rows, names=None, attr="M"):
+    """
+    写入品号 BOM (供多阶展开测试)。
+    rows: [(母件, 子件, 组成用量[, 底数[, 损耗率]])]，母件的品号属性 MB025 记为 attr；
+    names: 可选 {品号: (品名, 单位)}，INVMB 中还没有的品号按此补上。
+    """
+    names = names or {}
+    md = []
+    for i, r in enumerate(rows):
+        parent, child, qty = r[:3]
+        base = r[3] if len(r) > 3 else 1
+        loss = r[4] if len(r) > 4 else 0
+        md.append((parent, f"{i % 10000 + 1:04d}", child, qty, base, loss))
+    conn.executemany("INSERT INTO BOMMD (MD001, MD002, MD003, MD006, MD007, MD008) VALUES (?,?,?,?,?,?)", md)
+    items = {r[0] for r in rows} | {r[1] for r in rows}
+    conn.executemany("INSERT OR IGNORE INTO INVMB (MB001, MB002, MB004) VALUES (?,?,?)",
+                     [(p,) + tuple(names.get(p, (p, "PCS"))) for p in sorted(items)])
+    conn.executemany("UPDATE INVMB SET MB025 = ? WHERE MB001 = ?", [(attr, p) for p in sorted({r[0] for r in rows})])
+    conn.commit()
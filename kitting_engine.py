@@ -0,0 +1,1178 @@
+# -*- coding: utf-8 -*-
+"""
+齐套推演引擎 (数组版)
+
+与 DailyPlanAvailabilityApp._simulate_logic_v3 结果完全一致，但：
+1. BOM 以 CSR 形式保存 (工单 -> 行偏移)，品号/品名/单位均驻留为整数 ID；
+2. 库存是一条 float 向量，按品号 ID 索引；
+3. 齐套率、最小可生产数、当日状态、缺料文字都按批量方式计算；
+4. 可选多阶展开 (BomStore.attach_item_bom)：自制件库存不足的部分按品号 BOM 逐阶展开成下阶用料。
+
+关键点：库存扣减量 (工单总缺口) 与库存余额无关，所以每行 BOM 看到的库存
+就是 "期初库存 依次减去 排在它前面、同品号的扣减量"，可以按品号分组一次算出，
+不需要逐单循环。多阶展开时下阶的扣减量取决于上阶品号的库存，但只取决于阶次更低的品号，
+所以按低阶码逐阶进行，每一阶仍是按品号分组的一次计算。
+"""
+import gc
+from array import array
+from contextlib import contextmanager
+from operator import itemgetter
+from types import SimpleNamespace
+
+import numpy as np
+
+
+@contextmanager
+def gc_paused():
+    """
+    批量读取时暂停分代 GC：大量短命元组会反复触发回收，
+    而这期间新建的对象都不会形成循环引用。
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class StringPool:
+    """字符串驻留表：相同字符串只保存一份，用连续整数 ID 表示。"""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def intern(self, s):
+        i = self.index.get(s)
+        if i is None:
+            i = len(self.values)
+            self.index[s] = i
+            self.values.append(s)
+        return i
+
+    def intern_many(self, seq):
+        """批量驻留，返回 ID 列表 (新值按首次出现顺序编号)。"""
+        index = self.index
+        if not index.keys() >= set(seq):
+            for s in seq:
+                if s not in index:
+                    index[s] = len(self.values)
+                    self.values.append(s)
+        return list(map(index.__getitem__, seq))
+
+    def __len__(self):
+        return len(self.values)
+
+
+class BomStore:
+    """
+    CSR 形式的工单 BOM：
+    - keys[k] = (单别, 单号)，offsets[k]:offsets[k+1] 为该工单的 BOM 行；
+    - 行数组 part_id / name_id / unit_id / req / iss / unit_use；
+    - 工单数组 total / done (TA011 == 'Y')。
+    """
+
+    def __init__(self, keys, total, done, offsets, part_id, name_id, unit_id, req, iss, parts, labels):
+        self.keys = keys
+        self.key_index = {k: i for i, k in enumerate(keys)}
+        self.total = np.asarray(total, dtype=np.float64)
+        self.done = np.asarray(done, dtype=bool)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.part_id = np.asarray(part_id, dtype=np.int32)
+        self.name_id = np.asarray(name_id, dtype=np.int32)
+        self.unit_id = np.asarray(unit_id, dtype=np.int32)
+        self.req = np.asarray(req, dtype=np.float64)
+        self.iss = np.asarray(iss, dtype=np.float64)
+        self.parts = parts      # 品号 StringPool
+        self.labels = labels    # 品名/单位 StringPool
+        self.item_bom = None    # 多阶展开用的品号 BOM (ItemBom)，见 attach_item_bom
+        self.explosion = None   # item_bom 按本对象品号 ID 编译后的子件表
+
+        line_total = np.repeat(self.total, np.diff(self.offsets))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.unit_use = np.where(line_total > 0, self.req / np.where(line_total > 0, line_total, 1.0), 0.0)
+
+    @classmethod
+    def from_wo_data(cls, wo_data):
+        """由 _fetch_erp_data 返回的 dict 结构构建。"""
+        parts, labels = StringPool(), StringPool()
+        keys, total, done = [], [], []
+        offsets = [0]
+        part_id, name_id, unit_id, req, iss = [], [], [], [], []
+        for key, info in wo_data.items():
+            keys.append(key)
+            total.append(info['total'])
+            done.append(info['status'].upper() == 'Y')
+            for b in info['bom']:
+                part_id.append(parts.intern(b['part']))
+                name_id.append(labels.intern(b['name']))
+                unit_id.append(labels.intern(b['unit']))
+                req.append(b['req'])
+                iss.append(b['iss'])
+            offsets.append(len(part_id))
+        return cls(keys, total, done, offsets, part_id, name_id, unit_id, req, iss, parts, labels)
+
+    @property
+    def n_orders(self):
+        return len(self.keys)
+
+    @property
+    def n_lines(self):
+        return len(self.part_id)
+
+    def to_wo_data(self):
+        """还原成 dict 结构，供旧引擎或对比使用。"""
+        data = {}
+        pv, lv = self.parts.values, self.labels.values
+        for k, key in enumerate(self.keys):
+            s, e = self.offsets[k], self.offsets[k + 1]
+            data[key] = {
+                'status': 'Y' if self.done[k] else '',
+                'total': float(self.total[k]),
+                'bom': [{'part': pv[self.part_id[j]], 'name': lv[self.name_id[j]], 'unit': lv[self.unit_id[j]],
+                         'req': float(self.req[j]), 'iss': float(self.iss[j])} for j in range(s, e)]
+            }
+        return data
+
+    def merged(self, other):
+        """
+        并入 other 中本对象没有的工单，返回新的 BomStore。
+        已有工单、品号、品名/单位的 ID 保持不变，新字符串追加在后面。
+        """
+        parts, labels = StringPool(), StringPool()
+        for src, dst in ((self.parts, parts), (self.labels, labels)):
+            dst.values, dst.index = list(src.values), dict(src.index)
+        add = np.array([k for k, key in enumerate(other.keys) if key not in self.key_index], dtype=np.int64)
+        _, line, lens = _expand_lines(other.offsets, add)
+        part_map = np.array(parts.intern_many(other.parts.values), dtype=np.int32)
+        label_map = np.array(labels.intern_many(other.labels.values), dtype=np.int32)
+        offsets = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(lens)))
+        out = BomStore(self.keys + [other.keys[k] for k in add.tolist()],
+                       np.concatenate((self.total, other.total[add])), np.concatenate((self.done, other.done[add])),
+                       offsets, np.concatenate((self.part_id, part_map[other.part_id[line]])),
+                       np.concatenate((self.name_id, label_map[other.name_id[line]])),
+                       np.concatenate((self.unit_id, label_map[other.unit_id[line]])),
+                       np.concatenate((self.req, other.req[line])), np.concatenate((self.iss, other.iss[line])),
+                       parts, labels)
+        item_bom = other.item_bom if self.item_bom is None else self.item_bom.merged(other.item_bom)
+        if item_bom is not None:
+            out.attach_item_bom(item_bom)
+        return out
+
+    def subset(self, slots):
+        """只含指定工单 (槽位) 的 BomStore，品号/品名/单位重新编号，便于发送给子进程。"""
+        slots = np.asarray(slots, dtype=np.int64)
+        _, line, lens = _expand_lines(self.offsets, slots)
+        pools = []
+        ids = []
+        for src, col in ((self.parts, (self.part_id[line],)),
+                         (self.labels, (self.name_id[line], self.unit_id[line]))):
+            used, inverse = np.unique(np.concatenate(col), return_inverse=True)
+            pool = StringPool()
+            pool.values = [src.values[i] for i in used.tolist()]
+            pool.index = {v: i for i, v in enumerate(pool.values)}
+            pools.append(pool)
+            ids.append(np.split(inverse.astype(np.int32), len(col)))
+        offsets = np.zeros(len(slots) + 1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        out = BomStore([self.keys[k] for k in slots.tolist()], self.total[slots], self.done[slots], offsets,
+                       ids[0][0], ids[1][0], ids[1][1], self.req[line], self.iss[line], pools[0], pools[1])
+        if self.item_bom is not None:
+            out.attach_item_bom(self.item_bom)
+        return out
+
+    def attach_item_bom(self, item_bom):
+        """
+        挂接品号 BOM，推演时工单用料中的自制件按其逐阶展开 (见 ItemBom)。
+        从本对象用到的品号出发，把所有下阶子件驻留进品号表并编译成按品号 ID 索引的子件表；
+        返回新增的品号 (调用方需补查其库存)。
+        """
+        n0 = len(self.parts)
+        parents, child, per, name_id, unit_id = [], [], [], [], []
+        children = item_bom.children
+        seen = set()
+        stack = [p for p in self.parts.values if p in children]
+        while stack:
+            p = stack.pop()
+            if p in seen: continue
+            seen.add(p)
+            for c, q in children[p]:
+                name, unit = item_bom.labels.get(c, ("", ""))
+                parents.append(p)
+                child.append(c)
+                per.append(q)
+                name_id.append(name)
+                unit_id.append(unit)
+                if c in children and c not in seen:
+                    stack.append(c)
+        parent_id = np.array(self.parts.intern_many(parents), dtype=np.int64)
+        child_id = np.array(self.parts.intern_many(child), dtype=np.int32)
+        order = np.argsort(parent_id, kind="stable")
+        offsets = np.zeros(len(self.parts) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(parent_id, minlength=len(self.parts)), out=offsets[1:])
+        levels = item_bom.levels
+        level = np.fromiter((levels.get(p, 0) for p in self.parts.values), dtype=np.int64, count=len(self.parts))
+        self.item_bom = item_bom
+        self.explosion = SimpleNamespace(
+            level=level, offsets=offsets, child=child_id[order], per=np.array(per, dtype=np.float64)[order],
+            name_id=np.array(self.labels.intern_many(name_id), dtype=np.int32)[order],
+            unit_id=np.array(self.labels.intern_many(unit_id), dtype=np.int32)[order])
+        return self.parts.values[n0:]
+
+    def inventory_vector(self, inventory):
+        """把 {品号: 数量} 转成按品号 ID 索引的向量，不存在的品号为 0。"""
+        vec = np.zeros(len(self.parts), dtype=np.float64)
+        for code, i in self.parts.index.items():
+            q = inventory.get(code)
+            if q is not None:
+                vec[i] = q
+        return vec
+
+
+class BomStoreBuilder:
+    """
+    流式构建 BomStore：按块接收查询结果行
+    (单别, 单号, 预计产量, 状态, 品号, 品名, 单位, 需领用量, 已领用量)，
+    字符串即时驻留为整数 ID，数量写入定长数组，不生成逐行 dict / DataFrame。
+    """
+
+    def __init__(self):
+        self.parts, self.labels = StringPool(), StringPool()
+        self.keys, self.key_index = [], {}
+        self.total, self.done = array('d'), array('b')
+        self.slot = array('i')
+        self.part_id, self.name_id, self.unit_id = array('i'), array('i'), array('i')
+        self.req, self.iss = array('d'), array('d')
+
+    def add_rows(self, rows):
+        if not rows: return
+        ts, ns, totals, statuses, ps, names, units, reqs, isss = zip(*rows)
+        keys = list(zip(ts, ns))
+        key_index = self.key_index
+        if not key_index.keys() >= set(keys):
+            # 同一工单的表头各行相同，取该块中任意一行即可
+            for key, (tot, st) in dict(zip(keys, zip(totals, statuses))).items():
+                if key not in key_index:
+                    key_index[key] = len(self.keys)
+                    self.keys.append(key)
+                    self.total.append(float(tot))
+                    self.done.append(str(st).strip().upper() == 'Y')
+        self.slot.extend(map(key_index.__getitem__, keys))
+        self.part_id.extend(self.parts.intern_many(ps))
+        self.name_id.extend(self.labels.intern_many(names))
+        self.unit_id.extend(self.labels.intern_many(units))
+        self.req.extend(map(float, reqs))
+        self.iss.extend(map(float, isss))
+
+    def add_order(self, key, total, done, parts, names, units, req, iss):
+        """
+        整张工单一次写入 (供本地缓存使用)：parts/names/units 为字符串序列，
+        req/iss 为 float64 的原始字节。
+        """
+        k = self.key_index.get(key)
+        if k is None:
+            k = len(self.keys)
+            self.key_index[key] = k
+            self.keys.append(key)
+            self.total.append(float(total))
+            self.done.append(bool(done))
+        self.slot.extend(array('i', [k]) * len(parts))
+        self.part_id.extend(self.parts.intern_many(parts))
+        self.name_id.extend(self.labels.intern_many(names))
+        self.unit_id.extend(self.labels.intern_many(units))
+        self.req.frombytes(req)
+        self.iss.frombytes(iss)
+
+    def build(self):
+        n_orders = len(self.keys)
+        slot = np.frombuffer(self.slot, dtype=np.int32) if len(self.slot) else np.zeros(0, dtype=np.int32)
+        order = np.argsort(slot, kind="stable")
+        offsets = np.zeros(n_orders + 1, dtype=np.int64)
+        np.cumsum(np.bincount(slot, minlength=n_orders), out=offsets[1:])
+
+        def col(a, dtype):
+            return (np.frombuffer(a, dtype=dtype) if len(a) else np.zeros(0, dtype=dtype))[order]
+
+        return BomStore(self.keys, np.frombuffer(self.total, dtype=np.float64) if n_orders else [],
+                        np.frombuffer(self.done, dtype=np.int8).astype(bool) if n_orders else [], offsets,
+                        col(self.part_id, np.int32), col(self.name_id, np.int32), col(self.unit_id, np.int32),
+                        col(self.req, np.float64), col(self.iss, np.float64), self.parts, self.labels)
+
+
+class ItemBom:
+    """
+    品号 BOM (多阶展开用)，只含需要展开的自制/托外件。
+    rows: [(母件, 子件, 组成用量, 底数, 损耗率, 子件品名, 子件单位)]，见 erp_access.fetch_item_bom。
+
+    - children: {母件: [(子件, 每 1 单位母件的用量)]}。用量在构建时按底数与损耗率折算，
+      同一母件的重复子件合并；之后任何数量的母件都按此比例展开，整次运行的所有工单共用，不再回查结构；
+    - levels: {品号: 低阶码}，即在所有结构中出现的最深阶次 (母件总低于其子件)，
+      推演按低阶码逐阶进行，一个品号的全部需求 (直接用料 + 各上阶展开) 都到齐后才计算其库存推移；
+    - 一次深度优先遍历同时求出阶次并检查循环：遇到指回遍历路径上的品号时去掉这条边，
+      循环记入 cycles (品号路径)，循环中的品号按去掉这条边后的结构展开。
+    """
+
+    def __init__(self, rows=()):
+        children, labels = {}, {}
+        for parent, child, qty, base, loss, name, unit in rows:
+            base = float(base or 0)
+            per = float(qty or 0) / (base if base > 0 else 1.0) * (1.0 + float(loss or 0))
+            if per <= 0: continue
+            d = children.setdefault(parent, {})
+            d[child] = d.get(child, 0.0) + per
+            labels.setdefault(child, (name, unit))
+        self.children = {p: list(d.items()) for p, d in children.items()}
+        self.labels = labels
+        self.cycles = []
+        self.levels = self._low_level_codes()
+
+    def __len__(self):
+        return len(self.children)
+
+    def merged(self, other):
+        """并入 other 的结构 (两次分别查询的品号 BOM，同一母件的结构相同)，返回新的 ItemBom。"""
+        if other is None or other is self:
+            return self
+        out = ItemBom()
+        out.children = {**other.children, **self.children}
+        out.labels = {**other.labels, **self.labels}
+        out.cycles = self.cycles + [c for c in other.cycles if c not in self.cycles]
+        out.levels = out._low_level_codes()
+        return out
+
+    def _low_level_codes(self):
+        children = self.children
+        state = {}      # 1 在遍历路径上 / 2 已完成
+        post = []
+        dropped = set()
+        for root in sorted(children):
+            if root in state: continue
+            state[root] = 1
+            path = [root]
+            stack = [iter(children[root])]
+            while stack:
+                for c, _ in stack[-1]:
+                    s = state.get(c)
+                    if s is None:
+                        state[c] = 1
+                        path.append(c)
+                        stack.append(iter(children.get(c, ())))
+                        break
+                    if s == 1:
+                        dropped.add((path[-1], c))
+                        self.cycles.append(tuple(path[path.index(c):]) + (c,))
+                else:
+                    state[path[-1]] = 2
+                    post.append(path.pop())
+                    stack.pop()
+        if dropped:
+            for p in {p for p, _ in dropped}:
+                children[p] = [(c, q) for c, q in children[p] if (p, c) not in dropped]
+        # 后序的逆序即拓扑序，依次放松得到最长路径阶次
+        levels = {}
+        for p in reversed(post):
+            lv = levels.get(p, 0) + 1
+            for c, _ in children.get(p, ()):
+                if levels.get(c, 0) < lv:
+                    levels[c] = lv
+        return levels
+
+
+def _expand_lines(offsets, slots):
+    """对每个位置的工单槽位展开其 BOM 行，返回 (行所属位置, 行号)。"""
+    starts = offsets[slots]
+    lens = offsets[slots + 1] - starts
+    n = int(lens.sum())
+    pos = np.repeat(np.arange(len(slots)), lens)
+    first = np.repeat(np.cumsum(lens) - lens, lens)
+    line = np.repeat(starts, lens) + (np.arange(n) - first)
+    return pos, line, lens
+
+
+def _last_rem_per_part(pos, part, rem, n_parts):
+    """
+    复刻 wo_remaining_needs 字典语义：同一工单内同一品号取最后一个 rem > 0 的行。
+    """
+    need = np.zeros(len(pos), dtype=np.float64)
+    if len(pos) == 0:
+        return need
+    key = pos.astype(np.int64) * max(n_parts, 1) + part
+    pos_mask = np.flatnonzero(rem > 0)
+    if len(pos_mask) == 0:
+        return need
+    mk = key[pos_mask]
+    order = np.argsort(mk, kind="stable")
+    sk = mk[order]
+    is_last = np.ones(len(sk), dtype=bool)
+    is_last[:-1] = sk[1:] != sk[:-1]
+    last_keys = sk[is_last]
+    last_vals = rem[pos_mask[order[is_last]]]
+    idx = np.searchsorted(last_keys, key)
+    idx_c = np.minimum(idx, len(last_keys) - 1)
+    hit = last_keys[idx_c] == key
+    need[hit] = last_vals[idx_c[hit]]
+    return need
+
+
+def _running_stock(part, deduct, inv0):
+    """
+    每行看到的库存 = 期初库存依次减去前面同品号的扣减量 (严格按顺序逐个相减，
+    与字典版的浮点结果一致)。返回 (每行扣减前库存, 各品号期末库存)。
+    """
+    n = len(part)
+    before = np.empty(n, dtype=np.float64)
+    final = inv0.copy()
+    if n == 0:
+        return before, final
+    order = np.argsort(part, kind="stable")
+    sp = part[order]
+    bounds = np.flatnonzero(np.r_[True, sp[1:] != sp[:-1], True])
+    sd = deduct[order]
+    sb = np.empty(n, dtype=np.float64)
+    starts, ends = bounds[:-1], bounds[1:]
+
+    # 只出现一次的品号无需逐个相减
+    single = (ends - starts) == 1
+    s1 = starts[single]
+    p1 = sp[s1]
+    sb[s1] = inv0[p1]
+    final[p1] = inv0[p1] - sd[s1]
+
+    for s, e in zip(starts[~single], ends[~single]):
+        p = sp[s]
+        acc = np.subtract.accumulate(np.concatenate(([inv0[p]], sd[s:e])))
+        sb[s:e] = acc[:-1]
+        final[p] = acc[-1]
+
+    before[order] = sb
+    return before, final
+
+
+def simulate_kitting_vectorized(wo_list, wo_data, running_inv):
+    """
+    数组版推演。参数与 _simulate_logic_v3 相同 (wo_data 也可直接传 BomStore)，
+    返回相同结构的结果列表，并同样把扣减后的库存写回 running_inv。
+    """
+    store = wo_data if isinstance(wo_data, BomStore) else BomStore.from_wo_data(wo_data)
+    if not wo_list:
+        return []
+    results, final, touched = _simulate_block(store, wo_list, store.inventory_vector(running_inv))
+
+    # 写回库存 (只改动发生扣减的品号)
+    pv = store.parts.values
+    for pid in touched.tolist():
+        running_inv[pv[pid]] = float(final[pid])
+    return results
+
+
+def _order_slots(store, wo_list):
+    """
+    各位置的工单槽位 (ERP 中没有的为 -1)，以及对应的 BOM 行数、是否已完工、工单总量。
+    ERP 中没有的工单按 0 行、未完工、总量 0 计 (BomStore 为空时全部如此)。
+    """
+    n = len(wo_list)
+    slots = np.fromiter((store.key_index.get(item['wo_key'], -1) for item in wo_list), dtype=np.int64, count=n)
+    has_info = slots >= 0
+    k = slots[has_info]
+    n_lines = np.zeros(n, dtype=np.int64)
+    n_lines[has_info] = store.offsets[k + 1] - store.offsets[k]
+    done = np.zeros(n, dtype=bool)
+    done[has_info] = store.done[k]
+    total = np.zeros(n, dtype=np.float64)
+    total[has_info] = store.total[k]
+    return slots, n_lines, done, total
+
+
+def _line_state(store, wo_list, inv0):
+    """
+    推演的逐行部分：各工单的状态分类，以及参与推演的 BOM 行 (保持全局先后顺序)
+    的需求、扣减量与扣减前库存。推演结果与缺料时间线共用。
+    """
+    n = len(wo_list)
+    slots, n_lines_of, order_done, total = _order_slots(store, wo_list)
+    plan_qty = np.fromiter((item['plan_qty'] for item in wo_list), dtype=np.float64, count=n)
+
+    # 优先级 0: 无 ERP 信息
+    no_info = n_lines_of == 0
+    # 优先级 1: 工单已完工
+    done = ~no_info & order_done
+
+    # 展开其余工单的 BOM 行 (保持全局先后顺序)
+    cand = np.flatnonzero(~no_info & ~done)
+    lpos, line, _ = _expand_lines(store.offsets, slots[cand])
+    lpos = cand[lpos]
+    part = store.part_id[line]
+    req = store.req[line]
+    iss = store.iss[line]
+    rem = np.maximum(0.0, req - iss)
+
+    # 优先级 2: 发料齐套
+    pos_demand = np.zeros(n, dtype=bool)
+    pos_demand[lpos[rem > 0]] = True
+    issued_ok = np.zeros(n, dtype=bool)
+    issued_ok[cand] = ~pos_demand[cand]
+
+    # 其余为需要推演的行
+    act = pos_demand[lpos]
+    lpos, line, part, req, iss, rem = lpos[act], line[act], part[act], req[act], iss[act], rem[act]
+    unit_use = store.unit_use[line]
+    need = _last_rem_per_part(lpos, part, rem, len(store.parts))
+    valid = unit_use > 0
+    deduct = np.where(valid & (need > 0), need, 0.0)
+
+    L = SimpleNamespace(n=n, plan_qty=plan_qty, total=total, no_info=no_info, done=done,
+                        issued_ok=issued_ok, lpos=lpos, line=line, part=part, iss=iss, unit_use=unit_use,
+                        need=need, valid=valid, deduct=deduct, name_id=store.name_id[line], unit_id=store.unit_id[line])
+    if store.explosion is None or not len(part):
+        L.before, L.final = _running_stock(part, deduct, inv0)
+        L.eff = L.avail = np.where(L.before > 0, L.before, 0.0)
+        L.flat = L
+        return L
+
+    # 多阶展开：flat 为直接用料与各阶展开出的全部行 (按先后顺序)，直接用料取回各自的位置
+    L.flat = flat = _explode_lines(store.explosion, L, inv0)
+    at = flat.direct_at
+    L.before, L.final, L.eff, L.avail = flat.before[at], flat.final, flat.eff[at], flat.avail[at]
+    return L
+
+
+def _explode_lines(X, L, inv0):
+    """
+    多阶展开的库存推移 (X 为 BomStore.explosion)。按低阶码逐阶：
+    1. 本阶品号的行 (直接用料 + 上阶展开出的行) 中，同一工单位置、同一品号的展开行先合并
+       (多条路径汇到同一子件时只推移一次)，再按 (工单位置, 产生先后) 排序求扣减前库存；
+    2. 自制件库存不足的部分 (短缺量) 按子件表展开成下阶的行，归属同一工单位置，
+       并记下 "母行 -> 子行" 的边。
+    每张工单的每个品号每阶只处理一次，不会把共用的半成品按树形重复展开。
+    再自下而上沿边求可用量：库存可用 + 短缺量 × 其子件行中最低的满足率 (子件都够时短缺部分可以自制)。
+    """
+    n = len(L.part)
+    level_of, offsets = X.level, X.offsets
+    buckets = {}
+    total = [0]
+    edges = []      # (母行, 子行, 子行阶次)
+    aliases = []    # (被合并的行, 保留的行)
+
+    def add(blk):
+        m = len(blk.part)
+        blk.gid = np.arange(total[0], total[0] + m)
+        total[0] += m
+        lv = level_of[blk.part]
+        order = np.argsort(lv, kind="stable")
+        lv = lv[order]
+        cuts = np.flatnonzero(np.r_[True, lv[1:] != lv[:-1], True])
+        for s, e in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+            idx = order[s:e]
+            buckets.setdefault(int(lv[s]), []).append(
+                SimpleNamespace(**{k: v[idx] for k, v in vars(blk).items()}))
+        return blk.gid
+
+    add(SimpleNamespace(lpos=L.lpos, part=L.part.astype(np.int64), deduct=L.deduct, root=np.arange(n),
+                        name_id=L.name_id, unit_id=L.unit_id))
+    stock = inv0
+    levels = []
+    while buckets:
+        lv = min(buckets)
+        blks = buckets.pop(lv)
+        b = SimpleNamespace(**{k: np.concatenate([getattr(x, k) for x in blks]) for k in vars(blks[0])})
+        derived = np.flatnonzero(b.gid >= n)
+        if len(derived) > 1:
+            o = derived[np.lexsort((b.gid[derived], b.part[derived], b.lpos[derived]))]
+            first = np.r_[True, (b.lpos[o][1:] != b.lpos[o][:-1]) | (b.part[o][1:] != b.part[o][:-1])]
+            if not first.all():
+                starts = np.flatnonzero(first)
+                keep = o[starts]
+                b.deduct[keep] = np.add.reduceat(b.deduct[o], starts)
+                b.root[keep] = np.minimum.reduceat(b.root[o], starts)
+                drop = o[~first]
+                aliases.append((b.gid[drop], b.gid[keep][np.cumsum(first)[~first] - 1]))
+                live = np.ones(len(b.gid), dtype=bool)
+                live[drop] = False
+                b = SimpleNamespace(**{k: v[live] for k, v in vars(b).items()})
+        order = np.lexsort((b.gid, b.lpos))
+        b = SimpleNamespace(**{k: v[order] for k, v in vars(b).items()})
+        b.before, stock = _running_stock(b.part, b.deduct, stock)
+        b.short = b.deduct - np.clip(b.before, 0.0, b.deduct)
+        b.exploded = (b.short > 0) & (offsets[b.part + 1] > offsets[b.part])
+        e = np.flatnonzero(b.exploded)
+        if len(e):
+            pos, line, _ = _expand_lines(offsets, b.part[e])
+            e = e[pos]
+            child = X.child[line].astype(np.int64)
+            gid = add(SimpleNamespace(lpos=b.lpos[e], part=child, deduct=b.short[e] * X.per[line],
+                                      root=b.root[e], name_id=X.name_id[line], unit_id=X.unit_id[line]))
+            edges.append((b.gid[e], gid, level_of[child]))
+        levels.append(b)
+
+    # 自下而上：子行的满足率沿边汇总到母行 (被合并的子行换成保留的行)
+    alias = np.arange(total[0])
+    for drop, keep in aliases:
+        alias[drop] = keep
+    if edges:
+        e_parent, e_child, e_level = (np.concatenate(c) for c in zip(*edges))
+        e_child = alias[e_child]
+        o = np.argsort(-e_level, kind="stable")
+        e_parent, e_child, e_level = e_parent[o], e_child[o], e_level[o]
+    else:
+        e_parent = e_child = e_level = np.zeros(0, dtype=np.int64)
+    min_frac = np.ones(total[0], dtype=np.float64)
+    frac_of = np.ones(total[0], dtype=np.float64)
+    k = 0
+    for b in reversed(levels):
+        b.eff = np.where(b.before > 0, b.before, 0.0)
+        b.avail = b.eff + np.where(b.exploded, b.short * min_frac[b.gid], 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac_of[b.gid] = np.where(b.deduct > 0, np.minimum(b.avail / np.where(b.deduct > 0, b.deduct, 1.0),
+                                                               1.0), 1.0)
+        lv = level_of[b.part[0]]
+        k2 = k + int(np.searchsorted(-e_level[k:], -lv, side="right"))
+        np.minimum.at(min_frac, e_parent[k:k2], frac_of[e_child[k:k2]])
+        k = k2
+
+    flat = SimpleNamespace(**{k: np.concatenate([getattr(b, k) for b in levels]) for k in vars(levels[0])})
+    order = np.lexsort((flat.gid, flat.lpos))
+    flat = SimpleNamespace(**{k: v[order] for k, v in vars(flat).items()})
+    flat.final = stock
+    flat.direct_at = np.empty(n, dtype=np.int64)
+    direct = flat.gid < n
+    flat.direct_at[flat.gid[direct]] = np.flatnonzero(direct)
+    # 展开出的行：需求即扣减量
+    flat.need = np.where(direct, L.need[np.where(direct, flat.gid, 0)], flat.deduct)
+    flat.valid = np.where(direct, L.valid[np.where(direct, flat.gid, 0)], True)
+    return flat
+
+
+SUB_SHORT_LIMIT = 5     # 自制件之下的末阶缺料，A 列每行最多列出几项
+
+
+def _simulate_block(store, wo_list, inv0):
+    """
+    按顺序推演一段工单。inv0 为按品号 ID 索引的期初库存向量 (不会被修改)。
+    返回 (结果列表, 期末库存向量, 发生扣减的品号 ID)。
+    """
+    n = len(wo_list)
+    if n == 0:
+        return [], inv0, np.zeros(0, dtype=np.int32)
+    L = _line_state(store, wo_list, inv0)
+    plan_qty, no_info, done, issued_ok = L.plan_qty, L.no_info, L.done, L.issued_ok
+    lpos, part, iss, unit_use = L.lpos, L.part, L.iss, L.unit_use
+    need, valid, final = L.need, L.valid, L.final
+    eff = L.avail   # 可用量：库存可用部分 (多阶展开时另加下阶齐套、可以自制的部分)
+
+    # 宏观：齐套率 / 仓库缺料
+    has_need = valid & (need > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        part_rate = np.where(has_need, np.minimum(eff / np.where(has_need, need, 1.0), 1.0), 1.0)
+    min_rate = np.ones(n, dtype=np.float64)
+    np.minimum.at(min_rate, lpos, part_rate)
+    short = has_need & (eff < need - 0.0001)
+
+    # 最小可产数
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sets = np.where(valid, np.floor_divide(iss + eff, np.where(valid, unit_use, 1.0)), np.inf)
+    min_sets = np.full(n, np.inf)
+    np.minimum.at(min_sets, lpos, sets)
+
+    # 微观：当日计划
+    daily_need = plan_qty[lpos] * unit_use
+    daily_short_line = valid & (eff < np.minimum(need, daily_need) - 0.0001)
+    daily_short = np.zeros(n, dtype=bool)
+    daily_short[lpos[daily_short_line]] = True
+
+    wh_short = np.zeros(n, dtype=bool)
+    wh_short[lpos[short]] = True
+
+    # 缺料文字 (只对缺料行生成字符串)
+    short_idx = np.flatnonzero(short)
+    short_txt = {}
+    pv, lv = store.parts.values, store.labels.values
+    sub_txt = _sub_shortages(L, store, short_idx) if L.flat is not L else {}
+    for j, p, pid, nid, uid, diff in zip(short_idx.tolist(), lpos[short_idx].tolist(), part[short_idx].tolist(),
+                                         L.name_id[short_idx].tolist(), L.unit_id[short_idx].tolist(),
+                                         (need - eff)[short_idx].tolist()):
+        txt = f"{pv[pid]},{lv[nid]},缺{diff:g}{lv[uid]}"
+        if j in sub_txt:
+            txt += f"(下阶缺料 {'/'.join(sub_txt[j])})"
+        short_txt.setdefault(p, []).append(txt)
+
+    # 汇总结果 (状态码: 0 推演 / 1 无ERP信息 / 2 已完工 / 3 发料齐套)
+    kind = np.zeros(n, dtype=np.int8)
+    kind[issued_ok] = 3
+    kind[done] = 2
+    kind[no_info] = 1
+    results = []
+    for item, k, tot, d_short, w_short, rate, sets, i in zip(
+            wo_list, kind.tolist(), L.total.tolist(), daily_short.tolist(), wh_short.tolist(),
+            min_rate.tolist(), np.minimum(min_sets, 999999.0).tolist(), range(n)):
+        res = {'row_idx': item['row_idx'], 'rate': 0.0, 'achievable': 0, 'daily_status': "未知", 'msg': ""}
+        if k == 1:
+            res['msg'] = "无ERP信息"
+            res['daily_status'] = "异常"
+        elif k == 2:
+            res['rate'] = 1.0
+            res['achievable'] = int(tot)
+            res['daily_status'] = "齐套"
+            res['msg'] = "工单已完工"
+        elif k == 3:
+            res['rate'] = 1.0
+            res['achievable'] = int(tot)
+            res['daily_status'] = "齐套"
+            res['msg'] = "发料齐套"
+        else:
+            res['daily_status'] = "缺料" if d_short else "齐套"
+            if not w_short:
+                res['msg'] = "仓库齐套"
+                res['rate'] = 1.0
+                res['achievable'] = int(tot)
+            else:
+                res['msg'] = "; ".join(short_txt[i])
+                res['rate'] = rate
+                res['achievable'] = min(int(tot), int(sets))
+        results.append(res)
+    return results, final, np.unique(L.flat.part[L.flat.deduct > 0])
+
+
+def _sub_shortages(L, store, roots, limit=SUB_SHORT_LIMIT):
+    """
+    多阶展开时直接用料行 roots 之下的末阶缺料 (不再展开、库存不足的展开行)，同一品号合并，
+    每行最多列出 limit 项。返回 {直接用料行: ["品号,品名,缺XX单位", ...]}。
+    """
+    f = L.flat
+    leaf = np.flatnonzero((f.gid >= len(L.part)) & ~f.exploded & (f.eff < f.deduct - 0.0001) & np.isin(f.root, roots))
+    if not len(leaf):
+        return {}
+    leaf = leaf[np.lexsort((leaf, f.part[leaf], f.root[leaf]))]
+    root, part = f.root[leaf], f.part[leaf]
+    starts = np.flatnonzero(np.r_[True, (root[1:] != root[:-1]) | (part[1:] != part[:-1])])
+    diff = np.add.reduceat((f.deduct - f.eff)[leaf], starts)
+    leaf, root = leaf[starts], root[starts]
+    # 按各品号首次出现的先后列出
+    o = np.lexsort((leaf, root))
+    leaf, root, diff = leaf[o], root[o], diff[o]
+    first = np.flatnonzero(np.r_[True, root[1:] != root[:-1]])
+    rank = np.arange(len(root)) - np.repeat(first, np.diff(np.r_[first, len(root)]))
+    counts = dict(zip(root[first].tolist(), np.diff(np.r_[first, len(root)]).tolist()))
+    show = rank < limit
+    pv, lv = store.parts.values, store.labels.values
+    out = {}
+    for r, pid, nid, uid, d in zip(root[show].tolist(), f.part[leaf[show]].tolist(), f.name_id[leaf[show]].tolist(),
+                                   f.unit_id[leaf[show]].tolist(), diff[show].tolist()):
+        out.setdefault(r, []).append(f"{pv[pid]},{lv[nid]},缺{d:g}{lv[uid]}")
+    for r, c in counts.items():
+        if c > limit:
+            out[r].append(f"等{c}项")
+    return out
+
+
+def shortage_timeline(wo_list, store, inv0):
+    """
+    缺料时间线 (按品号反查)。inv0 为推演起点的库存向量，wo_list 须已按 (开工日期, 行号) 排好序。
+
+    推演行按 (品号, 先后顺序) 稳定排序后即为 "品号 -> 工单" 反查索引，组内对扣减量做前缀和
+    得到累计需求，累计缺口 = max(累计需求 - 期初库存, 0)。只输出有缺料的品号，按首次缺料先后排列：
+    {'part', 'name', 'unit', 'stock', 'demand', 'shortfall', 'first_date', 'first_wo', 'first_row',
+     'days': [(日期, 当日需求, 累计需求, 累计缺口, 当日缺料工单数)],
+     'blocked': [(日期, 工单, 行号, 需求, 扣减前库存, 缺量)]}
+    挂接了品号 BOM 时含各阶展开出的需求；是否缺料按可用量判断 (下阶齐套、可以自制的部分不算缺)。
+    """
+    if not wo_list:
+        return []
+    L = _line_state(store, wo_list, inv0).flat
+    short = L.valid & (L.need > 0) & (L.avail < L.need - 0.0001)
+    if not short.any():
+        return []
+
+    # 反查索引：只保留有缺料的品号的行，按品号稳定排序 (组内保持推演顺序)
+    sel = np.flatnonzero(np.isin(L.part, np.unique(L.part[short])))
+    sel = sel[np.argsort(L.part[sel], kind="stable")]
+    sp, sd, spos = L.part[sel], L.deduct[sel], L.lpos[sel]
+    day_of = {}
+    day = np.fromiter((day_of.setdefault(item['start_date'], len(day_of)) for item in wo_list),
+                      dtype=np.int64, count=len(wo_list))[spos]
+    dates = list(day_of)
+
+    # 组内前缀和
+    starts = np.flatnonzero(np.r_[True, sp[1:] != sp[:-1]])
+    lens = np.diff(np.r_[starts, len(sp)])
+    cs = np.cumsum(sd)
+    cum = cs - np.repeat(cs[starts] - sd[starts], lens)
+    stock = L.eff[sel][starts]  # 每组第一行的扣减前库存即期初库存 (负数按 0)
+    cum_short = np.maximum(cum - np.repeat(stock, lens), 0.0)
+    s_short = short[sel]
+
+    # (品号, 日期) 分组
+    gb = np.flatnonzero(np.r_[True, (sp[1:] != sp[:-1]) | (day[1:] != day[:-1])])
+    g_last = np.r_[gb[1:], len(sp)] - 1
+    g_demand = np.add.reduceat(sd, gb)
+    g_blocked = np.add.reduceat(s_short.astype(np.int64), gb)
+    g_part_start = np.searchsorted(starts, gb, side="right") - 1
+
+    pv, lv = store.parts.values, store.labels.values
+    out = []
+    for k, s in enumerate(starts.tolist()):
+        out.append({'part': pv[int(sp[s])], 'name': lv[int(L.name_id[sel[s]])],
+                    'unit': lv[int(L.unit_id[sel[s]])], 'stock': float(inv0[sp[s]]),
+                    'demand': float(cum[s + lens[k] - 1]), 'shortfall': float(cum_short[s + lens[k] - 1]),
+                    'days': [], 'blocked': []})
+    for k, d, dem, c, cshort, nb in zip(g_part_start.tolist(), day[gb].tolist(), g_demand.tolist(),
+                                        cum[g_last].tolist(), cum_short[g_last].tolist(), g_blocked.tolist()):
+        out[k]['days'].append((dates[d], dem, c, cshort, nb))
+    b = np.flatnonzero(s_short)
+    b_part = np.searchsorted(starts, b, side="right") - 1
+    for k, pos, n_, e in zip(b_part.tolist(), spos[b].tolist(), L.need[sel[b]].tolist(), L.avail[sel[b]].tolist()):
+        item = wo_list[pos]
+        out[k]['blocked'].append((item['start_date'], item['wo_key'], item['row_idx'], n_, e, n_ - e))
+
+    first_pos = spos[b[np.r_[True, b_part[1:] != b_part[:-1]]]]
+    for rec, pos in zip(out, first_pos.tolist()):
+        item = wo_list[pos]
+        rec['first_date'], rec['first_wo'], rec['first_row'] = item['start_date'], item['wo_key'], item['row_idx']
+    out_order = np.argsort(first_pos, kind="stable")
+    return [out[i] for i in out_order.tolist()]
+
+
+DAILY_KIT, DAILY_SHORT, DAILY_ERROR = "齐套", "缺料", "异常"
+
+
+def _group_starts(keys):
+    """已排序的 keys 中每组的起点 (布尔掩码)。"""
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return first
+
+
+def _grouped_cumsum(values, first):
+    """按组 (first 为组起点掩码) 的累计和，各组从 0 开始。"""
+    cs = np.cumsum(values)
+    starts = np.flatnonzero(first)
+    base = cs[starts] - values[starts]
+    return cs - np.repeat(base, np.diff(np.r_[starts, len(values)]))
+
+
+def simulate_time_phased(wo_list, dates, store, inventory, supply=()):
+    """
+    逐日推演。wo_list 每项带 'daily' (与 dates 对齐的逐日排产数量，见 PlanModel.extract(daily=True))，
+    须已按 (开工日期, 行号) 排好序；supply 为 [(品号, 到货日, 数量, 来源)] (见 erp_access.fetch_supply)。
+
+    事件按 (日期, 优先级, 先后) 排列：同一天先到货 (优先级 0) 后领用 (优先级 1)，领用按排程顺序、
+    BOM 行顺序依次发生。某行某天的领用量 = min(该工单该 BOM 行剩余未领量, 当日计划数 × 单耗)，
+    同一工单出现在多行时共用剩余未领量。到货日早于首日 (逾期未到) 的计在首日，晚于末日的不计，
+    落在两个排产日之间的计在下一个排产日。
+
+    与整单推演一样，领用量与库存余额无关，所以每个事件看到的库存 = 期初库存 + 此前到货 - 此前领用：
+    按 (品号, 日期, 优先级, 先后) 排序后分组前缀和即得，与逐个弹出事件堆的结果相同，但不需要逐事件循环。
+    当天各 BOM 行的扣减前库存 (负数按 0) 都不少于领用量即为当日齐套。
+
+    返回与 wo_list 对齐的结果：{'row_idx', 'daily': [(日期, 计划数, 齐套/缺料/异常)], 'kit_days', 'plan_days',
+    'first_short' (首个缺料日或 None), 'msg' (无ERP信息 / 工单已完工 / 发料齐套 / 仓库齐套 / 首个缺料日的缺料明细)}。
+    """
+    n, n_days = len(wo_list), len(dates)
+    if n == 0:
+        return []
+    slots, n_lines, order_done, _ = _order_slots(store, wo_list)
+    offsets = store.offsets
+    no_info = n_lines == 0
+    done = ~no_info & order_done
+    rem = np.maximum(0.0, store.req - store.iss)
+    rem_cum = np.r_[0, np.cumsum(rem > 0)]
+    has_rem = (rem_cum[offsets[1:]] - rem_cum[offsets[:-1]]) > 0
+    pending = np.zeros(n, dtype=bool)
+    pending[~no_info] = has_rem[slots[~no_info]]
+    issued_ok = ~no_info & ~done & ~pending
+    active = ~no_info & ~done & ~issued_ok
+
+    qty = np.stack([item['daily'] for item in wo_list]).astype(np.float64) if n_days else np.zeros((n, 0))
+    qty[qty < 0] = 0.0
+
+    # 领用事件：(日期, 排程顺序, BOM 行) 顺序展开
+    cj, cr = np.nonzero(qty.T * active)
+    epos, line, _ = _expand_lines(offsets, slots[cr])
+    live = (rem[line] > 0) & (store.unit_use[line] > 0)
+    epos, line = epos[live], line[live]
+    ask = qty[cr[epos], cj[epos]] * store.unit_use[line]
+
+    # 各 BOM 行的累计领用不超过剩余未领量 (同一行的事件按先后顺序)
+    draw = np.empty(len(line), dtype=np.float64)
+    if len(line):
+        order = np.argsort(line, kind="stable")
+        first = _group_starts(line[order])
+        cum = _grouped_cumsum(ask[order], first)
+        capped = np.minimum(cum, rem[line[order]])
+        prev = np.r_[0.0, capped[:-1]]
+        prev[first] = 0.0
+        draw[order] = capped - prev
+
+    # 到货事件
+    s_part, s_day, s_qty = [], [], []
+    index = store.parts.index
+    for code, d, q, _src in supply:
+        pid = index.get(code)
+        if pid is None or d is None or not q > 0:
+            continue
+        s_part.append(pid)
+        s_day.append(d)
+        s_qty.append(q)
+    s_day = np.searchsorted(np.array(dates, dtype="datetime64[D]"), np.array(s_day, dtype="datetime64[D]"))
+    keep = s_day < n_days
+    s_part = np.array(s_part, dtype=np.int64)[keep]
+    s_day, s_qty = s_day[keep], np.array(s_qty, dtype=np.float64)[keep]
+
+    # 合并后按 (品号, 日期, 优先级, 先后) 排序，分组前缀和得到每个事件之前的库存
+    n_ev = len(line)
+    e_part = np.concatenate((store.part_id[line].astype(np.int64), s_part))
+    e_day = np.concatenate((cj[epos], s_day))
+    e_pri = np.r_[np.ones(n_ev, dtype=np.int8), np.zeros(len(s_part), dtype=np.int8)]
+    e_seq = np.arange(len(e_part))
+    delta = np.concatenate((-draw, s_qty))
+    order = np.lexsort((e_seq, e_pri, e_day, e_part))
+    before = np.empty(len(e_part), dtype=np.float64)
+    if len(order):
+        sp = e_part[order]
+        before[order] = store.inventory_vector(inventory)[sp] + _grouped_cumsum(delta[order], _group_starts(sp)) \
+            - delta[order]
+    eff = np.maximum(before[:n_ev], 0.0)
+    short = (draw > 0) & (eff < draw - 0.0001)
+
+    # 每行每天的状态与首个缺料日
+    cell_short = np.zeros((n, n_days), dtype=bool)
+    s_ev = np.flatnonzero(short)
+    s_row, s_col = cr[epos[s_ev]], cj[epos[s_ev]]
+    cell_short[s_row, s_col] = True
+    first_short = np.full(n, n_days, dtype=np.int64)
+    np.minimum.at(first_short, s_row, s_col)
+    texts = {}
+    pv, lv = store.parts.values, store.labels.values
+    on_first = s_col == first_short[s_row]
+    s_line = line[s_ev[on_first]]
+    for r, pid, nid, uid, diff in zip(s_row[on_first].tolist(), store.part_id[s_line].tolist(),
+                                      store.name_id[s_line].tolist(), store.unit_id[s_line].tolist(),
+                                      (draw - eff)[s_ev[on_first]].tolist()):
+        texts.setdefault(r, []).append(f"{pv[pid]},{lv[nid]},缺{diff:g}{lv[uid]}")
+
+    results = []
+    rows, cols = np.nonzero(qty)
+    bounds = np.searchsorted(rows, np.arange(n + 1))
+    for i, item in enumerate(wo_list):
+        cs = cols[bounds[i]:bounds[i + 1]].tolist()
+        q = qty[i, cs].tolist()
+        if no_info[i]:
+            status, msg = [DAILY_ERROR] * len(cs), "无ERP信息"
+        elif not active[i]:
+            status, msg = [DAILY_KIT] * len(cs), "工单已完工" if done[i] else "发料齐套"
+        else:
+            status = [DAILY_SHORT if x else DAILY_KIT for x in cell_short[i, cs].tolist()]
+            msg = "; ".join(texts[i]) if i in texts else "仓库齐套"
+        results.append({'row_idx': item['row_idx'], 'daily': list(zip([dates[j] for j in cs], q, status)),
+                        'kit_days': status.count(DAILY_KIT), 'plan_days': len(cs),
+                        'first_short': dates[first_short[i]] if first_short[i] < n_days else None, 'msg': msg})
+    return results
+
+
+def format_daily_result(r):
+    """逐日推演的 A 列文字。格式：逐日齐套：X/Y天，首次缺料：MM-DD，缺料信息：品号,品名,缺XX单位 (首个缺料日)"""
+    first = r['first_short'].strftime("%m-%d") if r['first_short'] else "无"
+    return f"逐日齐套：{r['kit_days']}/{r['plan_days']}天，首次缺料：{first}，缺料信息：{r['msg']}"
+
+
+def order_components(wo_list, store):
+    """
+    按 "工单-品号" 图的连通分量给工单分组：两张工单只要 BOM 中有相同品号 (直接或间接)
+    就在同一分量。品号用并查集合并 (按较小编号挂接 + 路径压缩，数组方式批量进行)。
+    返回每个位置的分量编号；不读写库存的工单 (无 ERP 信息 / 已完工) 为 -1。
+    """
+    n = len(wo_list)
+    slots, _, done, _ = _order_slots(store, wo_list)
+    active = np.flatnonzero((slots >= 0) & ~done)
+    comp = np.full(n, -1, dtype=np.int64)
+    if len(active) == 0:
+        return comp
+    lpos, line, _ = _expand_lines(store.offsets, slots[active])
+    part = store.part_id[line].astype(np.int64)
+    n_parts = len(store.parts)
+    n_rows = len(active)
+    X = store.explosion
+    if X is not None and len(X.child):
+        # 自制件会在同一工单下展开出子件的行：每条 "母件-子件" 边当作一张只有这两个品号的虚拟工单
+        owner = np.repeat(np.arange(len(X.offsets) - 1), np.diff(X.offsets))
+        lpos = np.concatenate((lpos, n_rows + np.repeat(np.arange(len(X.child)), 2)))
+        part = np.concatenate((part, np.column_stack((owner, X.child)).ravel().astype(np.int64)))
+        n_rows += len(X.child)
+
+    parent = np.arange(n_parts, dtype=np.int64)
+    while True:
+        root = parent[part]
+        omin = np.full(n_rows, n_parts, dtype=np.int64)
+        np.minimum.at(omin, lpos, root)
+        hooked = parent.copy()
+        np.minimum.at(hooked, root, omin[lpos])
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked): break
+            hooked = jumped
+        if np.array_equal(hooked, parent): break
+        parent = hooked
+
+    omin = np.full(n_rows, n_parts, dtype=np.int64)
+    np.minimum.at(omin, lpos, parent[part])
+    omin = omin[:len(active)]
+    # 无 BOM 行的工单 (omin == n_parts) 也不读写库存
+    has_lines = omin < n_parts
+    comp[active[has_lines]] = np.unique(omin[has_lines], return_inverse=True)[1]
+    return comp
+
+
+def _simulate_bin(store, wo_list, inventory):
+    """子进程内推演一组互不相关的工单，返回 (结果, 被写回的库存)。"""
+    running = dict(inventory)
+    results = simulate_kitting_vectorized(wo_list, store, running)
+    written = {p: q for p, q in running.items() if p not in inventory or not q == inventory[p]}
+    return results, written
+
+
+def simulate_partitioned(wo_list, wo_data, running_inv, executor, n_bins=None, min_lines=0):
+    """
+    分量并行推演：按 order_components 分组，各组保持原有 (开工日期, 行号) 先后顺序，
+    装箱成 n_bins 份交给 executor (进程池) 并行推演，再按原位置合并结果。
+    不同分量之间没有共用品号，所以结果与串行推演完全一致；running_inv 同样被写回。
+    只有一个分量或 BOM 行数少于 min_lines 时直接串行推演。
+    """
+    store = wo_data if isinstance(wo_data, BomStore) else BomStore.from_wo_data(wo_data)
+    comp = order_components(wo_list, store)
+    n_comp = int(comp.max()) + 1 if len(comp) else 0
+    if n_comp <= 1 or store.n_lines < min_lines:
+        return simulate_kitting_vectorized(wo_list, store, running_inv)
+
+    # 按 BOM 行数从大到小装箱 (每次放进当前最轻的箱子)
+    slots, lines, _, _ = _order_slots(store, wo_list)
+    weight = np.bincount(comp[comp >= 0], weights=lines[comp >= 0], minlength=n_comp)
+    n_bins = min(n_bins or getattr(executor, '_max_workers', 4) * 2, n_comp)
+    load = [0.0] * n_bins
+    bin_of = np.zeros(n_comp, dtype=np.int64)
+    for c in np.argsort(-weight, kind="stable").tolist():
+        b = load.index(min(load))
+        bin_of[c] = b
+        load[b] += weight[c]
+    # 不读写库存的工单放在第 0 箱
+    pos_bin = np.where(comp >= 0, bin_of[np.maximum(comp, 0)], 0)
+
+    futures = []
+    for b in range(n_bins):
+        pos = np.flatnonzero(pos_bin == b)
+        sub_list = [wo_list[i] for i in pos.tolist()]
+        sub_slots = np.unique(slots[pos][slots[pos] >= 0])
+        sub = store.subset(sub_slots)
+        inv = {p: running_inv[p] for p in sub.parts.values if p in running_inv}
+        futures.append((pos, executor.submit(_simulate_bin, sub, sub_list, inv)))
+
+    results = [None] * len(wo_list)
+    for pos, f in futures:
+        sub_results, written = f.result()
+        for i, res in zip(pos.tolist(), sub_results):
+            results[i] = res
+        running_inv.update(written)
+    return results
+
+
+def format_result(r):
+    """A 列文字。格式：齐套率：XX%，当日：[齐套/缺料]，最小可生产数：XX，缺料信息：品号,品名,缺XX单位"""
+    msg = r['msg']
+    detail_str = f"缺料信息：{msg}" if msg else "缺料信息："
+    return f"齐套率：{r['rate']:.0%}，当日：{r['daily_status']}，最小可生产数：{r['achievable']}，{detail_str}"
+
+
+def _common_prefix(a, b, block=1024):
+    """两个列表相同前缀的长度 (先按块比较切片，再逐个比较)。"""
+    lim = min(len(a), len(b))
+    p = 0
+    while p + block <= lim and a[p:p + block] == b[p:p + block]:
+        p += block
+    while p < lim and a[p] == b[p]:
+        p += 1
+    return p
+
+
+class IncrementalSimulator:
+    """
+    增量推演 (what-if)：基于同一份 ERP 快照反复推演。
+
+    保存上次的工单顺序、结果，以及每 checkpoint_every 单一份库存快照
+    (位置 i 的快照 = 推演第 i 单之前的库存)。再次推演时：
+    1. 从第一处变化之前最近的快照恢复，按块重算；
+    2. 到达某个块边界时，若其后的工单与上次完全相同、且库存与上次对应位置的快照一致，
+       后面的结果直接沿用上次的 (只改计划数量不影响扣减，通常下一个块边界即收敛)。
+    wo_list 须已按 (开工日期, 行号) 排好序。
+    """
+
+    def __init__(self, store, inventory, checkpoint_every=256):
+        self.store = store
+        self.every = max(int(checkpoint_every), 1)
+        self._sig = []
+        self._results = []
+        self._cps = [(0, store.inventory_vector(inventory))]
+        self.stats = {}
+
+    def extend(self, store, inventory):
+        """
+        并入补充查询的工单 (例如延长了结束日期)。新品号此前从未扣减，
+        各快照中补上其期初库存即可，已有的快照和结果继续有效。
+        """
+        merged = self.store.merged(store)
+        new_parts = merged.parts.values[len(self.store.parts):]
+        if new_parts:
+            tail = np.array([inventory.get(p, 0.0) for p in new_parts], dtype=np.float64)
+            self._cps = [(pos, np.concatenate((v, tail))) for pos, v in self._cps]
+        self.store = merged
+
+    @property
+    def initial_inventory(self):
+        """推演起点的库存向量 (按品号 ID 索引)。"""
+        return self._cps[0][1]
+
+    def run(self, wo_list):
+        """返回 (结果列表, 结果有变化的行号列表)。"""
+        sig = list(map(itemgetter('wo_key', 'plan_qty', 'row_idx'), wo_list))
+        old_sig, old_res, old_cps = self._sig, self._results, self._cps
+        n, m = len(sig), len(old_sig)
+
+        # 与上次相同的前缀 / 后缀
+        p = _common_prefix(sig, old_sig)
+        s = _common_prefix(sig[::-1], old_sig[::-1])
+        delta = n - m
+        suffix_from = n - s
+
+        cps = [cp for cp in old_cps if cp[0] <= p]
+        c, state = cps[-1]
+        old_at = dict(old_cps)
+        # 后缀区域内可用于比对的上次快照位置 (换算为本次位置)
+        marks = [pos + delta for pos, _ in old_cps if pos + delta >= max(suffix_from, c)]
+        mi = 0
+
+        results = old_res[:c]
+        j = c
+        while j < n:
+            if j >= suffix_from:
+                old_state = old_at.get(j - delta)
+                if old_state is not None and np.array_equal(state, old_state, equal_nan=True):
+                    results.extend(old_res[j - delta:])
+                    cps.extend((pos + delta, v) for pos, v in old_cps if pos >= j - delta)
+                    break
+            if j > c:
+                cps.append((j, state))
+            e = min(j + self.every, n)
+            while mi < len(marks) and marks[mi] <= j:
+                mi += 1
+            if mi < len(marks) and marks[mi] < e:
+                e = marks[mi]
+            block, state, _ = _simulate_block(self.store, wo_list[j:e], state)
+            results.extend(block)
+            j = e
+
+        # 结果有变化的行：只可能出现在重算区间内，对应上次的 [c, j - delta)
+        old_by_row = {r['row_idx']: r for r in old_res[c:j - delta]}
+        changed = [r['row_idx'] for r in results[c:j] if old_by_row.get(r['row_idx']) != r]
+
+        self._sig, self._results, self._cps = sig, results, cps
+        self.stats = {'resume': c, 'recomputed': j - c, 'total': n}
+        return results, changed
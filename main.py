@@ -1,21 +1,34 @@
 # -*- coding: utf-8 -*-
+import time
+STARTUP_T0 = time.perf_counter()    # 启动计时起点
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import pandas as pd
-import openpyxl
-import pyodbc
 import traceback
 import datetime
 import copy
-import shutil
 import os
+import sys
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
-from openpyxl.styles import Font
 from tkcalendar import DateEntry
+# 启动时只导入轻量模块；numpy / openpyxl / pandas / pyodbc 及依赖它们的模块
+# (kitting_engine, plan_workbook, erp_cache, shortage_report) 在首次使用时导入，
+# 窗口显示后由后台线程预加载 (见 warm_up)
+from erp_access import (ErpConnection, ErpFetchError, ConnectionPool, fetch_bom_setbased, fetch_bom_columnar,
+                        fetch_inventory_streaming, fetch_pipelined, fetch_inventory_pooled,
+                        fetch_bom_versions, fetch_supply, fetch_item_bom)
+from run_report import RunReport
+from backup_store import BackupStore, describe as describe_backup
+from analysis_pipeline import start_backups, write_results, write_timeline
 
 # ============== 用户配置区 ==============
 def get_best_sql_driver():
     try:
+        import pyodbc
         installed_drivers = [d for d in pyodbc.drivers()]
     except Exception:
         return "SQL Server"
@@ -30,25 +43,172 @@ def get_best_sql_driver():
     return "SQL Server"
 
 
-CURRENT_DRIVER = get_best_sql_driver()
-# 数据库连接 (只读权限)
-DB_CONN_STRING = (
-    f"DRIVER={{{CURRENT_DRIVER}}};SERVER=192.168.0.117;DATABASE=FQD;"
+# 数据库连接 (只读权限)。枚举 ODBC 驱动较慢，首次访问数据库 (或后台预加载) 时才探测
+DB_CONN_TEMPLATE = (
+    "DRIVER={{{driver}}};SERVER=192.168.0.117;DATABASE=FQD;"
     "UID=zhitan;PWD=Zt@forcome;TrustServerCertificate=yes;"
 )
+CURRENT_DRIVER = None
+_driver_lock = threading.Lock()
+
+
+def db_conn_string():
+    global CURRENT_DRIVER
+    with _driver_lock:
+        if CURRENT_DRIVER is None:
+            CURRENT_DRIVER = get_best_sql_driver()
+    return DB_CONN_TEMPLATE.format(driver=CURRENT_DRIVER)
+
+
+def connect_erp():
+    import pyodbc
+    return pyodbc.connect(db_conn_string())
+
+
+def warm_up():
+    """预加载重模块并探测 ODBC 驱动 (窗口显示后在后台线程调用)，返回驱动名。"""
+    import numpy, openpyxl  # noqa: F401
+    import kitting_engine, plan_workbook, erp_cache, shortage_report  # noqa: F401
+    db_conn_string()
+    return CURRENT_DRIVER
+
+
+def open_erp_cache():
+    from erp_cache import ErpCache
+    base = os.path.dirname(sys.executable if getattr(sys, 'frozen', False) else os.path.abspath(__file__))
+    return ErpCache(os.path.join(base, "erp_cache.sqlite"),
+                    bom_ttl=ERP_CACHE_BOM_TTL, inv_ttl=ERP_CACHE_INV_TTL,
+                    keep_days=ERP_CACHE_KEEP_DAYS, max_bytes=ERP_CACHE_MAX_MB * 1024 * 1024,
+                    inv_scope=repr((sorted(ERP_INV_WAREHOUSE_INCLUDE), sorted(ERP_INV_WAREHOUSE_EXCLUDE))))
+
+
+def fetch_erp_snapshot(pool, keys, cache=None, force=False, on_batch=None, log=None):
+    """
+    流水线获取 BOM 与库存 (按 ERP_* 配置)；传入 cache 时只拉取过期或缺失的部分。
+    开启多阶展开时随后挂接品号 BOM (见 attach_item_bom)。
+    """
+    opts = dict(timeout=ERP_QUERY_TIMEOUT, retries=ERP_QUERY_RETRIES, on_batch=on_batch)
+    wh = dict(include=ERP_INV_WAREHOUSE_INCLUDE, exclude=ERP_INV_WAREHOUSE_EXCLUDE)
+    if cache is None:
+        store, inventory = fetch_pipelined(pool, keys, inv_strategy=ERP_INV_STRATEGY, **wh, **opts)
+    else:
+        store, inventory = cache.fetch(
+            keys,
+            fetch_bom=lambda k: fetch_pipelined(pool, k, inv_strategy=ERP_INV_STRATEGY, **wh, **opts),
+            fetch_versions=lambda k: fetch_bom_versions(pool, k, **opts),
+            fetch_inventory=lambda p: fetch_inventory_pooled(pool, p, strategy=ERP_INV_STRATEGY, **wh, **opts),
+            force=force, log=log)
+    if SIM_MULTI_LEVEL and not SIM_TIME_PHASED:
+        attach_item_bom(pool, store, inventory, on_batch, log)
+    return store, inventory
+
+
+def attach_item_bom(pool, store, inventory=None, on_batch=None, log=None):
+    """
+    多阶展开：从 store 用到的品号出发逐阶查询自制件的品号 BOM 并挂接到 store，
+    新出现的下阶品号补查库存并入 inventory (为 None 时由调用方统一查询)。返回 ItemBom。
+    """
+    from kitting_engine import ItemBom
+    log = log or (lambda msg: None)
+    opts = dict(timeout=ERP_QUERY_TIMEOUT, retries=ERP_QUERY_RETRIES, on_batch=on_batch)
+    item_bom = ItemBom(fetch_item_bom(pool, store.parts.values, **opts))
+    new_parts = store.attach_item_bom(item_bom)
+    if new_parts and inventory is not None:
+        inventory.update(fetch_inventory_pooled(pool, new_parts, strategy=ERP_INV_STRATEGY,
+                                                include=ERP_INV_WAREHOUSE_INCLUDE, exclude=ERP_INV_WAREHOUSE_EXCLUDE,
+                                                **opts))
+    depth = max(item_bom.levels.values(), default=0)
+    log(f"品号 BOM: {len(item_bom)} 个自制件, 最深 {depth} 阶, 下阶新增 {len(new_parts)} 个品号")
+    for cycle in item_bom.cycles[:5]:
+        log(f"警告: 品号 BOM 有循环 {' -> '.join(cycle)}，已断开最后一步")
+    if len(item_bom.cycles) > 5:
+        log(f"... 共 {len(item_bom.cycles)} 处循环")
+    return item_bom
+
+# 表格布局 (数据起始行、车间/单别/工单单号列名) 见 plan_workbook.py
+
+# 推演引擎: "vector" 数组版 (大排程更快) / "parallel" 数组版按物料分量多进程并行 / "classic" 逐单字典版，结果一致
+SIM_ENGINE = "vector"
+SIM_PARALLEL_WORKERS = 0            # parallel 的进程数，0 为 CPU 核数
+SIM_PARALLEL_MIN_LINES = 200000     # BOM 行数少于此值时直接串行 (进程启动和数据传输不划算)
+# 增量推演：同一 ERP 快照 (库存有效期内) 反复调整日期/车间/计划后，只重算变化的部分
+# 开启时优先于 SIM_ENGINE
+SIM_INCREMENTAL = True
+SIM_CHECKPOINT_EVERY = 256  # 每隔多少单保存一份库存快照
+# 逐日推演：按各日期列的排产数量逐日领料 (不再在开工日一次锁定整张工单的缺口)，并按预计到货日计入
+# 在途采购 (PURTD 未交量) 与生产中工单 (MOCTA 未产量)。A 列写逐日齐套摘要，另存 <排程名>_逐日齐套.xlsx
+# 开启时优先于 SIM_ENGINE / SIM_INCREMENTAL，且不生成缺料时间线 (缺料时间线按整单锁定计算)
+SIM_TIME_PHASED = False
+# 多阶展开：工单用料中的自制/托外件 (INVMB.MB025 为 M/S/Y) 库存不足的部分，按品号 BOM (BOMMD) 逐阶展开，
+# 下阶用料按同样的先后顺序一并扣减；下阶都够时视为可以自制、不算缺料，否则 A 列列出下阶缺料。
+# 不适用于 classic 引擎与逐日推演 (二者仍只看工单 BOM 这一阶)
+SIM_MULTI_LEVEL = False
+# BOM 查询方式: "pipelined" 连接池并发流水线 / "setbased" 临时表集合查询 (单连接复用) / "classic" 分批 OR 条件
+ERP_FETCH_MODE = "pipelined"
+ERP_POOL_SIZE = 4          # 流水线模式的并发连接数
+ERP_QUERY_TIMEOUT = 120    # 单次查询超时 (秒)
+ERP_QUERY_RETRIES = 2      # 失败重试次数 (指数退避)
+# 库存查询: "auto" 按品号数与 INVMC/INVMB 表统计自动选择 / "in" 参数化 IN 列表分批 / "scan" 整表汇总一次
+ERP_INV_STRATEGY = "auto"
+# 计入库存的库别 (MC002)：INCLUDE 为空表示全部；EXCLUDE 中的库别不计入 (如待验仓、不良品仓)
+ERP_INV_WAREHOUSE_INCLUDE = ()
+ERP_INV_WAREHOUSE_EXCLUDE = ()
+
+# ERP 本地快照缓存 (仅 pipelined 模式)，文件放在程序旁边
+ERP_CACHE_ENABLED = True
+ERP_CACHE_BOM_TTL = 4 * 3600        # 工单/BOM 有效期 (秒)，过期后按修改日期比对
+ERP_CACHE_INV_TTL = 15 * 60         # 库存有效期 (秒)
+ERP_CACHE_KEEP_DAYS = 7             # 快照保留天数
+ERP_CACHE_MAX_MB = 512              # 缓存文件大小上限
+
+# 备份：分析前把排程文件存入同目录的隐藏目录 .排程备份 (内容相同不重复存储，gzip 压缩)，
+# 与解析排程并行进行，回写前确认备份完成。恢复见 "恢复备份..." 按钮或 python backup_store.py
+BACKUP_KEEP_LAST = 30       # 每个排程文件保留最近几份
+BACKUP_KEEP_DAYS = 14       # 另外最近几天每天保留最后一份
+
+# 运行报告：各阶段耗时 / 峰值内存 / 计数与每个 SQL 批次耗时，写在 .排程备份/reports 下 (<文件名>_<时间>_report.json)
+RUN_REPORT_ENABLED = True
+# 各阶段的进程内存 (常驻 / 峰值) 始终记录；下一项另用 tracemalloc 统计 Python 对象峰值
+RUN_REPORT_TRACE_MEMORY = False     # 纯 Python 部分会慢数倍，仅排查内存时打开
+RUN_PROFILE = False                 # 深入排查时打开：额外输出 cProfile 数据 (.prof) 与 pstats 文本
+
+# 缺料时间线：按品号列出首次缺料日期/工单、逐日累计缺口和受阻工单，另存为 <排程名>_缺料时间线.xlsx
+SHORTAGE_TIMELINE_ENABLED = True
+# 车间汇总：选择 "全部车间" 时一次推演所有行后，另存 <排程名>_车间汇总.xlsx (各车间齐套/缺料/异常行数、
+# 齐套率分布透视表，以及全厂与各车间缺量最大的品号)，不必再逐个车间分析。缺料品号取自缺料时间线，关闭时间线时不列出
+WORKSHOP_SUMMARY_ENABLED = True
 
-# 基础数据从第4行开始
-ROW_IDX_DATA_START = 4
+# 命令行批量分析 (无界面，可用于夜间计划任务)：python main.py batch --help
+# 多个排程文件合并去重后只查询一次 ERP，各文件分别回写 A 列
+
+# 分析服务 (常驻进程)：python main.py serve --help。统一持有 ERP 连接池与内存中的工单/库存快照并按间隔刷新，
+# 各计划员的界面只上传排程、取回结果，ERP 查询量不再随使用人数增加。逐日推演不经服务，仍在本机进行
+ANALYSIS_SERVICE_URL = ""           # 界面使用的服务地址 (如 "http://192.168.0.20:8765")，空为在本机分析；连不上时也在本机分析
+ANALYSIS_SERVICE_TIMEOUT = 600      # 界面等待服务结果的超时 (秒)
+SERVICE_HOST = "127.0.0.1"          # 服务监听地址；供局域网其他电脑使用时填本机局域网 IP，并务必设置 SERVICE_TOKEN
+SERVICE_PORT = 8765
+SERVICE_TOKEN = ""                  # 服务口令：服务与各界面填同一个字符串，请求不带此口令时拒绝；空为不检查 (仅限本机监听)
+SERVICE_PLAN_ROOTS = []             # 允许按服务端路径分析并回写 A 列的排程目录 (含子目录)，如 [r"\\fileserver\计划\排程"]；空为只接受上传
+SERVICE_BOM_REFRESH = 4 * 3600      # 快照中工单 BOM 的刷新间隔 (秒，经本地缓存时只拉取有变化的工单)
+SERVICE_INV_REFRESH = 15 * 60       # 库存刷新间隔 (秒)
+SERVICE_IDLE_DAYS = 3               # 超过几天无人请求的工单在刷新时移出快照
+SERVICE_WARM_DAYS = 31              # serve --warm 预先查询排程中今天起几天内排产的工单
+
+APP_TITLE = "排程齐套分析 (含当日齐套判定)"
+UI_POLL_MS = 100            # 界面轮询后台任务消息的间隔 (毫秒)
+# 分析流程各阶段 (后台线程按顺序执行，阶段之间可取消)
+ANALYSIS_STAGES = ("备份原文件", "提取工单", "查询ERP数据", "推演", "回写A列", "附带报表")
+
+
+class AnalysisCancelled(Exception):
+    pass
 
-COL_NAME_WORKSHOP = "车间"
-COL_NAME_WO_TYPE = "单别"
-COL_NAME_WO_NO = "工单单号"
 
 # ============== 应用程序类 ==============
 class DailyPlanAvailabilityApp:
     def __init__(self, root):
         self.root = root
-        self.root.title(f"排程齐套分析 (含当日齐套判定) - {CURRENT_DRIVER}")
+        self.root.title(APP_TITLE)
         self.root.geometry("1000x650")
 
         self.file_path = tk.StringVar()
@@ -56,8 +216,41 @@ class DailyPlanAvailabilityApp:
         self.selected_workshop = tk.StringVar()
         self.date_column_map = {}
         self.col_map_main = {}
+        self.erp = ErpConnection(connect_erp)
+        self.erp_pool = ConnectionPool(connect_erp, size=ERP_POOL_SIZE)
+        self.erp_cache = None
+        self.what_if = None     # (增量推演器, 已查询的工单键, 查询时间)
+        self.force_refresh = tk.BooleanVar(value=False)
+        # 后台任务 -> 界面的消息队列 (日志 / 阶段进度 / 需在主线程执行的回调)
+        self.ui_queue = queue.Queue()
+        self.worker = None
+        self.cancel_event = threading.Event()
+        self.closing = False
+        self.report = None      # 当前运行的 RunReport
+        self.sim_executor = None    # parallel 推演的进程池 (首次使用时创建，之后复用)
 
         self._create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.root.after(UI_POLL_MS, self._poll_queue)
+        self.root.bind("<Map>", self._on_first_map, add="+")
+
+    def _on_first_map(self, event):
+        """窗口首次显示：记录耗时，后台预加载重模块并探测 ODBC 驱动。"""
+        if event.widget is not self.root: return
+        self.root.unbind("<Map>")
+        shown = time.perf_counter() - STARTUP_T0
+        threading.Thread(target=self._warm_up, args=(shown,), daemon=True).start()
+
+    def _warm_up(self, shown):
+        try:
+            driver = warm_up()
+        except Exception as e:
+            traceback.print_exc()
+            self._log(f"后台预加载失败 (首次使用时再加载): {e}")
+            return
+        ready = time.perf_counter() - STARTUP_T0
+        self._ui(self.root.title, f"{APP_TITLE} - {driver}")
+        self._log(f"启动耗时: 窗口显示 {shown:.2f}s, 后台加载完成 {ready:.2f}s")
 
     def _create_widgets(self):
         main_frame = ttk.Frame(self.root, padding="10")
@@ -68,6 +261,7 @@ class DailyPlanAvailabilityApp:
         file_frame.pack(fill=tk.X, pady=5)
         ttk.Entry(file_frame, textvariable=self.file_path, width=50).pack(side=tk.LEFT, padx=5)
         ttk.Button(file_frame, text="浏览Excel...", command=self._select_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(file_frame, text="恢复备份...", command=self._open_restore_dialog).pack(side=tk.LEFT, padx=5)
         ttk.Label(file_frame, text="   工作表:").pack(side=tk.LEFT)
         self.sheet_combo = ttk.Combobox(file_frame, textvariable=self.sheet_name, state="disabled", width=15)
         self.sheet_combo.pack(side=tk.LEFT, padx=5)
@@ -97,30 +291,116 @@ class DailyPlanAvailabilityApp:
         action_frame.pack(fill=tk.X, pady=10)
         
         btn_text = "备份 -> 模拟推演 -> 写入A列 (含当日状态)"
-        ttk.Button(action_frame, text=btn_text, command=self._run_analysis_logic_v3).pack(fill=tk.X, padx=100)
+        run_row = ttk.Frame(action_frame)
+        run_row.pack(fill=tk.X, padx=100)
+        self.run_btn = ttk.Button(run_row, text=btn_text, command=self._run_analysis_logic_v3)
+        self.run_btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_btn = ttk.Button(run_row, text="取消", command=self._cancel_analysis, state="disabled")
+        self.cancel_btn.pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Checkbutton(action_frame, text="强制刷新ERP数据 (忽略本地缓存)",
+                        variable=self.force_refresh).pack(anchor=tk.W, padx=100, pady=(5, 0))
+
+        progress_row = ttk.Frame(action_frame)
+        progress_row.pack(fill=tk.X, padx=100, pady=(5, 0))
+        self.progress = ttk.Progressbar(progress_row, maximum=len(ANALYSIS_STAGES), length=200)
+        self.progress.pack(side=tk.LEFT)
+        self.stage_label = ttk.Label(progress_row, text="空闲")
+        self.stage_label.pack(side=tk.LEFT, padx=10)
 
         self.log_text = tk.Text(main_frame, height=15, state="disabled", font=("Consolas", 9), bg="#F0F0F0")
         self.log_text.pack(fill=tk.BOTH, expand=True, pady=5)
 
     def _log(self, msg):
-        self.log_text.config(state="normal")
-        self.log_text.insert(tk.END, f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state="disabled")
-        self.root.update_idletasks()
+        # 可在任意线程调用：先入队，由 _poll_queue 在主线程批量写入日志框
+        self.ui_queue.put(('log', f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}\n"))
+
+    def _ui(self, func, *args):
+        """让主线程执行 func(*args) (弹窗等 Tk 操作不能在后台线程里做)。"""
+        self.ui_queue.put(('call', (func, args)))
+
+    def _poll_queue(self):
+        lines = []
+
+        def flush():
+            if lines:
+                self.log_text.config(state="normal")
+                self.log_text.insert(tk.END, "".join(lines))
+                self.log_text.see(tk.END)
+                self.log_text.config(state="disabled")
+                lines.clear()
+
+        try:
+            while True:
+                kind, payload = self.ui_queue.get_nowait()
+                if kind == 'log':
+                    lines.append(payload)
+                elif kind == 'stage':
+                    idx, name = payload
+                    self.progress['value'] = idx
+                    self.stage_label.config(text=f"{idx + 1}/{len(ANALYSIS_STAGES)} {name}..." if name else "空闲")
+                else:
+                    flush()
+                    func, args = payload
+                    func(*args)
+        except queue.Empty:
+            pass
+        flush()
+        self.root.after(UI_POLL_MS, self._poll_queue)
+
+    def _stage(self, name):
+        """后台线程进入下一阶段：先检查是否已请求取消。"""
+        if self.cancel_event.is_set():
+            raise AnalysisCancelled()
+        self.report.begin(name)
+        self.ui_queue.put(('stage', (ANALYSIS_STAGES.index(name), name)))
+
+    def _on_sql_batch(self, kind, index, seconds, rows):
+        # erp_access 的 on_batch 回调 (可能来自连接池线程)
+        if self.report is not None:
+            self.report.sql_batch(kind, index, seconds, rows)
+
+    def _cancel_analysis(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.cancel_event.set()
+            self.cancel_btn.config(state="disabled")
+            self._log("已请求取消，当前阶段结束后停止...")
+
+    def _on_close(self):
+        if self.worker is not None and self.worker.is_alive():
+            if not messagebox.askyesno("退出", "分析仍在进行，是否取消并退出？"):
+                return
+            # 等后台线程在阶段之间停下后再关闭窗口，避免留下写了一半的文件
+            self.closing = True
+            self._cancel_analysis()
+            return
+        self._shutdown()
+
+    def _shutdown(self):
+        if self.sim_executor is not None:
+            self.sim_executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    def _on_worker_done(self):
+        self.worker = None
+        self.run_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+        self.progress['value'] = 0
+        self.stage_label.config(text="空闲")
+        if self.closing:
+            self._shutdown()
 
     def _select_file(self):
         path = filedialog.askopenfilename(filetypes=[("Excel", "*.xlsx *.xls *.xlsm")])
         if path:
             self.file_path.set(path)
             try:
-                wb = openpyxl.load_workbook(path, read_only=True)
-                self.sheet_combo['values'] = wb.sheetnames
-                if wb.sheetnames:
+                from plan_workbook import sheet_names
+                names = sheet_names(path)
+                self.sheet_combo['values'] = names
+                if names:
                     self.sheet_combo.current(0)
                     self._on_sheet_selected(None)
                 self.sheet_combo.config(state="readonly")
-                wb.close()
             except Exception as e:
                 messagebox.showerror("错误", f"无法打开文件: {e}")
 
@@ -129,74 +409,91 @@ class DailyPlanAvailabilityApp:
         sheet_name = self.sheet_name.get()
         if not file_path or not sheet_name: return
         try:
-            wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
-            ws = wb[sheet_name]
-
-            self.col_map_main = {}
-            scan_rows = [3, 2]
-            for r in scan_rows:
-                for idx, cell in enumerate(ws[r], start=1):
-                    val = str(cell.value).strip() if cell.value else ""
-                    if val and val not in self.col_map_main:
-                        self.col_map_main[val] = idx
-
-            self.date_column_map = {}
-            for cell in ws[3]:
-                val = cell.value
-                dt = self._parse_excel_date(val)
-                if dt: self.date_column_map[dt] = cell.column
-
-            col_ws_idx = self.col_map_main.get(COL_NAME_WORKSHOP)
-            workshops = set()
-            if col_ws_idx:
-                for row in ws.iter_rows(min_row=ROW_IDX_DATA_START, min_col=col_ws_idx, max_col=col_ws_idx, values_only=True):
-                    if row[0]: workshops.add(str(row[0]).strip())
-
-            self.workshop_combo['values'] = ["全部车间"] + sorted(list(workshops))
+            from plan_workbook import load_plan, ALL_WORKSHOPS
+            # 一次扫描建立排程模型，后续分析直接复用
+            model = load_plan(file_path, sheet_name)
+            self.col_map_main = model.col_map
+            self.date_column_map = model.date_column_map
+
+            self.workshop_combo['values'] = [ALL_WORKSHOPS] + model.workshops
             self.workshop_combo.current(0)
             self.workshop_combo.config(state="readonly")
 
-            self._log(f"就绪: 找到 {len(self.date_column_map)} 个日期列。")
-            wb.close()
+            self._log(f"就绪: 找到 {len(self.date_column_map)} 个日期列，{len(model.row_idx)} 行有排产。")
         except Exception as e:
             traceback.print_exc()
             self._log(f"扫描失败: {e}")
 
     def _parse_excel_date(self, val):
-        if val is None: return None
-        try:
-            if isinstance(val, datetime.datetime): return val.date()
-            if isinstance(val, datetime.date): return val
-            if isinstance(val, (int, float)):
-                return (datetime.datetime(1899, 12, 30) + datetime.timedelta(days=int(val))).date()
-            if isinstance(val, str):
-                try:
-                    return datetime.datetime.strptime(val.strip(), "%Y/%m/%d").date()
-                except:
-                    pass
-            return None
-        except:
-            return None
+        from plan_workbook import parse_excel_date
+        return parse_excel_date(val)
+
+    def _backup_store(self, file_path):
+        return BackupStore.for_file(file_path, keep_last=BACKUP_KEEP_LAST, keep_days=BACKUP_KEEP_DAYS)
 
-    def _create_backup(self, file_path):
+    def _wait_backup(self, fut):
+        """等待后台备份完成；失败时提示并返回 None (此时文件尚未改动)。"""
+        t0 = time.perf_counter()
         try:
-            dir_name = os.path.dirname(file_path)
-            base_name = os.path.basename(file_path)
-            name_part, ext_part = os.path.splitext(base_name)
-            
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_name = f"{name_part}_备份_{timestamp}{ext_part}"
-            backup_path = os.path.join(dir_name, backup_name)
-            
-            shutil.copy2(file_path, backup_path)
-            self._log(f"已创建备份文件: {backup_name}")
-            return True
+            entry = fut.result()
         except Exception as e:
             self._log(f"备份失败: {e}")
-            messagebox.showerror("备份失败", f"无法创建备份文件，操作已取消。\n{e}")
-            return False
+            self._ui(messagebox.showerror, "备份失败", f"无法创建备份文件，操作已取消 (文件未修改)。\n{e}")
+            return None
+        self.report.count(backup_wait=round(time.perf_counter() - t0, 4), backup_bytes=entry['size'],
+                          backup_stored=entry['stored'], backup_duplicate=entry['duplicate'])
+        if entry['duplicate']:
+            self._log(f"备份: 内容与 {entry['time']} 的备份相同，未重复存储")
+        else:
+            self._log(f"已备份: {entry['size'] / 1048576:.2f} MB -> {entry['stored'] / 1048576:.2f} MB")
+        return entry
+
+    def _open_restore_dialog(self):
+        path = self.file_path.get()
+        if not path or not os.path.exists(path):
+            messagebox.showwarning("提示", "请先选择排程文件。")
+            return
+        if self.worker is not None and self.worker.is_alive():
+            messagebox.showwarning("提示", "分析进行中，请结束后再恢复。")
+            return
+        store = self._backup_store(path)
+        entries = store.entries(os.path.basename(path))
+        if not entries:
+            messagebox.showinfo("恢复备份", "该文件还没有备份。")
+            return
+
+        win = tk.Toplevel(self.root)
+        win.title(f"恢复备份 - {os.path.basename(path)}")
+        win.transient(self.root)
+        lb = tk.Listbox(win, width=60, height=min(len(entries), 15), font=("Consolas", 10))
+        for e in entries:
+            lb.insert(tk.END, describe_backup(e))
+        lb.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        lb.selection_set(0)
+
+        def do_restore():
+            sel = lb.curselection()
+            if not sel: return
+            e = entries[sel[0]]
+            if not messagebox.askyesno("确认恢复", f"用 {e['time']} 的备份覆盖当前文件？\n"
+                                                   f"(当前内容会先存入备份，可再恢复回来)", parent=win):
+                return
+            try:
+                store.restore(e, path)
+            except Exception as ex:
+                messagebox.showerror("恢复失败", str(ex), parent=win)
+                return
+            self._log(f"已恢复备份: {describe_backup(e)}")
+            win.destroy()
+            self._on_sheet_selected(None)
+
+        btns = ttk.Frame(win)
+        btns.pack(pady=5)
+        ttk.Button(btns, text="恢复所选备份", command=do_restore).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btns, text="关闭", command=win.destroy).pack(side=tk.LEFT, padx=5)
 
     def _run_analysis_logic_v3(self):
+        if self.worker is not None and self.worker.is_alive(): return
         start_date = self.date_start.get_date()
         end_date = self.date_end.get_date()
         
@@ -222,8 +519,6 @@ class DailyPlanAvailabilityApp:
             messagebox.showwarning("日期无效", "所选日期范围内没有在Excel第3行找到对应的日期列。")
             return
         
-        sorted_target_cols = sorted(target_cols_map.keys())
-
         msg = (f"即将执行排程分析：\n\n文件: {file_path}\n"
                f"日期: {start_date} 至 {end_date}\n\n"
                "逻辑更新：\n1. 模拟工单总需求扣减库存\n2. 额外判断当日排产计划是否齐套\n\n"
@@ -232,127 +527,372 @@ class DailyPlanAvailabilityApp:
         confirm = messagebox.askyesno("确认修改", msg)
         if not confirm: return
 
-        if not self._create_backup(file_path): return
+        # 界面变量在主线程读取好，后台线程只使用这些参数
+        args = (file_path, sheet_name, start_date, end_date, target_workshop, self.force_refresh.get())
+        self.cancel_event.clear()
+        self.run_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        self.worker = threading.Thread(target=self._analysis_worker, args=args, daemon=True)
+        self.worker.start()
 
+    def _analysis_worker(self, file_path, sheet_name, start_date, end_date, target_workshop, force):
+        from kitting_engine import (simulate_kitting_vectorized, simulate_partitioned, BomStore, IncrementalSimulator,
+                                    simulate_time_phased, format_daily_result)
+        from plan_workbook import load_plan, ALL_WORKSHOPS
+        self.report = RunReport(RUN_REPORT_ENABLED and RUN_REPORT_TRACE_MEMORY, RUN_REPORT_ENABLED and RUN_PROFILE,
+                                file=file_path, sheet=sheet_name, start_date=start_date, end_date=end_date,
+                                workshop=target_workshop, force_refresh=force, engine=SIM_ENGINE,
+                                fetch_mode=ERP_FETCH_MODE, incremental=SIM_INCREMENTAL, time_phased=SIM_TIME_PHASED,
+                                multi_level=SIM_MULTI_LEVEL)
+        self.report.start()
+        report_base = None
+        status = "error"
         try:
-            self._log(f"加载文件 (Openpyxl)...")
-            wb = openpyxl.load_workbook(file_path)
-            ws = wb[sheet_name]
+            self._stage("备份原文件")
+            backup_store = self._backup_store(file_path)
+            stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            report_base = os.path.join(backup_store.root, "reports", f"{os.path.splitext(os.path.basename(file_path))[0]}_{stamp}")
+            backup, = start_backups([(backup_store, file_path)])   # 与解析排程并行
+            self.report.count(bytes=os.path.getsize(file_path))
 
+            self._stage("提取工单")
+            if ANALYSIS_SERVICE_URL and not SIM_TIME_PHASED:
+                reply = self._service_analysis(file_path, sheet_name, start_date, end_date, target_workshop, force)
+                if reply is not None:
+                    status = self._apply_service_reply(file_path, reply, backup)
+                    return
             self._log(f"提取工单、计划数量并确定开工顺序...")
-            # 提取数据包含：wo_key, start_date, row_idx, AND plan_qty
-            wo_list = self._extract_data_with_details(ws, sorted_target_cols, target_cols_map, target_workshop)
+            # 提取数据包含：wo_key, start_date, row_idx, AND plan_qty (复用已扫描的排程模型)
+            model = load_plan(file_path, sheet_name)
+            wo_list = model.extract(start_date, end_date, target_workshop, daily=SIM_TIME_PHASED)
             
             if not wo_list:
-                messagebox.showinfo("无数据", "所选范围内没有排产数量 > 0 的工单。")
+                status = "no_data"
+                self._ui(messagebox.showinfo, "无数据", "所选范围内没有排产数量 > 0 的工单。")
                 return
 
             # 按开工日期排序，如果日期相同，按行号排序
             wo_list.sort(key=lambda x: (x['start_date'], x['row_idx']))
+            self.report.count(plan_rows=len(model.row_idx), date_cols=len(model.date_cols), orders=len(wo_list))
             
-            self._log(f"查询ERP数据 (共 {len(wo_list)} 张工单)...")
+            self._stage("查询ERP数据")
             all_wo_keys = list(set([p['wo_key'] for p in wo_list]))
-            static_wo_data = self._fetch_erp_data(all_wo_keys)
-            
-            all_parts = set()
-            for w in static_wo_data.values():
-                for b in w['bom']: all_parts.add(b['part'])
-            
-            self._log("查询库存...")
-            static_inventory = self._fetch_inventory(list(all_parts))
+            sim = None if SIM_TIME_PHASED else self._reusable_simulator(all_wo_keys, force)
+            reused = sim is not None
+            if sim is None:
+                self._log(f"查询ERP数据 (共 {len(wo_list)} 张工单)...")
+                static_wo_data, static_inventory = self._load_erp_snapshot(all_wo_keys, force)
+                if SIM_TIME_PHASED:
+                    store = static_wo_data if isinstance(static_wo_data, BomStore) else BomStore.from_wo_data(static_wo_data)
+                    self._log("查询在途供应 (采购未交 / 工单未产)...")
+                    supply = fetch_supply(self.erp_pool, store.parts.values, timeout=ERP_QUERY_TIMEOUT,
+                                          retries=ERP_QUERY_RETRIES, on_batch=self._on_sql_batch)
+                    self.report.count(supply=len(supply))
+                elif SIM_INCREMENTAL:
+                    store = static_wo_data if isinstance(static_wo_data, BomStore) else BomStore.from_wo_data(static_wo_data)
+                    sim = IncrementalSimulator(store, static_inventory, SIM_CHECKPOINT_EVERY)
+                    self.what_if = (sim, set(all_wo_keys), time.time())
+            self.report.count(reused_snapshot=reused, **self._data_counts(sim.store if sim is not None else static_wo_data))
 
-            # 模拟环境
-            running_inv = copy.deepcopy(static_inventory)
-            
+            self._stage("推演")
             self._log("开始推演 (库存模拟扣减 & 当日判定)...")
-            results = self._simulate_logic_v3(wo_list, static_wo_data, running_inv)
+            if SIM_TIME_PHASED:
+                dates = model.target_dates(start_date, end_date)
+                results = simulate_time_phased(wo_list, dates, store, static_inventory, supply)
+                cells = sum(r['plan_days'] for r in results)
+                short_cells = cells - sum(r['kit_days'] for r in results)
+                self._log(f"逐日推演: {len(results)} 行 × {len(dates)} 天, 共 {cells} 个排产日, "
+                          f"其中 {short_cells} 个缺料/异常 (计入在途供应 {len(supply)} 笔)")
+                self.report.count(orders=len(results), plan_days=cells, short_days=short_cells)
+            elif sim is not None:
+                # 增量推演：从第一处变化之前的库存快照恢复
+                results, changed = sim.run(wo_list)
+                st = sim.stats
+                self._log(f"增量推演: 从第 {st['resume'] + 1} 单恢复, 重算 {st['recomputed']}/{st['total']} 单, "
+                          f"{len(changed)} 行结果有变化")
+                if changed:
+                    more = " ..." if len(changed) > 20 else ""
+                    self._log(f"结果有变化的行: {', '.join(map(str, changed[:20]))}{more}")
+                self.report.count(orders=st['total'], recomputed=st['recomputed'], changed_rows=len(changed))
+            else:
+                # 模拟环境
+                running_inv = copy.deepcopy(static_inventory)
+                if SIM_ENGINE == "vector":
+                    results = simulate_kitting_vectorized(wo_list, static_wo_data, running_inv)
+                elif SIM_ENGINE == "parallel":
+                    # 没有共用品号的工单组互不影响，分组后多进程推演
+                    results = simulate_partitioned(wo_list, static_wo_data, running_inv, self._get_sim_executor(),
+                                                   min_lines=SIM_PARALLEL_MIN_LINES)
+                else:
+                    results = self._simulate_logic_v3(wo_list, static_wo_data, running_inv)
+                self.report.count(orders=len(results))
 
-            self._log("正在回写 A 列...")
-            font_style = Font(name="微软雅黑", size=9)
-            
-            count = 0
-            for r in results:
-                row_idx = r['row_idx']
-                # 格式：齐套率：XX%，当日：[齐套/缺料]，最小可生产数：XX，缺料信息：品号,品名,缺XX单位
-                
-                rate_str = f"{r['rate']:.0%}"
-                daily_status = r['daily_status']
-                
-                msg = r['msg']
-                detail_str = f"缺料信息：{msg}" if msg else "缺料信息："
-                
-                final_str = f"齐套率：{rate_str}，当日：{daily_status}，最小可生产数：{r['achievable']}，{detail_str}"
-                
-                cell = ws.cell(row=row_idx, column=1)
-                cell.value = final_str
-                cell.font = font_style
-                count += 1
+            self._stage("回写A列")
+            self._log("正在回写 A 列 (直接改写工作表 XML)...")
 
+            # 最后一次取消检查；此后的写入先写临时文件再整体替换，不会留下半成品
+            if self.cancel_event.is_set(): raise AnalysisCancelled()
+            if not self._wait_backup(backup): return
             self._log(f"保存文件...")
-            wb.save(file_path)
-            wb.close()
-            
-            messagebox.showinfo("完成", f"分析完成！\n已备份原文件。\n结果已写入 {count} 行到 A 列。")
+            count = write_results(file_path, sheet_name, results, format_daily_result if SIM_TIME_PHASED else None)
+            self.report.count(rows_written=count, bytes=os.path.getsize(file_path))
+            status = "ok"
+
+            done_msg = f"分析完成！\n已备份原文件。\n结果已写入 {count} 行到 A 列。"
+            summary = WORKSHOP_SUMMARY_ENABLED and target_workshop == ALL_WORKSHOPS and not SIM_TIME_PHASED
+            if SIM_TIME_PHASED or SHORTAGE_TIMELINE_ENABLED or summary:
+                # A 列已写完，此阶段取消或失败都不影响排程文件
+                try:
+                    self._stage("附带报表")
+                    outs = []
+                    if SIM_TIME_PHASED:
+                        outs.append(("逐日齐套表", self._write_daily_status(file_path, wo_list, results, dates)))
+                    else:
+                        timeline = None
+                        if SHORTAGE_TIMELINE_ENABLED:
+                            if sim is not None:
+                                store, inv0 = sim.store, sim.initial_inventory
+                            else:
+                                store = static_wo_data if isinstance(static_wo_data, BomStore) else BomStore.from_wo_data(static_wo_data)
+                                inv0 = store.inventory_vector(static_inventory)
+                            timeline, out = self._write_shortage_timeline(file_path, wo_list, store, inv0)
+                            outs.append(("缺料时间线", out))
+                        if summary:
+                            from analysis_pipeline import workshop_summary
+                            outs.append(("车间汇总", self._write_workshop_summary(
+                                file_path, workshop_summary(wo_list, results, timeline))))
+                    for label, out in outs:
+                        if out:
+                            done_msg += f"\n{label}已另存为 {os.path.basename(out)}。"
+                except AnalysisCancelled:
+                    self._log("已跳过附带报表 (A 列结果已保存)。")
+
+            self._ui(messagebox.showinfo, "完成", done_msg)
             self._log("全部完成。")
 
+        except AnalysisCancelled:
+            status = "cancelled"
+            self._log("已取消，排程文件未修改。")
         except Exception as e:
             traceback.print_exc()
             self._log(f"错误: {e}")
-            messagebox.showerror("运行错误", f"发生错误，文件未保存。\n{e}")
+            self._ui(messagebox.showerror, "运行错误", f"发生错误，文件未保存。\n{e}")
+        finally:
+            self._finish_report(status, report_base)
+            self._ui(self._on_worker_done)
+
+    def _service_analysis(self, file_path, sheet_name, start_date, end_date, target_workshop, force):
+        """上传排程交给分析服务解析与推演；服务无法连接时返回 None (改为本机分析)。"""
+        from analysis_service import remote_analyze, ServiceUnavailable
+        from plan_workbook import ALL_WORKSHOPS
+        self._log(f"提交到分析服务 {ANALYSIS_SERVICE_URL} ...")
+        try:
+            reply = remote_analyze(ANALYSIS_SERVICE_URL, file_path, sheet_name, start_date, end_date, target_workshop,
+                                   force=force, timeline=SHORTAGE_TIMELINE_ENABLED, timeout=ANALYSIS_SERVICE_TIMEOUT,
+                                   summary=WORKSHOP_SUMMARY_ENABLED and target_workshop == ALL_WORKSHOPS,
+                                   token=SERVICE_TOKEN)
+        except ServiceUnavailable as e:
+            self._log(f"分析服务无法连接 ({e})，改为本机分析。")
+            return None
+        sec = reply['seconds']
+        self._log(f"服务端完成: {reply['orders']} 张工单, 补查 ERP {reply['fetched']} 张, "
+                  f"解析 {sec['parse']:.2f}s, 推演 {sec.get('simulate', 0):.2f}s, 共 {sec['total']:.2f}s")
+        self.report.count(service=ANALYSIS_SERVICE_URL, orders=reply['orders'], service_fetched=reply['fetched'],
+                          **{f"service_{k}": v for k, v in sec.items()})
+        return reply
+
+    def _apply_service_reply(self, file_path, reply, backup):
+        """在本机回写服务返回的 A 列结果并另存缺料时间线 / 车间汇总，返回运行状态。"""
+        if reply['status'] == "no_data":
+            self._ui(messagebox.showinfo, "无数据", "所选范围内没有排产数量 > 0 的工单。")
+            return "no_data"
+        self._stage("回写A列")
+        self._log("正在回写 A 列 (直接改写工作表 XML)...")
+        if self.cancel_event.is_set(): raise AnalysisCancelled()
+        if not self._wait_backup(backup): return "error"
+        count = write_results(file_path, reply['sheet'], reply['results'], lambda r: r['text'])
+        self.report.count(rows_written=count, bytes=os.path.getsize(file_path))
+
+        done_msg = f"分析完成！\n已备份原文件。\n结果已写入 {count} 行到 A 列。"
+        timeline, summary = reply['timeline'], reply.get('summary')
+        if timeline is not None or summary is not None:
+            try:
+                self._stage("附带报表")
+                if timeline is not None:
+                    self.report.count(short_parts=len(timeline),
+                                      blocked_lines=sum(len(r['blocked']) for r in timeline))
+                    if not timeline:
+                        self._log("缺料时间线: 没有缺料的品号。")
+                    else:
+                        try:
+                            from shortage_report import write_shortage_workbook, sidecar_path
+                            out = sidecar_path(file_path)
+                            write_shortage_workbook(out, timeline)
+                            self._log(f"缺料时间线: {len(timeline)} 个品号缺料, 已写入 {os.path.basename(out)}")
+                            done_msg += f"\n缺料时间线已另存为 {os.path.basename(out)}。"
+                        except Exception as e:
+                            traceback.print_exc()
+                            self._log(f"缺料时间线写入失败 (文件是否已被打开?): {e}")
+                out = self._write_workshop_summary(file_path, summary)
+                if out:
+                    done_msg += f"\n车间汇总已另存为 {os.path.basename(out)}。"
+            except AnalysisCancelled:
+                self._log("已跳过附带报表 (A 列结果已保存)。")
+        self._ui(messagebox.showinfo, "完成", done_msg)
+        self._log("全部完成。")
+        return "ok"
 
-    def _extract_data_with_details(self, ws, sorted_col_indices, col_date_map, filter_ws):
+    def _write_shortage_timeline(self, file_path, wo_list, store, inv0):
         """
-        遍历行，找到：
-        1. 开工日期 (start_date)
-        2. 选定范围内的排产总数 (plan_qty) - 用于当日齐套判定
+        按品号反查缺料，写到排程文件旁；返回 (时间线, 写出的文件路径)。
+        无缺料时路径为 None，失败时两者均为 None。
         """
-        c_ws = self.col_map_main.get(COL_NAME_WORKSHOP)
-        c_type = self.col_map_main.get(COL_NAME_WO_TYPE)
-        c_no = self.col_map_main.get(COL_NAME_WO_NO)
+        try:
+            timeline, out = write_timeline(file_path, wo_list, store, inv0)
+            self.report.count(short_parts=len(timeline), blocked_lines=sum(len(r['blocked']) for r in timeline))
+            if not timeline:
+                self._log("缺料时间线: 没有缺料的品号。")
+                return timeline, None
+            self._log(f"缺料时间线: {len(timeline)} 个品号缺料, 已写入 {os.path.basename(out)}")
+            return timeline, out
+        except Exception as e:
+            traceback.print_exc()
+            self._log(f"缺料时间线写入失败 (文件是否已被打开?): {e}")
+            return None, None
 
-        if not c_type: c_type = 5
-        if not c_no: c_no = 6
+    def _write_workshop_summary(self, file_path, summary):
+        """车间汇总写到排程文件旁并在日志中列出各车间；返回写出的文件路径 (没有工单或失败时为 None)。"""
+        if not summary:
+            return None
+        from analysis_pipeline import summary_lines
+        from shortage_report import write_workshop_workbook, workshop_sidecar_path
+        self._log("车间汇总:")
+        for line in summary_lines(summary):
+            self._log(f"  {line}")
+        self.report.count(workshops=len(summary) - 1)
+        try:
+            out = workshop_sidecar_path(file_path)
+            write_workshop_workbook(out, summary)
+            self._log(f"车间汇总: 已写入 {os.path.basename(out)}")
+            return out
+        except Exception as e:
+            traceback.print_exc()
+            self._log(f"车间汇总写入失败 (文件是否已被打开?): {e}")
+            return None
 
-        data = []
-        for row in ws.iter_rows(min_row=ROW_IDX_DATA_START):
+    def _write_daily_status(self, file_path, wo_list, results, dates):
+        """逐日齐套表写到排程文件旁；返回写出的文件路径 (失败时为 None)。"""
+        try:
+            from shortage_report import write_daily_workbook, daily_sidecar_path
+            out = daily_sidecar_path(file_path)
+            write_daily_workbook(out, wo_list, results, dates)
+            self._log(f"逐日齐套表: 已写入 {os.path.basename(out)}")
+            return out
+        except Exception as e:
+            traceback.print_exc()
+            self._log(f"逐日齐套表写入失败 (文件是否已被打开?): {e}")
+            return None
+
+    def _finish_report(self, status, report_base):
+        """结束计量，日志中输出摘要，并在备份目录的 reports 下写 JSON 报告。"""
+        report = self.report
+        report.stop(status)
+        if not report.stages:
+            return
+        self._log("运行计量:")
+        for line in report.summary_lines():
+            self._log(line)
+        if RUN_REPORT_ENABLED and report_base:
             try:
-                found_start = False
-                first_date = None
-                range_total_qty = 0
-                
-                for col_idx in sorted_col_indices:
-                    if col_idx <= len(row):
-                        val = row[col_idx - 1].value
-                        if isinstance(val, (int, float)) and val > 0:
-                            range_total_qty += val
-                            if not found_start:
-                                found_start = True
-                                first_date = col_date_map[col_idx]
-                
-                if range_total_qty > 0:
-                    val_ws = row[c_ws - 1].value if (c_ws and c_ws <= len(row)) else None
-                    curr_ws = str(val_ws).strip() if val_ws else "未分类"
-                    
-                    if filter_ws != "全部车间" and curr_ws != filter_ws: continue
+                os.makedirs(os.path.dirname(report_base), exist_ok=True)
+                files = report.write(report_base + "_report.json")
+                self._log(f"运行报告: {', '.join(os.path.basename(f) for f in files)}")
+            except Exception as e:
+                self._log(f"运行报告写入失败: {e}")
 
-                    wt = row[c_type - 1].value
-                    wn = row[c_no - 1].value
-                    
-                    if wt and wn:
-                        data.append({
-                            'wo_key': (str(wt).strip(), str(wn).strip()),
-                            'start_date': first_date, # 用于排序
-                            'plan_qty': int(round(range_total_qty)), # 用于当日齐套判定
-                            'row_idx': row[0].row
-                        })
-            except:
-                continue
-        return data
+    @staticmethod
+    def _data_counts(wo_data):
+        """工单数 / BOM 行数 / 品号数 (BomStore 或 dict 结构均可)。"""
+        from kitting_engine import BomStore
+        if isinstance(wo_data, BomStore):
+            counts = {'erp_orders': wo_data.n_orders, 'bom_lines': wo_data.n_lines, 'parts': len(wo_data.parts)}
+            if wo_data.item_bom is not None:
+                counts['bom_items'] = len(wo_data.item_bom)
+            return counts
+        parts = {b['part'] for w in wo_data.values() for b in w['bom']}
+        return {'erp_orders': len(wo_data), 'bom_lines': sum(len(w['bom']) for w in wo_data.values()),
+                'parts': len(parts)}
+
+    def _load_erp_snapshot(self, keys, force=False):
+        """按 ERP_FETCH_MODE 查询工单 BOM 与库存，返回 (工单数据, {品号: 库存})。"""
+        if ERP_FETCH_MODE == "pipelined":
+            # BOM 分批并发，库存随 BOM 到达同步查询
+            static_wo_data, static_inventory = self._fetch_erp_pipelined(keys, force)
+            self._log(f"ERP 数据就绪: {static_wo_data.n_orders} 张工单, {len(static_inventory)} 个品号库存")
+            if SIM_ENGINE == "classic":
+                static_wo_data = static_wo_data.to_wo_data()
+        else:
+            if ERP_FETCH_MODE == "setbased" and SIM_ENGINE != "classic":
+                # 列式流式读取：直接生成 BomStore，品号已驻留
+                static_wo_data = fetch_bom_columnar(self.erp, keys, on_batch=self._on_sql_batch)
+                if SIM_MULTI_LEVEL and not SIM_TIME_PHASED:
+                    # 下阶品号随后与工单用料一起查库存
+                    attach_item_bom(self.erp_pool, static_wo_data, None, self._on_sql_batch, self._log)
+                all_parts = set(static_wo_data.parts.values)
+            else:
+                if ERP_FETCH_MODE == "setbased":
+                    static_wo_data = fetch_bom_setbased(self.erp, keys, on_batch=self._on_sql_batch)
+                else:
+                    static_wo_data = self._fetch_erp_data(keys)
+                all_parts = set()
+                for w in static_wo_data.values():
+                    for b in w['bom']: all_parts.add(b['part'])
+
+            self._log("查询库存...")
+            static_inventory = self._fetch_inventory(list(all_parts))
+        return static_wo_data, static_inventory
+
+    def _reusable_simulator(self, keys, force=False):
+        """
+        上次的 ERP 快照仍可用于增量推演时返回其推演器：未勾选强制刷新、
+        快照未超过库存有效期。本次新增的工单只补充查询这一部分并入快照。
+        """
+        if not SIM_INCREMENTAL or self.what_if is None or force:
+            return None
+        sim, fetched_keys, fetched_at = self.what_if
+        if time.time() - fetched_at >= ERP_CACHE_INV_TTL:
+            return None
+        self._log(f"复用上次的 ERP 快照 (共 {len(keys)} 张工单)...")
+        missing = [k for k in keys if k not in fetched_keys]
+        if missing:
+            from kitting_engine import BomStore
+            self._log(f"补充查询新增的 {len(missing)} 张工单...")
+            wo_data, inventory = self._load_erp_snapshot(missing)
+            sim.extend(wo_data if isinstance(wo_data, BomStore) else BomStore.from_wo_data(wo_data), inventory)
+            fetched_keys.update(missing)
+        return sim
+
+    def _get_sim_executor(self):
+        if self.sim_executor is None:
+            self.sim_executor = ProcessPoolExecutor(max_workers=SIM_PARALLEL_WORKERS or os.cpu_count())
+        return self.sim_executor
+
+    def _get_erp_cache(self):
+        if self.erp_cache is None:
+            self.erp_cache = open_erp_cache()
+        return self.erp_cache
+
+    def _fetch_erp_pipelined(self, keys, force=False):
+        """流水线获取 BOM 与库存；启用缓存时只拉取过期或缺失的部分。"""
+        cache = self._get_erp_cache() if ERP_CACHE_ENABLED else None
+        return fetch_erp_snapshot(self.erp_pool, keys, cache, force, self._on_sql_batch, self._log)
 
     def _fetch_erp_data(self, keys):
         if not keys: return {}
+        import pandas as pd
         conditions = [f"(TA.TA001='{t}' AND TA.TA002='{n}')" for t, n in keys]
         data = defaultdict(lambda: {'status': '', 'total': 0, 'bom': []})
+        errors = []
         batch_size = 200
         for i in range(0, len(conditions), batch_size):
             batch = conditions[i:i + batch_size]
@@ -366,8 +906,10 @@ class DailyPlanAvailabilityApp:
                 WHERE {" OR ".join(batch)}
             """
             try:
-                with pyodbc.connect(DB_CONN_STRING) as conn:
+                t0 = time.perf_counter()
+                with connect_erp() as conn:
                     df = pd.read_sql(sql, conn)
+                    self._on_sql_batch('bom', i // batch_size, time.perf_counter() - t0, len(df))
                     for _, r in df.iterrows():
                         key = (r['t'], r['n'])
                         data[key]['total'] = float(r['total'])
@@ -376,25 +918,19 @@ class DailyPlanAvailabilityApp:
                             'part': r['p'], 'name': r['name'], 'unit': r['unit'],
                             'req': float(r['req']), 'iss': float(r['iss'])
                         })
-            except:
-                pass
+            except Exception as e:
+                where = f"工单批次 {i // batch_size + 1} ({i + 1}-{i + len(batch)})"
+                self._log(f"ERP 查询失败 {where}: {e}")
+                errors.append((where, e))
+        if errors:
+            # 与连接池查询一致：查询失败不能当作 "无ERP信息" 写回排程
+            raise ErpFetchError(errors)
         return data
 
     def _fetch_inventory(self, parts):
-        if not parts: return {}
-        inv = {}
-        parts = list(set(parts))
-        batch_size = 500
-        for i in range(0, len(parts), batch_size):
-            p_str = ",".join(f"'{p}'" for p in parts[i:i + batch_size])
-            sql = f"SELECT RTRIM(MC001) p, SUM(MC007) q FROM INVMC WHERE MC001 IN ({p_str}) GROUP BY MC001"
-            try:
-                with pyodbc.connect(DB_CONN_STRING) as conn:
-                    df = pd.read_sql(sql, conn)
-                inv.update(pd.Series(df.q.values, index=df.p).to_dict())
-            except:
-                pass
-        return inv
+        """复用连接查询库存 (参数化；品号多时自动改为整表汇总)。"""
+        return fetch_inventory_streaming(self.erp, parts, on_batch=self._on_sql_batch, strategy=ERP_INV_STRATEGY,
+                                         include=ERP_INV_WAREHOUSE_INCLUDE, exclude=ERP_INV_WAREHOUSE_EXCLUDE)
 
     def _simulate_logic_v3(self, wo_list, wo_data, running_inv):
         results = []
@@ -515,7 +1051,209 @@ class DailyPlanAvailabilityApp:
 
         return results
 
+# ============== 命令行批量分析 ==============
+def _cli_date(text):
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d"):
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    import argparse
+    raise argparse.ArgumentTypeError(f"日期格式应为 YYYY-MM-DD: {text}")
+
+
+def batch_main(argv):
+    """无界面批量分析，返回退出码：0 全部成功 (含无排产的文件)，1 有文件失败或 ERP 查询失败。"""
+    import argparse
+    from analysis_pipeline import expand_paths, analyze_files
+    from kitting_engine import simulate_partitioned
+    from plan_workbook import ALL_WORKSHOPS
+
+    ap = argparse.ArgumentParser(prog="main.py batch", description="批量分析多个排程文件 (合并后只查询一次 ERP)")
+    ap.add_argument("files", nargs="+", help="排程文件、目录或通配符 (如 \\\\server\\排程\\*.xlsx)")
+    ap.add_argument("--start", type=_cli_date, default=datetime.date.today(), help="开始日期 YYYY-MM-DD (默认今天)")
+    ap.add_argument("--end", type=_cli_date, help="结束日期 (默认与开始日期相同)")
+    ap.add_argument("--days", type=int, help="从开始日期起共几天 (代替 --end)")
+    ap.add_argument("--workshop", default=ALL_WORKSHOPS, help=f"只分析该车间 (默认 {ALL_WORKSHOPS})")
+    ap.add_argument("--sheet", help="工作表名 (默认每个文件的第一个工作表)")
+    ap.add_argument("--workers", type=int, default=0, help="解析排程的进程数 (默认 min(文件数, CPU 核数))")
+    ap.add_argument("--force-refresh", action="store_true", help="忽略本地 ERP 缓存")
+    ap.add_argument("--no-timeline", action="store_true", help="不生成缺料时间线")
+    ap.add_argument("--no-summary", action="store_true", help=f"{ALL_WORKSHOPS}时不生成车间汇总")
+    ap.add_argument("--log", help="日志同时追加写入此文件 (打包后的窗口程序没有控制台)")
+    ap.add_argument("--report", help="运行报告 JSON 路径 (默认写在第一个文件的 .排程备份/reports 下)")
+    args = ap.parse_args(argv)
+    end = args.end or (args.start + datetime.timedelta(days=args.days - 1) if args.days else args.start)
+    if end < args.start:
+        ap.error("结束日期不能早于开始日期")
+    if SIM_TIME_PHASED:
+        ap.error("批量分析不支持逐日推演 (SIM_TIME_PHASED = True)：请在界面中分析，或先关闭该设置")
+
+    log, close_log = _cli_logger(args.log)
+    paths = expand_paths(args.files)
+    if not paths:
+        log("没有找到排程文件。")
+        return 1
+    log(f"批量分析 {len(paths)} 个文件, 日期 {args.start} 至 {end}, 车间 {args.workshop}")
+    report = RunReport(RUN_REPORT_ENABLED and RUN_REPORT_TRACE_MEMORY, RUN_REPORT_ENABLED and RUN_PROFILE,
+                       files=paths, sheet=args.sheet, start_date=args.start, end_date=end, workshop=args.workshop,
+                       force_refresh=args.force_refresh, engine=SIM_ENGINE, multi_level=SIM_MULTI_LEVEL, batch=True)
+    pool = ConnectionPool(connect_erp, size=ERP_POOL_SIZE)
+    cache = open_erp_cache() if ERP_CACHE_ENABLED else None
+    # 与界面相同的推演引擎 (增量推演只在界面反复分析时有意义，单次推演结果与 SIM_ENGINE 相同)
+    sim_executor, simulate = None, None
+    if SIM_ENGINE == "parallel":
+        sim_executor = ProcessPoolExecutor(max_workers=SIM_PARALLEL_WORKERS or os.cpu_count())
+        simulate = lambda wl, store, inv: simulate_partitioned(wl, store, inv, sim_executor,
+                                                               min_lines=SIM_PARALLEL_MIN_LINES)
+    elif SIM_ENGINE == "classic":
+        simulate = lambda wl, store, inv: DailyPlanAvailabilityApp._simulate_logic_v3(None, wl, store.to_wo_data(), inv)
+    status, failed = "error", len(paths)
+    report.start()
+    try:
+        jobs = analyze_files(
+            paths, lambda keys: fetch_erp_snapshot(pool, keys, cache, args.force_refresh, report.sql_batch, log),
+            args.start, end, args.workshop, sheet=args.sheet, workers=args.workers,
+            timeline=SHORTAGE_TIMELINE_ENABLED and not args.no_timeline,
+            summary=WORKSHOP_SUMMARY_ENABLED and not args.no_summary and args.workshop == ALL_WORKSHOPS,
+            keep_last=BACKUP_KEEP_LAST, keep_days=BACKUP_KEEP_DAYS, report=report, log=log, simulate=simulate)
+        failed = sum(j['status'] == "error" for j in jobs)
+        status = "ok" if not failed else "partial"
+        log("结果:")
+        for j in jobs:
+            name = os.path.basename(j['path'])
+            if j['status'] == "ok":
+                short = f", {j['short_parts']} 个品号缺料" if j['short_parts'] else ""
+                log(f"  {name}: 已写入 {j['rows_written']} 行{short}")
+                if j['summary']:
+                    log(f"    车间汇总: {os.path.basename(j['summary'])}")
+            elif j['status'] == "no_data":
+                log(f"  {name}: 范围内无排产")
+            else:
+                log(f"  {name}: 失败 - {j['error']}")
+    except Exception as e:
+        traceback.print_exc()
+        log(f"错误: {e} (排程文件均未修改)")
+    finally:
+        report.stop(status)
+        pool.close()
+        if cache is not None:
+            cache.close()
+        if sim_executor is not None:
+            sim_executor.shutdown()
+        log("运行计量:")
+        for line in report.summary_lines():
+            log(line)
+        if RUN_REPORT_ENABLED:
+            path = args.report
+            if not path:
+                stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                path = os.path.join(BackupStore.for_file(paths[0]).root, "reports", f"batch_{stamp}_report.json")
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                report.write(path)
+                log(f"运行报告: {path}")
+            except Exception as e:
+                log(f"运行报告写入失败: {e}")
+        close_log()
+    return 1 if failed else 0
+
+
+def serve_main(argv):
+    """常驻分析服务 (Ctrl+C 结束)，返回退出码。"""
+    import argparse
+    from analysis_service import Snapshot, AnalysisService, make_server
+    from analysis_pipeline import expand_paths, parse_plan
+    from plan_workbook import ALL_WORKSHOPS
+
+    ap = argparse.ArgumentParser(prog="main.py serve", description="常驻分析服务：共用 ERP 连接池与内存中的工单/库存快照")
+    ap.add_argument("--host", default=SERVICE_HOST, help=f"监听地址 (默认 {SERVICE_HOST})")
+    ap.add_argument("--port", type=int, default=SERVICE_PORT, help=f"端口 (默认 {SERVICE_PORT})")
+    ap.add_argument("--warm", nargs="*", default=(),
+                    help=f"启动时预先查询这些排程文件/目录/通配符中今天起 {SERVICE_WARM_DAYS} 天内排产的工单")
+    ap.add_argument("--log", help="日志同时追加写入此文件")
+    args = ap.parse_args(argv)
+    log, close_log = _cli_logger(args.log)
+
+    opts = dict(timeout=ERP_QUERY_TIMEOUT, retries=ERP_QUERY_RETRIES)
+    pool = ConnectionPool(connect_erp, size=ERP_POOL_SIZE)
+    cache = open_erp_cache() if ERP_CACHE_ENABLED else None
+    snapshot = Snapshot(
+        lambda keys, force: fetch_erp_snapshot(pool, keys, cache, force, log=log),
+        lambda parts: fetch_inventory_pooled(pool, parts, strategy=ERP_INV_STRATEGY, include=ERP_INV_WAREHOUSE_INCLUDE,
+                                             exclude=ERP_INV_WAREHOUSE_EXCLUDE, **opts),
+        bom_interval=SERVICE_BOM_REFRESH, inv_interval=SERVICE_INV_REFRESH, idle_days=SERVICE_IDLE_DAYS, log=log)
+    service = AnalysisService(snapshot, keep_last=BACKUP_KEEP_LAST, keep_days=BACKUP_KEEP_DAYS,
+                              plan_roots=SERVICE_PLAN_ROOTS, token=SERVICE_TOKEN, log=log)
+    server = None
+    try:
+        server = make_server(service, args.host, args.port)
+        if args.warm:
+            today = datetime.date.today()
+            keys = {}
+            for path in expand_paths(args.warm):
+                try:
+                    _, wo_list, _ = parse_plan(path, None, today, today + datetime.timedelta(days=SERVICE_WARM_DAYS - 1),
+                                               ALL_WORKSHOPS)
+                except Exception as e:
+                    log(f"{os.path.basename(path)}: 解析失败, 跳过预查询 - {e}")
+                    continue
+                keys.update(dict.fromkeys(w['wo_key'] for w in wo_list))
+            log(f"预先查询 {len(keys)} 张工单...")
+            try:
+                (store, inventory, _), _ = snapshot.get(list(keys))
+                log(f"快照就绪: {store.n_orders if store is not None else 0} 张工单, {len(inventory)} 个品号库存")
+            except Exception as e:
+                log(f"预先查询失败 (服务照常启动，请求时再查询): {e}")
+        if not SERVICE_TOKEN and args.host not in ("127.0.0.1", "localhost", "::1"):
+            log(f"警告: 监听 {args.host} 但未设置 SERVICE_TOKEN，局域网内任何人都可以使用本服务")
+        snapshot.start()
+        log(f"分析服务已启动: http://{args.host}:{server.server_address[1]} "
+            f"(库存每 {SERVICE_INV_REFRESH // 60} 分钟、工单 BOM 每 {SERVICE_BOM_REFRESH / 3600:g} 小时刷新)")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("分析服务已停止。")
+    except Exception as e:
+        traceback.print_exc()
+        log(f"错误: {e}")
+        return 1
+    finally:
+        if server is not None:
+            server.server_close()
+        snapshot.stop()
+        service.close()
+        pool.close()
+        if cache is not None:
+            cache.close()
+        close_log()
+    return 0
+
+
+def _cli_logger(path=None):
+    """命令行日志：带时间戳输出到控制台，path 非空时同时追加到文件。返回 (log, close)。"""
+    log_file = open(path, "a", encoding="utf-8") if path else None
+
+    def log(msg):
+        line = f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {msg}"
+        if sys.stdout is not None:
+            print(line, flush=True)
+        if log_file:
+            log_file.write(line + "\n")
+            log_file.flush()
+
+    def close():
+        if log_file:
+            log_file.close()
+    return log, close
+
+
 if __name__ == "__main__":
+    # 打包成 exe 后，parallel 推演 / 批量解析的子进程需要
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        sys.exit(serve_main(sys.argv[2:]))
     try:
         root = tk.Tk()
         app = DailyPlanAvailabilityApp(root)
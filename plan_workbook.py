@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+排程工作簿扫描
+
+一次只读流式扫描得到 PlanModel：表头映射、日期列、每行的车间 / 工单键 /
+各日期列数量。结果按 (路径, 修改时间, 大小) 缓存，选择工作表、车间筛选和
+分析都复用同一份模型，不再重复打开工作簿。
+数据行与原逐格读取一样按公式原文读取 (公式格的排产数量记 0)；表头/日期行
+含公式 (如 =E3+1) 时另按缓存的计算结果重读这两行。
+"""
+import datetime
+import os
+
+import numpy as np
+import openpyxl
+
+ROW_IDX_DATA_START = 4
+HEADER_ROWS = (3, 2)        # 表头扫描顺序：先第3行，再第2行
+DATE_ROW = 3
+
+COL_NAME_WORKSHOP = "车间"
+COL_NAME_WO_TYPE = "单别"
+COL_NAME_WO_NO = "工单单号"
+DEFAULT_COL_WO_TYPE = 5
+DEFAULT_COL_WO_NO = 6
+ALL_WORKSHOPS = "全部车间"
+UNCLASSIFIED = "未分类"
+
+
+def parse_excel_date(val):
+    if val is None: return None
+    try:
+        if isinstance(val, datetime.datetime): return val.date()
+        if isinstance(val, datetime.date): return val
+        if isinstance(val, (int, float)):
+            return (datetime.datetime(1899, 12, 30) + datetime.timedelta(days=int(val))).date()
+        if isinstance(val, str):
+            try:
+                return datetime.datetime.strptime(val.strip(), "%Y/%m/%d").date()
+            except ValueError:
+                pass
+        return None
+    except Exception:
+        return None
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+class PlanModel:
+    """
+    col_map: {表头文字: 列号}
+    date_column_map: {日期: 列号}
+    date_cols: 日期列号 (升序)，qty[:, j] 为 date_cols[j] 列的数量 (非正数/非数字记 0)
+    row_idx / workshop / wo_key: 每个数据行的行号、车间 (空为 "未分类")、(单别, 单号) 或 None
+    workshops: 车间下拉框内容 (不含 "全部车间")
+    """
+
+    def __init__(self, col_map, date_column_map, row_idx, workshop, wo_key, qty, workshops):
+        self.col_map = col_map
+        self.date_column_map = date_column_map
+        self.date_cols = sorted(date_column_map.values())
+        self.row_idx = row_idx
+        self.workshop = workshop
+        self.wo_key = wo_key
+        self.qty = qty
+        self.workshops = workshops
+
+    def target_columns(self, start_date, end_date):
+        """日期范围内存在的列：{列号: 日期}。"""
+        target = {}
+        curr = start_date
+        while curr <= end_date:
+            if curr in self.date_column_map:
+                target[self.date_column_map[curr]] = curr
+            curr += datetime.timedelta(days=1)
+        return target
+
+    def target_dates(self, start_date, end_date):
+        """日期范围内存在的日期 (升序)，即 extract(daily=True) 中 'daily' 的顺序。"""
+        return sorted(self.target_columns(start_date, end_date).values())
+
+    def extract(self, start_date, end_date, filter_ws, daily=False):
+        """
+        与原 _extract_data_with_details 相同的输出：
+        [{'wo_key', 'start_date', 'plan_qty', 'row_idx', 'workshop'}]，按行号顺序 (未排序)。
+        daily=True 时每项另带 'daily'：按 target_dates 顺序的逐日排产数量 (逐日推演用)。
+        """
+        target = self.target_columns(start_date, end_date)
+        if not target or not len(self.row_idx):
+            return []
+        col_pos = {c: j for j, c in enumerate(self.date_cols)}
+        cols = sorted(target)
+        if daily:
+            per_day = self.qty[:, [col_pos[self.date_column_map[d]] for d in sorted(target.values())]]
+
+        # 逐列顺序累加，保持与逐格相加相同的浮点结果
+        total = np.zeros(len(self.row_idx), dtype=np.float64)
+        first = np.full(len(self.row_idx), -1, dtype=np.int64)
+        for k, c in enumerate(cols):
+            v = self.qty[:, col_pos[c]]
+            total += v
+            first[(first < 0) & (v > 0)] = k
+
+        data = []
+        for i in np.flatnonzero(total > 0).tolist():
+            if filter_ws != ALL_WORKSHOPS and self.workshop[i] != filter_ws: continue
+            key = self.wo_key[i]
+            if key is None: continue
+            rec = {
+                'wo_key': key,
+                'start_date': target[cols[first[i]]],
+                'plan_qty': int(round(total[i])),
+                'row_idx': self.row_idx[i],
+                'workshop': self.workshop[i],
+            }
+            if daily:
+                rec['daily'] = per_day[i]
+            data.append(rec)
+        return data
+
+
+def _header_rows(ws):
+    return dict(enumerate(ws.iter_rows(min_row=min(HEADER_ROWS), max_row=max(HEADER_ROWS), values_only=True),
+                          start=min(HEADER_ROWS)))
+
+
+def _is_formula(val):
+    return isinstance(val, str) and val.startswith("=")
+
+
+def _scan(path, sheet_name):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        ws = wb[sheet_name]
+
+        header = _header_rows(ws)
+        if any(_is_formula(v) for row in header.values() for v in row):
+            hwb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+            try:
+                header = _header_rows(hwb[sheet_name])
+            finally:
+                hwb.close()
+        col_map = {}
+        for r in HEADER_ROWS:
+            for idx, val in enumerate(header.get(r, ()), start=1):
+                val = str(val).strip() if val else ""
+                if val and val not in col_map:
+                    col_map[val] = idx
+
+        date_column_map = {}
+        for idx, val in enumerate(header.get(DATE_ROW, ()), start=1):
+            dt = parse_excel_date(val)
+            if dt: date_column_map[dt] = idx
+
+        c_ws = col_map.get(COL_NAME_WORKSHOP)
+        c_type = col_map.get(COL_NAME_WO_TYPE) or DEFAULT_COL_WO_TYPE
+        c_no = col_map.get(COL_NAME_WO_NO) or DEFAULT_COL_WO_NO
+        date_cols = sorted(date_column_map.values())
+
+        # 只读取用得到的列区间
+        needed = [c for c in (c_ws, c_type, c_no) if c] + date_cols
+        min_col, max_col = min(needed), max(needed)
+        off = min_col - 1
+        date_pos = [c - 1 - off for c in date_cols]
+
+        row_idx, workshop, wo_key, qty_rows = [], [], [], []
+        workshops = set()
+        for r, row in enumerate(ws.iter_rows(min_row=ROW_IDX_DATA_START, min_col=min_col, max_col=max_col,
+                                             values_only=True), start=ROW_IDX_DATA_START):
+            n = len(row)
+            v_ws = row[c_ws - 1 - off] if c_ws and c_ws - 1 - off < n else None
+            if v_ws: workshops.add(str(v_ws).strip())
+            q = []
+            for p in date_pos:
+                v = row[p] if p < n else None
+                q.append(v if isinstance(v, (int, float)) and v > 0 else 0)
+            if not any(q): continue
+            wt = row[c_type - 1 - off] if c_type - 1 - off < n else None
+            wn = row[c_no - 1 - off] if c_no - 1 - off < n else None
+            row_idx.append(r)
+            workshop.append(str(v_ws).strip() if v_ws else UNCLASSIFIED)
+            wo_key.append((str(wt).strip(), str(wn).strip()) if wt and wn else None)
+            qty_rows.append(q)
+
+        qty = np.array(qty_rows, dtype=np.float64).reshape(len(qty_rows), len(date_cols))
+        return PlanModel(col_map, date_column_map, row_idx, workshop, wo_key, qty, sorted(workshops))
+    finally:
+        wb.close()
+
+
+_plan_cache = {}
+_sheet_cache = {}
+
+
+def sheet_names(path):
+    """工作表名称 (按文件修改时间/大小缓存)。"""
+    path = os.path.abspath(path)
+    stamp = _file_stamp(path)
+    hit = _sheet_cache.get(path)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        names = list(wb.sheetnames)
+    finally:
+        wb.close()
+    _sheet_cache[path] = (stamp, names)
+    return names
+
+
+def load_plan(path, sheet_name):
+    """取得工作表的 PlanModel；文件未变化时直接返回缓存。"""
+    path = os.path.abspath(path)
+    stamp = _file_stamp(path)
+    hit = _plan_cache.get((path, sheet_name))
+    if hit and hit[0] == stamp:
+        return hit[1]
+    model = _scan(path, sheet_name)
+    _plan_cache[(path, sheet_name)] = (stamp, model)
+    return model
+
+
+def forget_plan(path):
+    """丢弃该文件的缓存 (文件删除后调用，供常驻的分析服务释放内存)。"""
+    path = os.path.abspath(path)
+    _sheet_cache.pop(path, None)
+    for key in [k for k in list(_plan_cache) if k[0] == path]:
+        _plan_cache.pop(key, None)
+
+
+def restamp_plan(path, sheet_name, touched_cols=(1,)):
+    """
+    本程序自己改写文件后 (只动了 touched_cols 列)，若这些列不在模型读取范围内，
+    把缓存登记到新的修改时间/大小，下次无需重新扫描。
+    """
+    path = os.path.abspath(path)
+    hit = _plan_cache.get((path, sheet_name))
+    if not hit: return
+    model = hit[1]
+    used = set(model.date_cols)
+    used.update(c for c in (model.col_map.get(COL_NAME_WORKSHOP),
+                            model.col_map.get(COL_NAME_WO_TYPE) or DEFAULT_COL_WO_TYPE,
+                            model.col_map.get(COL_NAME_WO_NO) or DEFAULT_COL_WO_NO) if c)
+    if used.isdisjoint(touched_cols):
+        stamp = _file_stamp(path)
+        _plan_cache[(path, sheet_name)] = (stamp, model)
+        names = _sheet_cache.get(path)
+        if names:
+            _sheet_cache[path] = (stamp, names[1])
+    else:
+        _plan_cache.pop((path, sheet_name), None)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+运行计量
+
+记录一次分析运行中各阶段的耗时、内存、数据量计数，以及每个 SQL 批次的耗时与行数；
+结束后写成 JSON 报告，并生成日志摘要。
+内存默认在每个阶段结束时读取进程常驻内存 (当前值与进程峰值，一次系统调用，可常开)；
+需要 Python 对象层面的各阶段峰值时另开 tracemalloc (会拖慢纯 Python 代码)。
+可选开启 cProfile，另存 .prof 原始数据与按累计耗时排序的 pstats 文本。
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+_MB = 1048576
+
+
+def _windows_memory():
+    import ctypes
+    from ctypes import wintypes
+
+    class Counters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    kernel32 = ctypes.WinDLL("kernel32")
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    psapi = ctypes.WinDLL("psapi")
+    psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(Counters), wintypes.DWORD]
+    psapi.GetProcessMemoryInfo.restype = wintypes.BOOL
+    c = Counters()
+    c.cb = ctypes.sizeof(c)
+    if not psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb):
+        return None, None
+    return c.WorkingSetSize, c.PeakWorkingSetSize
+
+
+def process_memory():
+    """(当前常驻内存, 进程启动以来的峰值)，单位字节；取不到的项为 None。"""
+    try:
+        if sys.platform == "win32":
+            return _windows_memory()
+        with open("/proc/self/status", "rb") as f:
+            fields = dict(line.split(b":", 1) for line in f if b":" in line)
+        return int(fields[b"VmRSS"].split()[0]) * 1024, int(fields[b"VmHWM"].split()[0]) * 1024
+    except Exception:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return None, peak if sys.platform == "darwin" else peak * 1024
+    except Exception:
+        return None, None
+
+
+def _mb(n):
+    return round(n / _MB, 2) if n is not None else None
+
+
+class RunReport:
+    """
+    各阶段记录 rss_mb / peak_rss_mb：阶段结束时的常驻内存与到此为止的进程峰值
+    (峰值在该阶段上升时即为该阶段的峰值)，开销可忽略，始终记录。系统给出的峰值与常驻内存
+    分别统计、不保证先后读数递增，报告中的峰值取历次读数 (含常驻内存) 的最大值。
+    trace_memory: 另用 tracemalloc 统计各阶段 Python 对象的峰值 peak_mb (会拖慢纯 Python 代码)
+    profile: 对调用 start() 的线程开启 cProfile (连接池线程不在其中)
+    """
+
+    def __init__(self, trace_memory=False, profile=False, **meta):
+        self.meta = meta
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+        self.stages = []
+        self.sql = []
+        self.status = "running"
+        self._current = None
+        self._lock = threading.Lock()
+        self._owns_tracing = False
+        self._peak = None
+        self._t0 = None
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self, status="ok"):
+        self.end()
+        if self.profiler:
+            self.profiler.disable()
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+        self.status = status
+
+    # ---------- 阶段 ----------
+
+    def begin(self, name):
+        """结束当前阶段并开始新阶段。"""
+        self.end()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._current = {'name': name, 'seconds': 0.0, 'rss_mb': None, 'peak_rss_mb': None, 'peak_mb': None,
+                         'counts': {}, '_t0': time.perf_counter()}
+
+    def end(self):
+        cur = self._current
+        if cur is None:
+            return
+        cur['seconds'] = round(time.perf_counter() - cur.pop('_t0'), 4)
+        rss, peak = process_memory()
+        for n in (peak, rss):
+            if n is not None and (self._peak is None or n > self._peak):
+                self._peak = n
+        cur['rss_mb'], cur['peak_rss_mb'] = _mb(rss), _mb(self._peak)
+        if tracemalloc.is_tracing():
+            cur['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1048576, 2)
+        self.stages.append(cur)
+        self._current = None
+
+    def count(self, **counts):
+        """给当前阶段记录计数 (行数、工单数、BOM 行数、品号数等)。"""
+        if self._current is not None:
+            self._current['counts'].update(counts)
+
+    def sql_batch(self, kind, index, seconds, rows):
+        """SQL 批次回调，签名与 erp_access 的 on_batch 相同；可在任意线程调用。"""
+        stage = self._current['name'] if self._current else None
+        with self._lock:
+            self.sql.append({'stage': stage, 'kind': kind, 'index': index,
+                             'seconds': round(seconds, 4), 'rows': rows})
+
+    # ---------- 输出 ----------
+
+    def to_dict(self):
+        by_kind = {}
+        for b in self.sql:
+            k = by_kind.setdefault(b['kind'], {'batches': 0, 'rows': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            k['batches'] += 1
+            k['rows'] += b['rows']
+            k['seconds'] = round(k['seconds'] + b['seconds'], 4)
+            k['max_seconds'] = max(k['max_seconds'], b['seconds'])
+        return {
+            'status': self.status,
+            'started_at': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)) if self.started_at else None,
+            'total_seconds': round(sum(s['seconds'] for s in self.stages), 4),
+            'meta': self.meta,
+            'stages': self.stages,
+            'sql_summary': by_kind,
+            'sql_batches': self.sql,
+        }
+
+    def write(self, path):
+        """写 JSON 报告；开启了 cProfile 时同时写 <报告名>.prof 与 <报告名>.pstats.txt。返回写出的文件列表。"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+        files = [path]
+        if self.profiler:
+            stem = os.path.splitext(path)[0]
+            self.profiler.dump_stats(stem + ".prof")
+            buf = io.StringIO()
+            pstats.Stats(self.profiler, stream=buf).sort_stats("cumulative").print_stats(60)
+            with open(stem + ".pstats.txt", "w", encoding="utf-8") as f:
+                f.write(buf.getvalue())
+            files += [stem + ".prof", stem + ".pstats.txt"]
+        return files
+
+    def summary_lines(self):
+        lines = []
+        peak = None
+        for s in self.stages:
+            mem = ""
+            if s.get('rss_mb') is not None:
+                mem += f", 内存 {s['rss_mb']:.0f} MB"
+            if s.get('peak_rss_mb') is not None and f"{s['peak_rss_mb']:.0f}" != peak:
+                # 进程峰值只在上升的阶段列出
+                peak = f"{s['peak_rss_mb']:.0f}"
+                mem += f" (进程峰值 {peak} MB)"
+            if s['peak_mb'] is not None:
+                mem += f", 对象峰值 {s['peak_mb']:.1f} MB"
+            counts = ", ".join(f"{k}={v}" for k, v in s['counts'].items())
+            lines.append(f"  {s['name']}: {s['seconds']:.2f}s{mem}" + (f" ({counts})" if counts else ""))
+        for kind, k in self.to_dict()['sql_summary'].items():
+            lines.append(f"  SQL[{kind}]: {k['batches']} 批, {k['rows']} 行, 合计 {k['seconds']:.2f}s, "
+                         f"最慢一批 {k['max_seconds']:.2f}s")
+        return lines
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+缺料时间线工作簿
+
+把 kitting_engine.shortage_timeline 的结果另存为独立的 xlsx，供采购按品号查看：
+- 缺料汇总：每个品号一行，首次缺料的日期 / 工单、总需求、总缺口、受阻工单数；
+- 缺料时间线：品号 × 日期的当日需求、累计需求、累计缺口；
+- 受阻工单：每条缺料的 BOM 行 (工单、行号、需求、扣减前库存、缺量)。
+逐日推演另存 <排程名>_逐日齐套.xlsx：每个排程行一行，各排产日的齐套/缺料状态。
+全部车间一次推演后另存 <排程名>_车间汇总.xlsx：各车间行数、齐套/缺料/异常、齐套率分布的透视表，
+以及全厂与各车间缺量最大的品号各一张表 (汇总见 analysis_pipeline.workshop_summary)。
+大排程时明细可达数十万行，用 xlsx_patch.write_table_workbook 直接流式生成 XML。
+"""
+import os
+
+from xlsx_patch import write_table_workbook
+
+SUMMARY_HEADERS = ("品号", "品名", "单位", "期初库存", "总需求", "总缺口", "首次缺料日期", "首次缺料工单",
+                   "排程行号", "受阻工单数")
+TIMELINE_HEADERS = ("品号", "品名", "日期", "当日需求", "累计需求", "累计缺口", "当日受阻工单数")
+BLOCKED_HEADERS = ("品号", "品名", "开工日期", "工单", "排程行号", "需求", "扣减前库存", "缺量")
+SIDECAR_SUFFIX = "_缺料时间线.xlsx"
+DAILY_SUFFIX = "_逐日齐套.xlsx"
+DAILY_HEADERS = ("排程行号", "工单", "齐套天数", "排产天数", "首次缺料日期", "首日缺料信息")
+WORKSHOP_SUFFIX = "_车间汇总.xlsx"
+RATE_BINS = ((100, "100%"), (80, "80~99%"), (50, "50~79%"), (1, "1~49%"), (0, "0%"))  # 齐套率分布 (下限%, 表头)
+PIVOT_HEADERS = (("车间", "排产行数", "工单数", "齐套", "缺料", "异常", "当日缺料", "齐套率%")
+                 + tuple(label for _, label in RATE_BINS) + ("缺料品号数",))
+TOP_HEADERS = ("排名", "品号", "品名", "单位", "缺量", "受阻行数", "首次缺料日期", "首次缺料行号")
+_SHEET_NAME_BAD = str.maketrans({c: "_" for c in '[]:*?/\\'})
+
+
+def sidecar_path(plan_path):
+    """排程文件旁的缺料时间线文件名。"""
+    return os.path.splitext(plan_path)[0] + SIDECAR_SUFFIX
+
+
+def daily_sidecar_path(plan_path):
+    """排程文件旁的逐日齐套文件名。"""
+    return os.path.splitext(plan_path)[0] + DAILY_SUFFIX
+
+
+def workshop_sidecar_path(plan_path):
+    """排程文件旁的车间汇总文件名。"""
+    return os.path.splitext(plan_path)[0] + WORKSHOP_SUFFIX
+
+
+def _wo_text(key):
+    return "-".join(str(x).strip() for x in key)
+
+
+def _num(x):
+    return round(x, 4)
+
+
+def write_shortage_workbook(path, timeline):
+    """写出缺料时间线工作簿 (先写临时文件再整体替换)，返回缺料品号数。"""
+    summary = ((r['part'], r['name'], r['unit'], _num(r['stock']), _num(r['demand']), _num(r['shortfall']),
+                r['first_date'], _wo_text(r['first_wo']), r['first_row'], len(r['blocked'])) for r in timeline)
+    days = ((r['part'], r['name'], d, _num(dem), _num(cum), _num(cum_short), nb)
+            for r in timeline for d, dem, cum, cum_short, nb in r['days'])
+    blocked = ((r['part'], r['name'], d, _wo_text(key), row, _num(need), _num(before), _num(short))
+               for r in timeline for d, key, row, need, before, short in r['blocked'])
+    write_table_workbook(path, [
+        ("缺料汇总", SUMMARY_HEADERS, summary, (18, 30, 6, 10, 10, 10, 12, 18, 9, 10)),
+        ("缺料时间线", TIMELINE_HEADERS, days, (18, 30, 12, 10, 10, 10, 14)),
+        ("受阻工单", BLOCKED_HEADERS, blocked, (18, 30, 12, 18, 9, 10, 10, 10)),
+    ])
+    return len(timeline)
+
+
+def write_daily_workbook(path, wo_list, results, dates):
+    """
+    写出逐日齐套工作簿：results 为 kitting_engine.simulate_time_phased 的结果 (与 wo_list 对齐)，
+    dates 为推演的日期列；没有排产的日期留空。返回行数。
+    """
+    col = {d: k for k, d in enumerate(dates)}
+
+    def rows():
+        for item, r in zip(wo_list, results):
+            cells = [None] * len(dates)
+            for d, _, status in r['daily']:
+                cells[col[d]] = status
+            yield (r['row_idx'], _wo_text(item['wo_key']), r['kit_days'], r['plan_days'], r['first_short'],
+                   r['msg'], *cells)
+    headers = DAILY_HEADERS + tuple(d.strftime("%Y-%m-%d") for d in dates)
+    write_table_workbook(path, [
+        ("逐日齐套", headers, rows(), (9, 18, 9, 9, 12, 40) + (11,) * len(dates)),
+    ])
+    return len(results)
+
+
+def kit_percent(s):
+    """车间汇总一项的齐套率 (%，不含异常行)；没有可推演的行时为 None。"""
+    n = s['kitted'] + s['short']
+    return round(s['kitted'] / n * 100, 1) if n else None
+
+
+def _sheet_title(name, used):
+    """工作表名：去掉 Excel 不允许的字符、截到 31 字，重名时加序号。"""
+    base = (str(name).translate(_SHEET_NAME_BAD).strip("'") or "_")[:31]
+    title, k = base, 1
+    while title in used:
+        k += 1
+        title = f"{base[:31 - len(str(k)) - 1]}_{k}"
+    used.add(title)
+    return title
+
+
+def write_workshop_workbook(path, summary):
+    """
+    写出车间汇总工作簿 (summary 为 analysis_pipeline.workshop_summary 的结果，最后一项为合计)：
+    第一张为各车间透视表，其后为合计 (全厂) 与各车间的缺料品号排名。返回车间数。
+    """
+    pivot = ((s['workshop'], s['rows'], s['orders'], s['kitted'], s['short'], s['error'], s['daily_short'],
+              kit_percent(s), *s['rate_bins'], s['short_parts']) for s in summary)
+    used = {"车间汇总"}
+    sheets = [("车间汇总", PIVOT_HEADERS, pivot, (14, 9, 9, 8, 8, 8, 9, 9) + (9,) * len(RATE_BINS) + (10,))]
+    for s in summary[-1:] + summary[:-1]:
+        rows = ((k, part, name, unit, _num(short), n_rows, d, row)
+                for k, (part, name, unit, short, n_rows, d, row) in enumerate(s['top'], 1))
+        sheets.append((_sheet_title(f"{s['workshop']}缺料", used), TOP_HEADERS, rows, (6, 18, 30, 6, 10, 9, 12, 12)))
+    write_table_workbook(path, sheets)
+    return len(summary) - 1
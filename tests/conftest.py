@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""测试公用：把仓库根目录加入 sys.path，并提供随机排程 / ERP 数据的生成函数。"""
+import datetime
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+START = datetime.date(2026, 10, 5)
+
+
+def random_erp(rnd, n_orders, n_parts=12, done_rate=0.1, missing_rate=0.1):
+    """
+    随机 wo_data / inventory (_fetch_erp_data / _fetch_inventory 形式)。
+    品名/单位按品号固定 (取自品号主档)；同一工单可重复出现同一品号，部分品号没有库存或库存为负，部分工单已完工或 BOM 为空。
+    返回 (wo_data, inventory, keys)，keys 含若干 ERP 中不存在的工单。
+    """
+    parts = [f"P{i:03d}" for i in range(n_parts)]
+    wo_data, keys = {}, []
+    for i in range(n_orders):
+        key = ("5101", f"W{i:05d}")
+        keys.append(key)
+        if rnd.random() < missing_rate:
+            continue
+        total = rnd.choice([0, 50, 100, 120, 300])
+        bom = []
+        for _ in range(rnd.randint(0, 5)):
+            req = rnd.choice([0, 10, 25, 100, 240])
+            p = rnd.choice(parts)
+            bom.append({'part': p, 'name': f"物料{p}", 'unit': "KG" if int(p[1:]) % 3 == 0 else "PCS",
+                        'req': float(req), 'iss': float(rnd.choice([0, 0, 5, req]))})
+        wo_data[key] = {'status': "Y" if rnd.random() < done_rate else "N", 'total': float(total), 'bom': bom}
+    inventory = {}
+    for p in parts:
+        r = rnd.random()
+        if r < 0.2:
+            continue                            # 没有库存记录
+        inventory[p] = float(rnd.choice([-30, 0, 40, 150, 500, 2000])) if r < 0.9 else float(rnd.randint(1, 999))
+    return wo_data, inventory, keys
+
+
+def random_plan(rnd, keys, n_rows, n_days=5):
+    """随机排程 wo_list (已按 (开工日期, 行号) 排序)；同一工单可出现在多行。"""
+    rows = []
+    for i in range(n_rows):
+        rows.append({'row_idx': i + 4, 'wo_key': rnd.choice(keys), 'plan_qty': float(rnd.choice([0, 10, 40, 100])),
+                     'start_date': START + datetime.timedelta(days=rnd.randrange(n_days))})
+    rows.sort(key=lambda x: (x['start_date'], x['row_idx']))
+    return rows
+
+
+def make_standin(path, wo_data, inventory, warehouse="01"):
+    """把随机数据写入替身库文件，返回路径 (连接池各连接分别打开同一文件)。"""
+    from erp_standin import connect_standin, load_standin
+    conn = connect_standin(str(path))
+    load_standin(conn, wo_data, inventory, warehouse)
+    conn.close()
+    return str(path)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""批量分析 (替身库)：文件展开、多个排程合并后只查一次 ERP、各自回写 A 列，以及引擎设置；车间汇总。"""
+import datetime
+import os
+import random
+import subprocess
+import sys
+
+import openpyxl
+import pytest
+
+from analysis_pipeline import analyze_files, expand_paths, parse_plan, workshop_summary
+from backup_store import BackupStore
+from conftest import START, make_standin, random_erp
+from erp_access import ConnectionPool, fetch_pipelined
+from erp_standin import standin_factory
+from kitting_engine import format_result, simulate_kitting_vectorized
+from plan_workbook import ALL_WORKSHOPS
+from shortage_report import (PIVOT_HEADERS, RATE_BINS, SIDECAR_SUFFIX, TOP_HEADERS, WORKSHOP_SUFFIX, kit_percent,
+                             write_workshop_workbook)
+
+END = START + datetime.timedelta(days=4)
+
+
+def write_plan(path, rows, n_days=5):
+    """rows: [(车间, 工单键, {第几天: 数量})]；表头在第 3 行，E 列起为日期列。"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "排程"
+    for c, name in enumerate(["结果", "车间", "单别", "工单单号"], start=1):
+        ws.cell(3, c, name)
+    for j in range(n_days):
+        ws.cell(3, 5 + j, START + datetime.timedelta(days=j))
+    for r, (workshop, (t, n), daily) in enumerate(rows, start=4):
+        ws.cell(r, 2, workshop)
+        ws.cell(r, 3, t)
+        ws.cell(r, 4, n)
+        for j, q in daily.items():
+            ws.cell(r, 5 + j, q)
+    wb.save(path)
+    return str(path)
+
+
+def random_rows(rnd, keys, n):
+    return [(rnd.choice(["一车间", "二车间"]), rnd.choice(keys),
+             {rnd.randrange(5): rnd.choice([10, 40, 100]) for _ in range(rnd.randint(1, 2))}) for _ in range(n)]
+
+
+def column_a(path):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return {row[0].row: row[0].value for row in wb["排程"].iter_rows(min_row=4, max_col=1) if row[0].value}
+    finally:
+        wb.close()
+
+
+@pytest.fixture
+def plans(tmp_path):
+    rnd = random.Random(11)
+    wo_data, inventory, keys = random_erp(rnd, 30, n_parts=15)
+    db = make_standin(tmp_path / "erp.sqlite", wo_data, inventory)
+    plan_dir = tmp_path / "排程"
+    plan_dir.mkdir()
+    a = write_plan(plan_dir / "一车间.xlsx", random_rows(rnd, keys[:20], 25))
+    b = write_plan(plan_dir / "二车间.xlsx", random_rows(rnd, keys[10:], 25))     # 与 a 共用 10 张工单
+    pool = ConnectionPool(standin_factory(db), size=2)
+    yield pool, plan_dir, a, b
+    pool.close()
+
+
+def test_import_is_light():
+    """界面启动时导入本模块，不应连带导入 openpyxl / numpy 及依赖它们的模块。"""
+    code = ("import sys, analysis_pipeline; print(sorted(m for m in ('numpy', 'openpyxl', 'kitting_engine', "
+            "'plan_workbook', 'shortage_report', 'xlsx_patch') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip() == "[]"
+
+
+def test_expand_paths(plans, tmp_path):
+    _, plan_dir, a, b = plans
+    for name in ("~$一车间.xlsx", "说明.txt", "一车间" + SIDECAR_SUFFIX, "一车间" + WORKSHOP_SUFFIX):
+        (plan_dir / name).write_bytes(b"x")
+    missing = str(tmp_path / "不存在.xlsx")
+    assert expand_paths([str(plan_dir), a, str(plan_dir / "*车间.xlsx"), missing]) == [a, b, missing]
+
+
+def test_two_workbooks_share_one_fetch(plans):
+    pool, _, a, b = plans
+    calls = []
+
+    def fetch(keys):
+        calls.append(list(keys))
+        return fetch_pipelined(pool, keys)
+
+    expected_keys = []
+    for path in (a, b):
+        expected_keys += [w['wo_key'] for w in parse_plan(path, None, START, END, ALL_WORKSHOPS)[1]]
+    logs = []
+    jobs = analyze_files([a, b], fetch, START, END, ALL_WORKSHOPS, workers=1, summary=True, log=logs.append)
+
+    assert calls == [list(dict.fromkeys(expected_keys))]
+    assert [j['status'] for j in jobs] == ["ok", "ok"]
+    store, inventory = fetch_pipelined(pool, calls[0])
+    for j in jobs:
+        _, wo_list, _ = parse_plan(j['path'], None, START, END, ALL_WORKSHOPS)
+        # 每个文件各自从完整库存开始推演
+        expected = {r['row_idx']: format_result(r) for r in simulate_kitting_vectorized(wo_list, store, dict(inventory))}
+        assert column_a(j['path']) == expected
+        assert j['rows_written'] == len(expected)
+        assert os.path.exists(j['summary'])
+        assert (j['timeline'] is not None) == bool(j['short_parts'])
+        assert len(BackupStore.for_file(j['path']).entries(os.path.basename(j['path']))) == 1
+    assert 'wo_list' not in jobs[0] and 'results' not in jobs[0]
+
+
+def test_bad_file_only_fails_itself(plans, tmp_path):
+    pool, plan_dir, a, b = plans
+    bad = plan_dir / "损坏.xlsx"
+    bad.write_bytes(b"not a workbook")
+    jobs = analyze_files([a, str(bad), b], lambda keys: fetch_pipelined(pool, keys), START, END, "一车间",
+                         workers=2, timeline=False, log=lambda msg: None)
+    assert [j['status'] for j in jobs] == ["ok", "error", "ok"]
+    assert jobs[1]['error'].startswith("解析失败")
+    assert all(v.startswith("齐套率") for v in column_a(a).values())
+
+
+def test_engine_setting_is_used(plans):
+    pool, _, a, b = plans
+    main = pytest.importorskip("main")
+    fetch = lambda keys: fetch_pipelined(pool, keys)
+    analyze_files([a, b], fetch, START, END, ALL_WORKSHOPS, workers=1, backup=False, timeline=False,
+                  log=lambda msg: None)
+    vector = [column_a(a), column_a(b)]
+    used = []
+
+    def classic(wo_list, store, inv):
+        used.append(len(wo_list))
+        return main.DailyPlanAvailabilityApp._simulate_logic_v3(None, wo_list, store.to_wo_data(), inv)
+    analyze_files([a, b], fetch, START, END, ALL_WORKSHOPS, workers=1, backup=False, timeline=False,
+                  log=lambda msg: None, simulate=classic)
+    assert len(used) == 2
+    assert [column_a(a), column_a(b)] == vector
+
+
+def test_batch_rejects_time_phased(plans, monkeypatch):
+    _, _, a, _ = plans
+    main = pytest.importorskip("main")
+    monkeypatch.setattr(main, "SIM_TIME_PHASED", True)
+    with pytest.raises(SystemExit) as exc:
+        main.batch_main([a, "--start", START.isoformat()])
+    assert exc.value.code == 2
+
+
+def row(r, workshop, wo, rate, daily="缺料"):
+    return ({'row_idx': r, 'workshop': workshop, 'wo_key': ("5101", wo), 'start_date': START},
+            {'rate': rate, 'daily_status': "齐套" if rate >= 1 else daily})
+
+
+def blocked(part, *rows):
+    return {'part': part, 'name': part + "名", 'unit': "PCS",
+            'blocked': [(START, None, r, 10.0, 10.0 - short, short) for r, short in rows]}
+
+
+def test_workshop_summary_totals_and_bins():
+    items = [row(4, "二车间", "W1", 1.0), row(5, "一车间", "W2", 1 - 1e-12), row(6, "二车间", "W1", 0.5, "齐套"),
+             row(7, "一车间", "W3", 0.004), row(8, "一车间", "W3", 0.0, "异常"), row(9, "二车间", "W4", 0.795)]
+    wo_list, results = [i for i, _ in items], [r for _, r in items]
+    timeline = [blocked("P1", (5, 3.0), (9, 2.0)), blocked("P2", (7, 10.0)), blocked("P3", (6, 1.0), (9, 8.0))]
+    two, one, total = workshop_summary(wo_list, results, timeline)
+
+    assert [s['workshop'] for s in (two, one, total)] == ["二车间", "一车间", "合计"]
+    assert (two['rows'], two['orders'], two['kitted'], two['short'], two['error'], two['daily_short']) == (3, 2, 1, 2, 0, 1)
+    assert (one['rows'], one['orders'], one['kitted'], one['short'], one['error'], one['daily_short']) == (3, 2, 0, 2, 1, 2)
+    assert (total['rows'], total['orders'], total['kitted'], total['short'], total['error']) == (6, 4, 1, 4, 1)
+    # 差一点到 1 的缺料行在 A 列显示为 100%，仍落在 80~99% 档；79.5% 显示为 80%，0.4% 显示为 0%
+    assert one['rate_bins'] == [0, 1, 0, 0, 1]
+    assert two['rate_bins'] == [1, 1, 1, 0, 0]
+    assert total['rate_bins'] == [a + b for a, b in zip(one['rate_bins'], two['rate_bins'])]
+    assert sum(total['rate_bins']) == total['kitted'] + total['short']
+    assert kit_percent(two) == 33.3 and kit_percent(one) == 0.0
+
+    assert (one['short_parts'], two['short_parts'], total['short_parts']) == (2, 2, 3)
+    assert [t[0] for t in total['top']] == ["P2", "P3", "P1"]
+    assert total['top'][1] == ("P3", "P3名", "PCS", 9.0, 2, START, 6)
+    assert two['top'] == [("P3", "P3名", "PCS", 9.0, 2, START, 6), ("P1", "P1名", "PCS", 2.0, 1, START, 9)]
+
+    no_timeline = workshop_summary(wo_list, results)
+    assert [s['short_parts'] for s in no_timeline] == [None] * 3 and all(s['top'] == [] for s in no_timeline)
+    assert workshop_summary([], []) == []
+
+
+def test_write_workshop_workbook(tmp_path):
+    items = [row(4, "一车间", "W1", 1.0), row(5, "A/B:车间", "W2", 0.3), row(6, "一车间" * 12, "W3", 0.6),
+             row(7, "一车间" * 12 + "x", "W4", 0.0)]
+    summary = workshop_summary([i for i, _ in items], [r for _, r in items],
+                               [blocked("P1", (5, 4.0), (7, 1.0))])
+    path = str(tmp_path / ("排程" + WORKSHOP_SUFFIX))
+    assert write_workshop_workbook(path, summary) == 4
+
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        long_name = ("一车间" * 12 + "缺料")[:31]
+        assert wb.sheetnames == ["车间汇总", "合计缺料", "一车间缺料", "A_B_车间缺料", long_name,
+                                 long_name[:29] + "_2"]
+        pivot = [list(r) for r in wb["车间汇总"].iter_rows(values_only=True)]
+        assert pivot[0] == list(PIVOT_HEADERS)
+        assert [r[0] for r in pivot[1:]] == [s['workshop'] for s in summary]
+        assert pivot[-1][1:8] == [4, 4, 1, 3, 0, 3, 25]
+        assert pivot[-1][8:8 + len(RATE_BINS)] == [1, 0, 1, 1, 1] and pivot[-1][-1] == 1
+        top = [list(r) for r in wb["合计缺料"].iter_rows(values_only=True)]
+        assert top[0] == list(TOP_HEADERS)
+        assert top[1][:6] == [1, "P1", "P1名", "PCS", 5, 2]
+        assert list(wb["一车间缺料"].iter_rows(values_only=True)) == [TOP_HEADERS]
+    finally:
+        wb.close()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""分析服务的访问控制：服务口令、path 方式只接受开放目录下的排程；同一排程的回写依次进行。"""
+import os
+import random
+import threading
+import time
+
+import openpyxl
+import pytest
+
+import analysis_service
+from analysis_service import AnalysisService, Forbidden, ServiceError, Snapshot, call_service, make_server
+from backup_store import BackupStore
+from conftest import START, make_standin, random_erp
+from erp_access import ConnectionPool, fetch_inventory_pooled, fetch_pipelined
+from erp_standin import standin_factory
+
+
+def no_erp(*args):
+    raise AssertionError("不应查询 ERP")
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**kw):
+        service = AnalysisService(Snapshot(no_erp, no_erp, log=lambda msg: None), log=lambda msg: None, **kw)
+        server = make_server(service, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((server, service))
+        return f"http://127.0.0.1:{server.server_address[1]}", service
+
+    yield start
+    for server, service in servers:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def make_plans(tmp_path):
+    root, other = tmp_path / "排程", tmp_path / "其他"
+    root.mkdir()
+    other.mkdir()
+    (root / "a.xlsx").write_bytes(b"x")
+    (other / "b.xlsx").write_bytes(b"x")
+    return root, other
+
+
+def test_plan_path_must_be_under_roots(tmp_path):
+    root, other = make_plans(tmp_path)
+    service = AnalysisService(None, plan_roots=[str(root)], log=lambda msg: None)
+    try:
+        assert service._plan_path(str(root / "a.xlsx")) == os.path.realpath(root / "a.xlsx")
+        for bad in (other / "b.xlsx", root / ".." / "其他" / "b.xlsx", tmp_path / "排程2" / "a.xlsx"):
+            with pytest.raises(Forbidden):
+                service._plan_path(str(bad))
+        if hasattr(os, "symlink"):
+            os.symlink(other / "b.xlsx", root / "link.xlsx")
+            with pytest.raises(Forbidden):
+                service._plan_path(str(root / "link.xlsx"))        # 链接指向开放目录之外
+        (root / "c.txt").write_bytes(b"x")
+        with pytest.raises(ValueError):
+            service._plan_path(str(root / "c.txt"))
+        with pytest.raises(FileNotFoundError):
+            service._plan_path(str(root / "nope.xlsx"))
+    finally:
+        service.close()
+
+    closed = AnalysisService(None, log=lambda msg: None)
+    try:
+        with pytest.raises(Forbidden):
+            closed._plan_path(str(root / "a.xlsx"))
+    finally:
+        closed.close()
+
+
+def test_path_requests_outside_roots_are_refused(tmp_path, serve):
+    root, other = make_plans(tmp_path)
+    url, service = serve(plan_roots=[str(root)])
+    req = {'path': str(other / "b.xlsx"), 'start': "2026-10-05", 'write': True}
+    with pytest.raises(ServiceError, match="开放的目录"):
+        call_service(url, "/analyze", req)
+    assert (other / "b.xlsx").read_bytes() == b"x"
+    assert not os.path.exists(other / ".排程备份")
+    assert service.failures == 1
+
+
+def test_token_is_required(serve):
+    url, service = serve(token="s3cret")
+    for token in ("", "wrong"):
+        with pytest.raises(ServiceError, match="口令"):
+            call_service(url, "/status", token=token)
+        with pytest.raises(ServiceError, match="口令"):
+            call_service(url, "/analyze", {'workbook': "AAAA" * 50000, 'name': "a.xlsx", 'start': "2026-10-05"},
+                         token=token)
+    assert service.requests == 0
+    assert call_service(url, "/status", token="s3cret")['requests'] == 0
+
+
+def test_writes_to_same_plan_are_serialized(tmp_path, monkeypatch):
+    wo_data, inventory, keys = random_erp(random.Random(3), 10)
+    pool = ConnectionPool(standin_factory(make_standin(tmp_path / "erp.sqlite", wo_data, inventory)), size=2)
+    root = tmp_path / "排程"
+    (root / "子目录").mkdir(parents=True)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for c, name in enumerate(["结果", "车间", "单别", "工单单号", START], start=1):
+        ws.cell(3, c, name)
+    for r, (t, n) in enumerate(keys, start=4):
+        ws.append([None, "一车间", t, n, 10])
+    wb.save(root / "a.xlsx")
+
+    active, overlaps = [0], []
+    write_results = analysis_service.write_results
+
+    def slow_write(*args):
+        active[0] += 1
+        overlaps.append(active[0])
+        time.sleep(0.2)
+        try:
+            return write_results(*args)
+        finally:
+            active[0] -= 1
+    monkeypatch.setattr(analysis_service, "write_results", slow_write)
+
+    snapshot = Snapshot(lambda keys, force: fetch_pipelined(pool, keys), lambda parts: fetch_inventory_pooled(pool, parts),
+                        log=lambda msg: None)
+    service = AnalysisService(snapshot, plan_roots=[str(root)], log=lambda msg: None)
+    replies, errors = [], []
+
+    def request(path):
+        try:
+            replies.append(service.analyze({'path': str(path), 'start': START.isoformat(), 'write': True}))
+        except Exception as e:
+            errors.append(e)
+    # 同一文件的两种写法 (按真实路径加锁)
+    threads = [threading.Thread(target=request, args=(p,)) for p in (root / "a.xlsx", root / "子目录" / ".." / "a.xlsx")]
+    try:
+        for t in threads: t.start()
+        for t in threads: t.join()
+    finally:
+        service.close()
+        pool.close()
+    assert errors == []
+    assert [r['status'] for r in replies] == ["ok", "ok"]
+    assert overlaps == [1, 1]
+    assert len(BackupStore.for_file(str(root / "a.xlsx")).entries("a.xlsx")) == 2     # 第二次备份的是第一次回写后的文件
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""备份库：并发备份同一目录不丢记录、不删仍被引用的对象，残留锁与占用超时，恢复被清理的备份。"""
+import os
+import threading
+import time
+
+import pytest
+
+import backup_store
+from backup_store import LOCK_NAME, BackupError, BackupStore
+
+
+def check_consistent(store):
+    for e in store.entries():
+        assert os.path.exists(store._object_path(e['sha256'])), e
+    assert not os.path.exists(os.path.join(store.root, LOCK_NAME))
+
+
+def test_concurrent_backups_keep_every_entry(tmp_path):
+    n_files, rounds = 8, 20
+    files = [tmp_path / f"排程{i}.xlsx" for i in range(n_files)]
+    store = BackupStore(str(tmp_path / ".排程备份"), keep_last=3, keep_days=0)
+    errors = []
+
+    def worker(i):
+        try:
+            for r in range(rounds):
+                # 各文件内容交替重复，清理时会删对象，别的文件也会引用同一内容
+                files[i].write_bytes(b"plan %d" % ((i + r) % 4) * 2000)
+                BackupStore(store.root, keep_last=3, keep_days=0).backup(str(files[i]))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_files)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert errors == []
+    for i, f in enumerate(files):
+        mine = store.entries(f.name)
+        assert 1 <= len(mine) <= 3
+        out = tmp_path / f"恢复{i}.xlsx"
+        store.restore(mine[0], str(out))
+        assert out.read_bytes() == f.read_bytes()
+    check_consistent(store)
+
+
+def test_stale_lock_is_broken(tmp_path):
+    src = tmp_path / "排程.xlsx"
+    src.write_bytes(b"a")
+    store = BackupStore(str(tmp_path / ".排程备份"))
+    os.makedirs(store.root)
+    lock = os.path.join(store.root, LOCK_NAME)
+    with open(lock, "w") as f:
+        f.write("PC-1 pid 1")
+    old = time.time() - backup_store.LOCK_STALE - 10
+    os.utime(lock, (old, old))
+    assert store.backup(str(src))['duplicate'] is False
+    check_consistent(store)
+
+
+def test_busy_lock_times_out(tmp_path, monkeypatch):
+    src = tmp_path / "排程.xlsx"
+    src.write_bytes(b"a")
+    store = BackupStore(str(tmp_path / ".排程备份"))
+    os.makedirs(store.root)
+    monkeypatch.setattr(backup_store, "LOCK_WAIT", 0.2)
+    with store._locked():
+        with pytest.raises(BackupError, match="占用"):
+            store.backup(str(src))
+    assert store.entries() == []
+    assert os.listdir(os.path.join(store.root, "objects")) == []     # 临时对象已删
+    store.backup(str(src))
+    check_consistent(store)
+
+
+def test_restore_entry_pruned_by_its_own_backup(tmp_path):
+    src = tmp_path / "排程.xlsx"
+    store = BackupStore.for_file(str(src), keep_last=2, keep_days=0)
+    for content in (b"v1", b"v2"):
+        src.write_bytes(content)
+        store.backup(str(src))
+    src.write_bytes(b"v3")
+    oldest = store.entries(src.name)[-1]
+    store.restore(oldest, str(src))        # 恢复前备份 v3 会清理掉 v1
+    assert src.read_bytes() == b"v1"
+    assert oldest not in store.entries(src.name)
+    check_consistent(store)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""ERP 查询 (替身库)：集合查询、临时键表、连接池流水线、库存查询方式与超时重试。"""
+import random
+
+import pytest
+
+from conftest import make_standin, random_erp
+from erp_access import (SQLITE, ConnectionPool, ErpConnection, ErpFetchError, fetch_bom_columnar, fetch_bom_setbased,
+                        fetch_inventory_pooled, fetch_inventory_streaming, fetch_pipelined, load_key_table,
+                        run_with_retry)
+from erp_standin import connect_standin, standin_factory
+
+
+@pytest.fixture
+def erp_data(tmp_path):
+    rnd = random.Random(3)
+    wo_data, inventory, keys = random_erp(rnd, 300, n_parts=60)
+    return make_standin(tmp_path / "erp.sqlite", wo_data, inventory), wo_data, inventory, keys
+
+
+def expected_bom(wo_data, keys):
+    """ERP 中存在且有 BOM 行的工单 (INNER JOIN MOCTB)。"""
+    return {k: wo_data[k] for k in keys if k in wo_data and wo_data[k]['bom']}
+
+
+def test_setbased_matches_loaded_data(erp_data):
+    db, wo_data, _, keys = erp_data
+    batches = []
+    data = fetch_bom_setbased(ErpConnection(standin_factory(db)), keys, batch_size=7, chunk_size=11,
+                              on_batch=lambda *a: batches.append(a))
+    assert dict(data) == expected_bom(wo_data, keys)
+    assert [(kind, rows) for kind, _, _, rows in batches] == [('bom', sum(len(w['bom']) for w in data.values()))]
+
+
+def test_columnar_matches_setbased(erp_data):
+    db, wo_data, _, keys = erp_data
+    store = fetch_bom_columnar(ErpConnection(standin_factory(db)), keys, batch_size=50, chunk_size=13)
+    # BomStore 只保留是否完工
+    expected = {k: dict(w, status="Y" if w['status'] == "Y" else "") for k, w in expected_bom(wo_data, keys).items()}
+    assert store.to_wo_data() == expected
+
+
+def test_key_table_is_reused_and_dropped(erp_data):
+    """同一连接连续查询：临时键表每次重建，查询结束后删除，不残留上一次的工单键。"""
+    db, wo_data, _, keys = erp_data
+    erp = ErpConnection(standin_factory(db))
+    first = fetch_bom_setbased(erp, keys[:100])
+    second = fetch_bom_setbased(erp, keys[100:120])
+    assert set(first) == set(expected_bom(wo_data, keys[:100]))
+    assert set(second) == set(expected_bom(wo_data, keys[100:120]))
+    tables = erp.get().execute("SELECT name FROM temp.sqlite_master WHERE type = 'table'").fetchall()
+    assert tables == []
+
+
+def test_load_key_table_batches(tmp_path):
+    conn = connect_standin(str(tmp_path / "k.sqlite"))
+    keys = [("5101", f"W{i:05d}") for i in range(23)]
+    cur = conn.cursor()
+    cur.execute(SQLITE.drop_key_table)
+    assert load_key_table(conn, SQLITE, keys, batch_size=5) == []
+    assert conn.execute(f"SELECT t, n FROM {SQLITE.key_table}").fetchall() == keys
+
+
+def test_setbased_error_is_reported(tmp_path):
+    def broken():
+        raise OSError("network down")
+    with pytest.raises(ErpFetchError, match="network down"):
+        fetch_bom_setbased(ErpConnection(broken), [("5101", "W00001")])
+
+
+def expected_inventory(wo_data, inventory, keys):
+    parts = {b['part'] for w in expected_bom(wo_data, keys).values() for b in w['bom']}
+    return {p: q for p, q in inventory.items() if p in parts}
+
+
+@pytest.mark.parametrize("strategy", ["in", "scan", "auto"])
+def test_pipelined_matches_loaded_data(erp_data, strategy):
+    db, wo_data, inventory, keys = erp_data
+    pool = ConnectionPool(standin_factory(db), size=3)
+    kinds = []
+    store, inv = fetch_pipelined(pool, keys, batch_size=40, part_batch=7, inv_strategy=strategy,
+                                 on_batch=lambda kind, *a: kinds.append(kind))
+    expected = expected_bom(wo_data, keys)
+    assert {k: store.to_wo_data()[k]['bom'] for k in store.keys} == {k: w['bom'] for k, w in expected.items()}
+    assert inv == expected_inventory(wo_data, inventory, keys)
+    assert kinds.count('bom') == 8
+    if strategy == "scan":
+        assert kinds.count('inv_scan') == 1 and 'inv' not in kinds
+    elif strategy == "in":
+        assert 'inv_scan' not in kinds and 'inv' in kinds
+
+
+@pytest.mark.parametrize("strategy", ["in", "scan", "auto"])
+def test_inventory_strategies_agree(erp_data, strategy):
+    db, _, inventory, _ = erp_data
+    parts = sorted(inventory)[::2] + ["NOT-IN-ERP"]
+    expected = {p: inventory[p] for p in parts if p in inventory}
+    assert fetch_inventory_streaming(ErpConnection(standin_factory(db)), parts, batch_size=9,
+                                     strategy=strategy) == expected
+    assert fetch_inventory_pooled(ConnectionPool(standin_factory(db), size=2), parts, part_batch=9,
+                                  strategy=strategy) == expected
+
+
+def test_inventory_warehouse_filters(erp_data):
+    db, _, inventory, _ = erp_data
+    conn = connect_standin(db)
+    conn.executemany("INSERT INTO INVMC (MC001, MC002, MC007) VALUES (?, '99', 5)", [(p,) for p in inventory])
+    conn.close()
+    parts = sorted(inventory)
+    pool = ConnectionPool(standin_factory(db), size=2)
+    for strategy in ("in", "scan"):
+        assert fetch_inventory_pooled(pool, parts, strategy=strategy) == {p: q + 5 for p, q in inventory.items()}
+        assert fetch_inventory_pooled(pool, parts, strategy=strategy, exclude=["99"]) == inventory
+        assert fetch_inventory_pooled(pool, parts, strategy=strategy, include=["99"]) == dict.fromkeys(parts, 5.0)
+
+
+def test_run_with_retry_recovers_and_discards(erp_data):
+    db = erp_data[0]
+    opened = []
+
+    def connect():
+        conn = connect_standin(db)
+        opened.append(conn)
+        return conn
+
+    pool = ConnectionPool(connect, size=1)
+    calls = []
+
+    def flaky(conn, dialect):
+        calls.append(conn)
+        if len(calls) < 3:
+            raise OSError("connection reset")
+        return conn.execute("SELECT COUNT(*) FROM MOCTA").fetchone()[0]
+
+    assert run_with_retry(pool, flaky, timeout=5, retries=2, backoff=0) == len(erp_data[1])
+    # 出错的连接被丢弃，每次重试都换新连接；成功后连接回到池中复用
+    assert len(opened) == 3 and calls == opened
+    assert run_with_retry(pool, lambda conn, dialect: conn, retries=0) is opened[-1]
+
+    def down(conn, dialect):
+        calls.append(conn)
+        raise OSError("still down")
+
+    calls.clear()
+    with pytest.raises(OSError, match="still down"):
+        run_with_retry(pool, down, retries=1, backoff=0)
+    assert len(calls) == 2
+    # 失败的连接都已归还名额，池仍可用
+    assert run_with_retry(pool, lambda conn, dialect: 1, retries=0) == 1
+
+
+def test_slow_connection_timeout(erp_data):
+    """查询超过单次超时：SlowConnection 抛出 TimeoutError，重试用尽后整次查询以 ErpFetchError 失败。"""
+    db, _, _, keys = erp_data
+    pool = ConnectionPool(standin_factory(db, latency=0.05), size=2)
+    with pytest.raises(ErpFetchError) as e:
+        fetch_pipelined(pool, keys[:10], timeout=0.01, retries=1, backoff=0, inv_strategy="in")
+    assert all(isinstance(err, TimeoutError) for _, err in e.value.errors)
+
+    # 超时足够时同一连接池正常完成
+    store, _ = fetch_pipelined(pool, keys[:10], timeout=5, retries=0, inv_strategy="in")
+    assert store.n_orders == len(expected_bom(erp_data[1], keys[:10]))
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""ERP 本地缓存 (替身库)：命中与重新打开、库存 TTL、版本戳比对后只拉取变化的工单、force、淘汰。"""
+import random
+import types
+
+import pytest
+
+import erp_cache
+from conftest import make_standin, random_erp
+from erp_access import ConnectionPool, fetch_bom_versions, fetch_inventory_pooled, fetch_pipelined
+from erp_cache import ErpCache
+from erp_standin import connect_standin, standin_factory
+
+T0 = 1_790_000_000.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = T0
+
+    def __call__(self):
+        return self.now
+
+
+class Erp:
+    """替身库上的三个查询函数，记录每次调用的参数。"""
+
+    def __init__(self, db):
+        self.db = db
+        self.pool = ConnectionPool(standin_factory(db), size=2)
+        self.calls = []
+
+    def bom(self, keys):
+        self.calls.append(('bom', set(keys)))
+        return fetch_pipelined(self.pool, keys)
+
+    def versions(self, keys):
+        self.calls.append(('versions', set(keys)))
+        return fetch_bom_versions(self.pool, keys)
+
+    def inventory(self, parts):
+        self.calls.append(('inventory', set(parts)))
+        return fetch_inventory_pooled(self.pool, parts)
+
+    def fetch(self, cache, keys, **kw):
+        self.calls = []
+        return cache.fetch(keys, self.bom, self.versions, self.inventory, **kw)
+
+    def direct(self, keys):
+        store, inv = fetch_pipelined(self.pool, keys)
+        return store.to_wo_data(), inv
+
+    def execute(self, sql, *args):
+        conn = connect_standin(self.db)
+        conn.execute(sql, args)
+        conn.close()
+
+    def kinds(self):
+        return [kind for kind, _ in self.calls]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    rnd = random.Random(5)
+    wo_data, inventory, keys = random_erp(rnd, 120, n_parts=40)
+    erp = Erp(make_standin(tmp_path / "erp.sqlite", wo_data, inventory))
+    clock = Clock()
+    monkeypatch.setattr(erp_cache, "time", types.SimpleNamespace(time=clock))
+    yield erp, clock, wo_data, keys, str(tmp_path / "cache.sqlite")
+    erp.pool.close()
+
+
+def same(result, expected):
+    store, inv = result
+    assert (store.to_wo_data(), inv) == expected
+
+
+def with_bom(wo_data):
+    return next(k for k, w in wo_data.items() if w['bom'] and w['bom'][0]['req'] > 0)
+
+
+def test_cold_warm_and_reopen(env):
+    erp, clock, _, keys, path = env
+    cache = ErpCache(path)
+    same(erp.fetch(cache, keys), erp.direct(keys))
+    assert erp.kinds() == ['versions', 'bom'] and erp.calls[1][1] == set(keys)
+
+    clock.now += 60
+    same(erp.fetch(cache, keys), erp.direct(keys))
+    assert erp.calls == []
+    cache.close()
+
+    # 重新打开同一文件：照常命中；库存口径改变时只清空库存缓存
+    cache = ErpCache(path)
+    same(erp.fetch(cache, keys[::2]), erp.direct(keys[::2]))
+    assert erp.calls == []
+    cache.close()
+    cache = ErpCache(path, inv_scope="(['01'], [])")
+    same(erp.fetch(cache, keys), erp.direct(keys))
+    assert erp.kinds() == ['inventory']
+    cache.close()
+
+
+def test_inventory_expires_after_ttl(env):
+    erp, clock, _, keys, path = env
+    cache = ErpCache(path, bom_ttl=3600, inv_ttl=600)
+    store, _ = erp.fetch(cache, keys)
+    part = store.parts.values[0]
+    erp.execute("UPDATE INVMC SET MC007 = 12345 WHERE MC001 = ?", part)
+
+    clock.now += 599
+    assert erp.fetch(cache, keys)[1].get(part) != 12345
+    assert erp.calls == []
+
+    clock.now += 2
+    store, inv = erp.fetch(cache, keys)
+    assert erp.calls == [('inventory', set(store.parts.values))]
+    assert inv[part] == 12345
+    same((store, inv), erp.direct(keys))
+    cache.close()
+
+
+def test_stale_orders_refetch_only_changed(env):
+    erp, clock, wo_data, keys, path = env
+    cache = ErpCache(path, bom_ttl=3600, inv_ttl=600)
+    erp.fetch(cache, keys)
+    changed = with_bom(wo_data)
+    erp.execute("UPDATE MOCTB SET TB005 = TB005 + 1 WHERE TB001 = ? AND TB002 = ?", *changed)
+
+    clock.now += 3601
+    result = erp.fetch(cache, keys)
+    assert erp.kinds()[:2] == ['versions', 'bom']
+    assert erp.calls[0][1] == set(keys)
+    # 变化的工单，以及 ERP 中不存在 (没有版本戳) 的工单重新拉取；其余只刷新时间戳
+    assert erp.calls[1][1] == {changed} | {k for k in keys if k not in wo_data}
+    same(result, erp.direct(keys))
+
+    clock.now += 60
+    erp.fetch(cache, keys)
+    assert erp.calls == []
+    cache.close()
+
+
+def test_version_query_failure_refetches_all_stale(env):
+    erp, clock, _, keys, path = env
+    cache = ErpCache(path, bom_ttl=3600)
+    erp.fetch(cache, keys)
+    clock.now += 3601
+
+    def broken(keys):
+        raise RuntimeError("no MODI_DATE")
+    logs = []
+    erp.calls = []
+    result = cache.fetch(keys, erp.bom, broken, erp.inventory, log=logs.append)
+    assert erp.calls[0] == ('bom', set(keys))
+    assert any("版本查询失败" in m for m in logs)
+    same(result, erp.direct(keys))
+    cache.close()
+
+
+def test_force_ignores_cache(env):
+    erp, clock, wo_data, keys, path = env
+    cache = ErpCache(path)
+    store, _ = erp.fetch(cache, keys)
+    changed = with_bom(wo_data)
+    part = store.parts.values[0]
+    erp.execute("UPDATE MOCTB SET TB005 = TB005 + 1 WHERE TB001 = ? AND TB002 = ?", *changed)
+    erp.execute("UPDATE INVMC SET MC007 = 777 WHERE MC001 = ?", part)
+
+    clock.now += 1
+    result = erp.fetch(cache, keys, force=True)
+    assert erp.kinds() == ['versions', 'bom'] and erp.calls[1][1] == set(keys)
+    assert result[1][part] == 777
+    same(result, erp.direct(keys))
+    # 强制刷新的结果随即写入缓存
+    same(erp.fetch(cache, keys), erp.direct(keys))
+    assert erp.calls == []
+    cache.close()
+
+
+def rows(cache):
+    return {(t, n): at for t, n, at in cache.db.execute("SELECT t, n, fetched_at FROM wo_header")}
+
+
+def test_eviction_by_age_and_size(env):
+    erp, clock, _, keys, path = env
+    old, new = keys[:60], keys[60:]
+    cache = ErpCache(path, keep_days=1)
+    erp.fetch(cache, old)
+    clock.now += 86400 + 1
+    erp.fetch(cache, new)
+    assert set(rows(cache)) == set(new)
+    assert cache.db.execute("SELECT MIN(fetched_at) FROM inventory").fetchone()[0] == clock.now
+
+    # 超过大小上限：从最旧的开始淘汰
+    erp.fetch(cache, old)
+    clock.now += 10
+    erp.fetch(cache, new[:10], force=True)
+    before = rows(cache)
+    cache.max_bytes = cache._size() - 4096      # 少一页
+    cache.evict(clock.now)
+    after = rows(cache)
+    assert cache._size() <= cache.max_bytes
+    assert after and len(after) < len(before)
+    assert min(after.values()) >= max(at for k, at in before.items() if k not in after)
+
+    # 淘汰掉的工单再次请求时重新拉取
+    erp.fetch(cache, keys)
+    assert erp.calls[1] == ('bom', set(keys) - set(after))
+    same(erp.fetch(cache, keys), erp.direct(keys))
+    cache.close()
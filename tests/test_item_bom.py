@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""多阶展开：品号 BOM 的用量折算、低阶码、循环检查，替身库逐阶查询，以及展开后的推演结果。"""
+import datetime
+
+import pytest
+
+from conftest import make_standin
+from erp_access import ConnectionPool, fetch_item_bom
+from erp_standin import connect_standin, load_item_bom, standin_factory
+from kitting_engine import BomStore, ItemBom, order_components, shortage_timeline, simulate_kitting_vectorized
+
+# 成品件 M = 2 个半成品 S + 0.5 KG 原料 C (底数 2)；S = 3 KG C，损耗 10%
+ROWS = [("M", "S", 2, 1, 0, "半成品", "PCS"), ("S", "C", 3, 1, 0.1, "原料", "KG"), ("M", "C", 1, 2, 0, "原料", "KG")]
+
+
+def test_usage_is_normalized_and_merged():
+    bom = ItemBom(ROWS + [("M", "S", 1, 1, 0, "半成品", "PCS"), ("M", "Z", 0, 1, 0, "", "")])
+    assert dict(bom.children["M"]) == {"S": 3.0, "C": 0.5}     # 重复子件合并，用量为 0 的去掉
+    assert dict(bom.children["S"]) == pytest.approx({"C": 3.3})
+    assert bom.labels["C"] == ("原料", "KG")
+
+
+def test_low_level_codes_take_deepest_path():
+    # A -> B -> D 与 A -> D：D 的低阶码取最深的 2；E 只出现在第 1 阶
+    bom = ItemBom([("A", "B", 1, 1, 0, "", ""), ("B", "D", 1, 1, 0, "", ""), ("A", "D", 1, 1, 0, "", ""),
+                   ("A", "E", 1, 1, 0, "", "")])
+    assert bom.levels == {"B": 1, "D": 2, "E": 1}
+    assert bom.cycles == []
+    assert ItemBom(ROWS).levels == {"S": 1, "C": 2}
+
+
+def test_cycles_are_reported_and_cut():
+    bom = ItemBom([("X", "Y", 1, 1, 0, "", ""), ("Y", "Z", 1, 1, 0, "", ""), ("Z", "X", 1, 1, 0, "", ""),
+                   ("Q", "Q", 1, 1, 0, "", "")])
+    assert sorted(bom.cycles) == [("Q", "Q"), ("X", "Y", "Z", "X")]
+    assert bom.children["Z"] == [] and bom.children["Q"] == []
+    assert bom.levels == {"Y": 1, "Z": 2}
+
+
+def test_merged_recomputes_levels():
+    a = ItemBom([("A", "B", 1, 1, 0, "", "")])
+    b = ItemBom([("B", "C", 1, 1, 0, "", "")])
+    m = a.merged(b)
+    assert m.levels == {"B": 1, "C": 2}
+    assert a.merged(None) is a
+
+
+def test_fetch_item_bom_from_standin(tmp_path):
+    db = make_standin(tmp_path / "erp.sqlite", {}, {})
+    conn = connect_standin(db)
+    load_item_bom(conn, [("M", "S", 2), ("S", "C", 3, 1, 0.1), ("M", "C", 1, 2), ("X", "Y", 1), ("Y", "X", 1)],
+                  names={"S": ("半成品", "PCS"), "C": ("原料", "KG")})
+    load_item_bom(conn, [("P", "Q", 1)], attr="P")      # 采购件的 BOM 不展开
+    conn.close()
+    batches = []
+    rows = fetch_item_bom(ConnectionPool(standin_factory(db), size=2), ["M", "X", "P", None], part_batch=1,
+                          on_batch=lambda *a: batches.append(a))
+    assert sorted(r[:2] for r in rows) == [("M", "C"), ("M", "S"), ("S", "C"), ("X", "Y"), ("Y", "X")]
+    assert ("S", "C", 3.0, 1.0, 0.1, "原料", "KG") in rows
+    # 每批 1 个品号，每个品号只查一次：第 1 阶 M/X/P，第 2 阶 S/C/Y，之后没有新品号
+    assert len(batches) == 6
+    assert ItemBom(rows).cycles == [("X", "Y", "X")]
+
+
+@pytest.mark.parametrize("stock, rate, short", [
+    ({"M": 0, "S": 0, "C": 100}, 1.0, {}),
+    ({"M": 0, "S": 0, "C": 10}, None, {"M": 10.0, "S": 20.0, "C": 61.0}),
+    ({"M": 4, "S": 0, "C": 0}, 0.4, {"M": 6.0, "S": 12.0, "C": 42.6}),
+])
+def test_exploded_simulation(stock, rate, short):
+    wo_data = {("5101", "A"): {'status': "N", 'total': 10.0,
+                               'bom': [{'part': "M", 'name': "成品件", 'unit': "PCS", 'req': 10.0, 'iss': 0.0}]}}
+    wo_list = [{'row_idx': 4, 'wo_key': ("5101", "A"), 'plan_qty': 10.0, 'start_date': datetime.date(2026, 10, 5)}]
+    store = BomStore.from_wo_data(wo_data)
+    assert store.attach_item_bom(ItemBom(ROWS)) == ["S", "C"]
+    r, = simulate_kitting_vectorized(wo_list, store, dict(stock))
+    if rate is not None:
+        assert r['rate'] == pytest.approx(rate)
+    assert (r['msg'] == "仓库齐套") == (not short)
+    if short:
+        assert "下阶缺料 C,原料" in r['msg']
+    timeline = shortage_timeline(wo_list, store, store.inventory_vector(stock))
+    assert {t['part']: t['shortfall'] for t in timeline} == pytest.approx(short)
+    # 展开出的下阶品号与工单用料在同一分量
+    assert order_components(wo_list, store).tolist() == [0]
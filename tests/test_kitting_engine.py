@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""数组版推演引擎与原逐单引擎 (_simulate_logic_v3) 的一致性，分量并行推演与串行推演的一致性。"""
+import copy
+import random
+
+import pytest
+
+from conftest import START, random_erp, random_plan
+from kitting_engine import (BomStore, BomStoreBuilder, IncrementalSimulator, ItemBom, format_result, order_components,
+                            shortage_timeline, simulate_kitting_vectorized, simulate_partitioned, simulate_time_phased)
+
+main = pytest.importorskip("main")
+
+
+def reference(wo_list, wo_data, inventory):
+    """原引擎 (不依赖界面对象)，返回 (结果, 期末库存)。"""
+    inv = dict(inventory)
+    return main.DailyPlanAvailabilityApp._simulate_logic_v3(None, wo_list, wo_data, inv), inv
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_vectorized_matches_reference(seed):
+    rnd = random.Random(seed)
+    wo_data, inventory, keys = random_erp(rnd, rnd.randint(1, 40), missing_rate=rnd.choice([0.0, 0.1, 0.5, 1.0]))
+    wo_list = random_plan(rnd, keys, rnd.randint(1, 80))
+    expected, expected_inv = reference(wo_list, wo_data, inventory)
+
+    inv = dict(inventory)
+    assert simulate_kitting_vectorized(wo_list, copy.deepcopy(wo_data), inv) == expected
+    assert inv == expected_inv
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_matches_reference(seed):
+    rnd = random.Random(seed)
+    wo_data, inventory, keys = random_erp(rnd, rnd.randint(1, 40))
+    wo_list = random_plan(rnd, keys, rnd.randint(1, 80))
+    sim = IncrementalSimulator(BomStore.from_wo_data(wo_data), inventory, checkpoint_every=7)
+    results, _ = sim.run(wo_list)
+    assert results == reference(wo_list, wo_data, inventory)[0]
+
+    # 修改部分计划数量、删去一行后再次推演 (从快照恢复)
+    edited = [dict(item) for item in wo_list]
+    for item in rnd.sample(edited, max(1, len(edited) // 4)):
+        item['plan_qty'] = float(rnd.choice([0, 5, 80]))
+    edited.pop(rnd.randrange(len(edited)))
+    results, changed = sim.run(edited)
+    expected = reference(edited, wo_data, inventory)[0]
+    assert results == expected
+    assert set(changed) <= {r['row_idx'] for r in expected}
+
+
+def test_empty_erp_reports_missing_info():
+    """计划中的工单在 ERP 中都不存在 (BomStore 为空) 时，每行都是无ERP信息，而不是中途报错。"""
+    rnd = random.Random(7)
+    _, inventory, keys = random_erp(rnd, 5)
+    wo_list = random_plan(rnd, keys, 12)
+    store = BomStoreBuilder().build()
+    assert store.n_orders == 0
+    expected, _ = reference(wo_list, {}, inventory)
+    assert all(r['msg'] == "无ERP信息" and r['daily_status'] == "异常" for r in expected)
+
+    assert simulate_kitting_vectorized(wo_list, store, dict(inventory)) == expected
+    assert simulate_kitting_vectorized(wo_list, {}, dict(inventory)) == expected
+    assert IncrementalSimulator(store, inventory).run(wo_list)[0] == expected
+    assert shortage_timeline(wo_list, store, store.inventory_vector(inventory)) == []
+    assert order_components(wo_list, store).tolist() == [-1] * len(wo_list)
+
+    dates = sorted({item['start_date'] for item in wo_list})
+    daily = [dict(item, daily=[item['plan_qty'] if d == item['start_date'] else 0.0 for d in dates])
+             for item in wo_list]
+    for r in simulate_time_phased(daily, dates, store, inventory):
+        assert r['msg'] == "无ERP信息"
+        assert r['kit_days'] == 0
+
+
+@pytest.fixture(scope="module")
+def pool():
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(3) as ex:
+        yield ex
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_partitioned_matches_serial(seed, pool):
+    rnd = random.Random(seed)
+    # 品号多、每单用料少，才会分成多个互不相关的分量
+    wo_data, inventory, keys = random_erp(rnd, rnd.randint(1, 40), n_parts=rnd.choice([12, 60, 200]))
+    wo_list = random_plan(rnd, keys, rnd.randint(1, 80))
+    store = BomStore.from_wo_data(wo_data)
+
+    serial_inv = dict(inventory)
+    expected = simulate_kitting_vectorized(wo_list, store, serial_inv)
+    inv = dict(inventory)
+    results = simulate_partitioned(wo_list, store, inv, pool, n_bins=rnd.choice([2, 3, 5]), min_lines=0)
+    assert [format_result(r) for r in results] == [format_result(r) for r in expected]
+    assert results == expected
+    assert inv == serial_inv
+
+
+def test_order_components_multiple():
+    def order(parts, status="N"):
+        return {'status': status, 'total': 10.0,
+                'bom': [{'part': p, 'name': p, 'unit': "PCS", 'req': 10.0, 'iss': 0.0} for p in parts]}
+    wo_data = {("5101", "A"): order(["P1", "P2"]), ("5101", "B"): order(["P3", "P2"]),
+               ("5101", "C"): order(["P4"]), ("5101", "D"): order(["P5", "P4"]),
+               ("5101", "E"): order(["P1"], status="Y"), ("5101", "G"): order([]), ("5101", "H"): order(["P6"])}
+    names = "ABCDEFGHA"
+    wo_list = [{'row_idx': i + 4, 'wo_key': ("5101", k), 'plan_qty': 10.0, 'start_date': START}
+               for i, k in enumerate(names)]
+    store = BomStore.from_wo_data(wo_data)
+    comp = dict(zip(range(len(names)), order_components(wo_list, store).tolist()))
+    # A、B 共用 P2；C、D 共用 P4；H 单独；已完工 (E)、ERP 中没有 (F)、BOM 为空 (G) 的为 -1
+    assert comp[0] == comp[1] == comp[8] and comp[2] == comp[3]
+    assert len({comp[0], comp[2], comp[7]}) == 3 and sorted({comp[0], comp[2], comp[7]}) == [0, 1, 2]
+    assert comp[4] == comp[5] == comp[6] == -1
+
+    # P3 由 P4 制成：展开后 A、B 与 C、D 连成一个分量
+    assert store.attach_item_bom(ItemBom([("P3", "P4", 1, 1, 0, "", "")])) == []      # P4 已是工单用料
+    comp = order_components(wo_list, store).tolist()
+    assert comp[0] == comp[2] != comp[7]
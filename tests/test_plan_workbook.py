@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""排程工作簿扫描：与原逐格读取 (_extract_data_with_details) 的一致性，以及按修改时间/大小的缓存。"""
+import datetime
+import os
+import random
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+import plan_workbook
+from conftest import START
+from plan_workbook import ALL_WORKSHOPS, forget_plan, load_plan, parse_excel_date, restamp_plan, sheet_names
+
+SHEET = "排程"
+WORKSHOPS = ["一车间", "二车间", " 三车间 ", None]
+
+
+def reference(path, sheet, start, end, filter_ws):
+    """原界面的做法：表头按 data_only 读取，数据行用普通方式打开后逐格判断。"""
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    ws = wb[sheet]
+    col_map = {}
+    for r in (3, 2):
+        for idx, cell in enumerate(ws[r], start=1):
+            val = str(cell.value).strip() if cell.value else ""
+            if val and val not in col_map:
+                col_map[val] = idx
+    date_column_map = {}
+    for idx, cell in enumerate(ws[3], start=1):
+        dt = parse_excel_date(cell.value)
+        if dt: date_column_map[dt] = idx
+    wb.close()
+
+    target = {}
+    curr = start
+    while curr <= end:
+        if curr in date_column_map:
+            target[date_column_map[curr]] = curr
+        curr += datetime.timedelta(days=1)
+    c_ws, c_type, c_no = col_map.get("车间"), col_map.get("单别") or 5, col_map.get("工单单号") or 6
+
+    wb = openpyxl.load_workbook(path)
+    data = []
+    for row in wb[sheet].iter_rows(min_row=4):
+        first, total = None, 0
+        for c in sorted(target):
+            if c <= len(row):
+                val = row[c - 1].value
+                if isinstance(val, (int, float)) and val > 0:
+                    total += val
+                    first = first or target[c]
+        if total > 0:
+            val_ws = row[c_ws - 1].value if (c_ws and c_ws <= len(row)) else None
+            ws_name = str(val_ws).strip() if val_ws else "未分类"
+            if filter_ws != ALL_WORKSHOPS and ws_name != filter_ws: continue
+            wt, wn = row[c_type - 1].value, row[c_no - 1].value
+            if wt and wn:
+                data.append({'wo_key': (str(wt).strip(), str(wn).strip()), 'start_date': first,
+                             'plan_qty': int(round(total)), 'row_idx': row[0].row, 'workshop': ws_name})
+    wb.close()
+    return data
+
+
+def make_workbook(path, rnd, n_rows=40, n_days=8):
+    """A 列为结果，B 车间、C 单别、D 工单单号 (表头在第 3 行)，E 起为日期列；另有一张干扰工作表。"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    ws.cell(2, 2, "说明")
+    for c, name in enumerate(["结果", "车间", "单别", "工单单号"], start=1):
+        ws.cell(3, c, name)
+    for j in range(n_days):
+        d = START + datetime.timedelta(days=j)
+        # 日期列混用 datetime、"YYYY/MM/DD" 文本与 Excel 序号
+        ws.cell(3, 5 + j, [datetime.datetime.combine(d, datetime.time()), d.strftime("%Y/%m/%d"),
+                           (d - datetime.date(1899, 12, 30)).days][j % 3])
+    ws.cell(3, 5 + n_days, "备注")
+    for r in range(4, 4 + n_rows):
+        ws.cell(r, 2, rnd.choice(WORKSHOPS))
+        if rnd.random() < 0.9:
+            ws.cell(r, 3, rnd.choice(["5101", " 5102"]))
+        ws.cell(r, 4, f"W{rnd.randrange(15):04d}" if rnd.random() < 0.95 else None)
+        for j in range(n_days):
+            if rnd.random() < 0.4:
+                ws.cell(r, 5 + j, rnd.choice([10, 25.5, 0, -5, "30", f"=E{r}*2", 0.4]))
+    other = wb.create_sheet("其他")           # 无表头：单别 / 工单单号取默认的 E / F 列
+    other.cell(3, 7, START)
+    other.cell(4, 5, "5101")
+    other.cell(4, 6, "X")
+    other.cell(4, 7, 99)
+    wb.save(path)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    plan_workbook._plan_cache.clear()
+    plan_workbook._sheet_cache.clear()
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_extract_matches_cell_by_cell(tmp_path, seed):
+    rnd = random.Random(seed)
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, rnd)
+    model = load_plan(path, SHEET)
+    assert model.workshops == ["一车间", "三车间", "二车间"]
+    for _ in range(8):
+        start = START + datetime.timedelta(days=rnd.randrange(-2, 8))
+        end = start + datetime.timedelta(days=rnd.randrange(0, 6))
+        ws = rnd.choice(["一车间", "三车间", "未分类", ALL_WORKSHOPS])
+        rows = model.extract(start, end, ws)
+        assert rows == reference(path, SHEET, start, end, ws)
+        daily = model.extract(start, end, ws, daily=True)
+        assert [{k: v for k, v in r.items() if k != 'daily'} for r in daily] == rows
+        for r in daily:
+            assert len(r['daily']) == len(model.target_dates(start, end))
+
+
+def cache_formula_values(path, values):
+    """openpyxl 不保存公式的计算结果；按 Excel 保存时的样子给公式格补上缓存值 {单元格: 值}。"""
+    with zipfile.ZipFile(path) as z:
+        parts = {name: z.read(name) for name in z.namelist()}
+    name = "xl/worksheets/sheet1.xml"
+    xml = parts[name].decode("utf-8")
+    for ref, v in values.items():
+        xml = re.sub(rf'(<c r="{ref}"[^>]*>)<f>([^<]*)</f><v ?/>', rf"\1<f>\2</f><v>{v}</v>", xml)
+        assert f"<v>{v}</v>" in xml
+    parts[name] = xml.encode("utf-8")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for n, data in parts.items():
+            z.writestr(n, data)
+
+
+def test_formula_cells(tmp_path):
+    """数量格的公式与原逐格读取一样记 0 (即使有缓存的计算结果)；日期行的公式按计算结果识别。"""
+    path = str(tmp_path / "plan.xlsx")
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    for c, name in enumerate(["结果", "车间", "单别", "工单单号"], start=1):
+        ws.cell(3, c, name)
+    ws.cell(3, 5, START)
+    ws.cell(3, 6, "=E3+1")
+    ws.append([None, "一车间", "5101", "W1", "=2*5", 3])
+    ws.append([None, "一车间", "5101", "W2", 7])
+    wb.save(path)
+    serial = (START - datetime.date(1899, 12, 30)).days + 1
+    cache_formula_values(path, {"F3": serial, "E4": 10})
+
+    model = load_plan(path, SHEET)
+    assert model.target_dates(START, START + datetime.timedelta(days=1)) == [
+        START, START + datetime.timedelta(days=1)]
+    assert [(r['wo_key'][1], r['plan_qty']) for r in model.extract(START, START, ALL_WORKSHOPS)] == [("W2", 7)]
+    end = START + datetime.timedelta(days=1)
+    assert model.extract(START, end, ALL_WORKSHOPS) == reference(path, SHEET, START, end, ALL_WORKSHOPS)
+    assert [(r['wo_key'][1], r['plan_qty']) for r in model.extract(START, end, ALL_WORKSHOPS)] == [
+        ("W1", 3), ("W2", 7)]
+
+
+def test_sheets_are_scanned_separately(tmp_path):
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, random.Random(1))
+    assert sheet_names(path) == [SHEET, "其他"]
+    other = load_plan(path, "其他")
+    assert other.extract(START, START, ALL_WORKSHOPS) == [
+        {'wo_key': ("5101", "X"), 'start_date': START, 'plan_qty': 99, 'row_idx': 4, 'workshop': "未分类"}]
+    assert load_plan(path, SHEET) is not other
+
+
+def bump(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def test_cache_follows_file_stamp(tmp_path):
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, random.Random(2))
+    model = load_plan(path, SHEET)
+    assert load_plan(path, SHEET) is model
+    names = sheet_names(path)
+
+    # 文件被改动 (修改时间变化) 后重新扫描
+    wb = openpyxl.load_workbook(path)
+    wb[SHEET].cell(4, 5, 500)
+    wb[SHEET].cell(4, 4, "W9999")
+    wb.save(path)
+    bump(path)
+    changed = load_plan(path, SHEET)
+    assert changed is not model
+    assert changed.row_idx[0] == 4 and changed.wo_key[0][1] == "W9999"
+    assert sheet_names(path) == names
+
+    # forget_plan 丢弃该文件的全部缓存
+    forget_plan(path)
+    assert not plan_workbook._sheet_cache and not plan_workbook._plan_cache
+    assert load_plan(path, SHEET) is not changed
+
+
+def test_restamp_after_writing_column_a(tmp_path):
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, random.Random(3))
+    model = load_plan(path, SHEET)
+    sheet_names(path)
+
+    wb = openpyxl.load_workbook(path)
+    wb[SHEET].cell(4, 1, "齐套率：100%")
+    wb.save(path)
+    bump(path)
+    restamp_plan(path, SHEET)                   # 只改了 A 列：沿用原模型
+    assert load_plan(path, SHEET) is model
+    assert plan_workbook._sheet_cache[os.path.abspath(path)][0] == plan_workbook._file_stamp(path)
+
+    bump(path)
+    restamp_plan(path, SHEET, touched_cols=(1, 4))     # 动到工单单号列：丢弃缓存
+    assert load_plan(path, SHEET) is not model
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""运行报告：每个阶段默认记录进程内存，tracemalloc 只在开启时记录。"""
+import json
+
+from run_report import RunReport, process_memory
+
+
+def test_process_memory_is_sampled_by_default(tmp_path):
+    rss, peak = process_memory()
+    assert peak and peak >= (rss or 0) * 0.99
+
+    report = RunReport(n_orders=3)
+    report.start()
+    report.begin("解析")
+    block = bytearray(64 * 1048576)
+    block[::4096] = b"\1" * len(block[::4096])
+    report.begin("推演")
+    del block
+    report.sql_batch('bom', 0, 0.01, 10)
+    report.stop()
+
+    first, second = report.stages
+    assert first['peak_rss_mb'] >= 64 and first['peak_mb'] is None
+    assert second['peak_rss_mb'] >= first['peak_rss_mb'] - 0.1
+    assert second['rss_mb'] < first['rss_mb']
+    lines = report.summary_lines()
+    assert "进程峰值" in lines[0] and "内存" in lines[1]
+    path = report.write(str(tmp_path / "r.json"))[0]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)['stages'][0]['rss_mb'] == first['rss_mb']
+
+
+def test_tracemalloc_is_opt_in():
+    report = RunReport(trace_memory=True)
+    report.start()
+    report.begin("a")
+    data = [str(i) for i in range(100000)]
+    report.stop()
+    assert report.stages[0]['peak_mb'] > 1 and data
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""逐日推演：到货事件的计入日期、同日先到货后领用，以及与逐事件模拟的一致性。"""
+import datetime
+import random
+
+import numpy as np
+import pytest
+
+from conftest import START, make_standin, random_erp
+from erp_access import ConnectionPool, fetch_supply
+from erp_standin import connect_standin, load_supply, standin_factory
+from kitting_engine import DAILY_KIT, DAILY_SHORT, BomStore, simulate_time_phased
+
+D = [START + datetime.timedelta(days=i) for i in range(4)]
+
+
+def naive(wo_list, dates, wo_data, inventory, supply):
+    """逐日、逐行、逐 BOM 行依次扣减 (同日先到货)，返回每行的 [(日期, 状态)]。"""
+    stock = dict(inventory)
+    left = {}
+    arrivals = {}
+    for part, d, q, _ in supply:
+        if d is None or not q > 0: continue
+        j = next((j for j, x in enumerate(dates) if x >= d), None)
+        if j is not None:
+            arrivals.setdefault(j, []).append((part, q))
+    out = [[] for _ in wo_list]
+    for j, day in enumerate(dates):
+        for part, q in arrivals.get(j, ()):
+            stock[part] = stock.get(part, 0.0) + q
+        for i, item in enumerate(wo_list):
+            qty = max(item['daily'][j], 0.0)
+            if not qty: continue
+            info = wo_data.get(item['wo_key'])
+            if not info or not info['bom'] or info['status'] == "Y" or \
+                    all(b['req'] - b['iss'] <= 0 for b in info['bom']):
+                continue
+            short = False
+            for n, b in enumerate(info['bom']):
+                use = b['req'] / info['total'] if info['total'] > 0 else 0.0
+                rem = left.setdefault((item['wo_key'], n), max(0.0, b['req'] - b['iss']))
+                if use <= 0 or rem <= 0: continue
+                draw = min(rem, qty * use)
+                before = stock.get(b['part'], 0.0)
+                short |= draw > 0 and max(before, 0.0) < draw - 0.0001
+                stock[b['part']] = before - draw
+                left[(item['wo_key'], n)] = rem - draw
+            out[i].append((day, DAILY_SHORT if short else DAILY_KIT))
+    return out
+
+
+def plan(rows):
+    """rows: [(工单键, [逐日计划数])]。"""
+    return [{'row_idx': i + 4, 'wo_key': key, 'plan_qty': float(sum(daily)), 'start_date': D[0],
+             'daily': np.array(daily, dtype=np.float64)} for i, (key, daily) in enumerate(rows)]
+
+
+def one_order(stock, supply, daily=(10, 10, 10, 10), dates=D):
+    wo_data = {("5101", "A"): {'status': "N", 'total': 100.0,
+                               'bom': [{'part': "P1", 'name': "料", 'unit': "PCS", 'req': 100.0, 'iss': 0.0}]}}
+    res = simulate_time_phased(plan([(("5101", "A"), list(daily))]), dates, BomStore.from_wo_data(wo_data),
+                               {"P1": stock}, supply)
+    return res[0]
+
+
+def test_arrival_covers_later_day():
+    r = one_order(15, [("P1", D[2], 20.0, 'po')])
+    assert [s for _, _, s in r['daily']] == [DAILY_KIT, DAILY_SHORT, DAILY_KIT, DAILY_SHORT]
+    assert r['kit_days'] == 2 and r['plan_days'] == 4
+    assert r['first_short'] == D[1]
+    assert r['msg'] == "P1,料,缺5PCS"
+
+
+def test_arrival_same_day_is_before_issue():
+    assert one_order(10, [("P1", D[1], 10.0, 'mo')])['kit_days'] == 2
+
+
+def test_arrival_dates_outside_and_between_plan_days():
+    # 逾期未到的计在首日，晚于末日的不计
+    assert one_order(0, [("P1", D[0] - datetime.timedelta(days=3), 40.0, 'po')])['kit_days'] == 4
+    assert one_order(0, [("P1", D[-1] + datetime.timedelta(days=1), 40.0, 'po')])['kit_days'] == 0
+    # 两个排产日之间到货 (非连续日期) 计在下一个排产日
+    dates = [D[0], D[2]]
+    r = one_order(10, [("P1", D[1], 10.0, 'po')], daily=(10, 10), dates=dates)
+    assert [s for _, _, s in r['daily']] == [DAILY_KIT, DAILY_KIT]
+    # 无日期、非正数量、不相关品号的供应忽略
+    assert one_order(10, [("P1", None, 50.0, 'po'), ("P1", D[1], 0.0, 'po'), ("P9", D[1], 50.0, 'po')])[
+        'kit_days'] == 1
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_matches_event_by_event(seed):
+    rnd = random.Random(seed)
+    wo_data, inventory, keys = random_erp(rnd, rnd.randint(1, 25))
+    dates = sorted(rnd.sample([START + datetime.timedelta(days=i) for i in range(10)], rnd.randint(1, 6)))
+    rows = [(rnd.choice(keys), [float(rnd.choice([0, 0, 10, 30, -5])) for _ in dates])
+            for _ in range(rnd.randint(1, 40))]
+    parts = sorted({b['part'] for w in wo_data.values() for b in w['bom']}) or ["P000"]
+    supply = [(rnd.choice(parts), START + datetime.timedelta(days=rnd.randint(-2, 11)),
+               float(rnd.choice([20, 100, 500])), rnd.choice(['po', 'mo'])) for _ in range(rnd.randint(0, 15))]
+    wo_list = plan(rows)
+    results = simulate_time_phased(wo_list, dates, BomStore.from_wo_data(wo_data), inventory, supply)
+    for r, expected, item in zip(results, naive(wo_list, dates, wo_data, inventory, supply), wo_list):
+        info = wo_data.get(item['wo_key'])
+        if info and info['bom'] and r['msg'] not in ("工单已完工", "发料齐套"):
+            assert [(d, s) for d, _, s in r['daily']] == expected
+        first = next((d for d, s in expected if s == DAILY_SHORT), None)
+        assert r['first_short'] == first
+
+
+def test_fetch_supply_from_standin(tmp_path):
+    db = make_standin(tmp_path / "erp.sqlite", {}, {})
+    conn = connect_standin(db)
+    load_supply(conn, purchases=[("P1", D[1], 100, 30), ("P2", "20261020", 50, 0), ("P1", D[2], 10, 10)],
+                productions=[("5101", "M1", "P2", D[3], 80, 20)])
+    # 已结束 / 未确认的采购单身不计
+    conn.execute("UPDATE PURTD SET TD016 = 'Y' WHERE TD004 = 'P2'")
+    conn.execute("INSERT INTO PURTD (TD001, TD002, TD003, TD004, TD012, TD008, TD015, TD018) "
+                 "VALUES ('3301', 'X', '0001', 'P1', '20261006', 70, 0, 'N')")
+    conn.close()
+    supply = fetch_supply(ConnectionPool(standin_factory(db), size=2), ["P1", "P2", "P3"], part_batch=2)
+    assert sorted(supply) == [("P1", D[1], 70.0, 'po'), ("P2", D[3], 60.0, 'mo')]
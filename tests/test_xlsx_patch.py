@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""A 列回写：直接改写工作表 XML，以及共享公式主单元格被替换时改为整本改写。"""
+import re
+import zipfile
+
+import openpyxl
+import pytest
+
+from xlsx_patch import SharedFormulaError, _patch_sheet, write_column_a
+
+SHEET = "排程"
+
+
+def make_workbook(path, a_cells):
+    """B4:B9 为 1..6；A 列各行按 a_cells {行号: 单元格 XML} 直接写入工作表 XML (openpyxl 不会写共享公式)。"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = SHEET
+    for r in range(4, 10):
+        ws.cell(row=r, column=1, value="old")
+        ws.cell(row=r, column=2, value=r - 3)
+    wb.save(path)
+    with zipfile.ZipFile(path) as zf:
+        members = {i.filename: zf.read(i.filename) for i in zf.infolist()}
+    xml = members["xl/worksheets/sheet1.xml"].decode("utf-8")
+    for r, cell in a_cells.items():
+        xml, n = re.subn(r'<c r="A%d"[^>]*?(?:/>|>.*?</c>)' % r, cell, xml, count=1, flags=re.S)
+        assert n == 1
+    members["xl/worksheets/sheet1.xml"] = xml.encode("utf-8")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+
+
+def shared(ref=None):
+    """A 列共享公式 =B{r}*2 (si=0)；ref 不为空时为主单元格。"""
+    def cell(r):
+        if ref:
+            return f'<c r="A{r}"><f t="shared" ref="{ref}" si="0">B{r}*2</f><v>{(r - 3) * 2}</v></c>'
+        return f'<c r="A{r}"><f t="shared" si="0"/><v>{(r - 3) * 2}</v></c>'
+    return cell
+
+
+def column_a(path):
+    ws = openpyxl.load_workbook(path)[SHEET]
+    return {r: ws.cell(row=r, column=1).value for r in range(4, 10)}
+
+
+def sheet_xml(path):
+    with zipfile.ZipFile(path) as zf:
+        return zf.read("xl/worksheets/sheet1.xml").decode("utf-8")
+
+
+def test_patch_keeps_other_cells_and_sets_font(tmp_path):
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, {})
+    assert write_column_a(path, SHEET, {4: "齐套率：100%", 6: "a < b & c", 12: "新行"}) == 3
+    ws = openpyxl.load_workbook(path)[SHEET]
+    assert [ws.cell(row=r, column=1).value for r in (4, 5, 6, 12)] == ["齐套率：100%", "old", "a < b & c", "新行"]
+    assert ws["B6"].value == 3
+    assert (ws["A4"].font.name, ws["A4"].font.sz) == ("微软雅黑", 9)
+    assert 't="inlineStr"' in sheet_xml(path)
+
+
+def test_shared_master_with_live_dependents_falls_back(tmp_path):
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, {4: shared("A4:A9")(4), **{r: shared()(r) for r in range(5, 10)}})
+    write_column_a(path, SHEET, {4: "结果4", 6: "结果6"})
+    assert column_a(path) == {4: "结果4", 5: "=B5*2", 6: "结果6", 7: "=B7*2", 8: "=B8*2", 9: "=B9*2"}
+    ws = openpyxl.load_workbook(path)[SHEET]
+    assert (ws["A6"].font.name, ws["A6"].font.sz) == ("微软雅黑", 9)
+
+
+def test_shared_formula_fully_replaced_stays_on_fast_path(tmp_path):
+    # 主单元格与全部从属单元格都被替换，或只替换从属单元格：不需要整本改写
+    path = str(tmp_path / "plan.xlsx")
+    make_workbook(path, {4: shared("A4:A6")(4), 5: shared()(5), 6: shared()(6),
+                         7: shared("A7:A9")(7).replace('si="0"', 'si="1"'),
+                         8: shared()(8).replace('si="0"', 'si="1"'), 9: shared()(9).replace('si="0"', 'si="1"')})
+    write_column_a(path, SHEET, {4: "x", 5: "y", 6: "z", 9: "w"})
+    xml = sheet_xml(path)
+    assert 't="inlineStr"' in xml
+    assert 'si="0"' not in xml and 'ref="A7:A9"' in xml
+    assert column_a(path) == {4: "x", 5: "y", 6: "z", 7: "=B7*2", 8: "=B8*2", 9: "w"}
+
+
+def test_patch_sheet_detects_orphaned_dependents():
+    class Styles:
+        def style_for(self, s):
+            return 0
+    xml = ('<worksheet><sheetData><row r="4">' + shared("A4:A5")(4) + '</row><row r="5">' + shared()(5) +
+           '</row></sheetData></worksheet>')
+    with pytest.raises(SharedFormulaError):
+        _patch_sheet(xml, {4: "x"}, Styles())
+    assert _patch_sheet(xml, {4: "x", 5: "y"}, Styles())[1] is True